@@ -1,30 +1,176 @@
 import streamlit as st
 import time
-import numpy as np
 
 MAX_REROUTE_DISTANCE = 800  # meters (emergency operational limit)
-MIN_PRESSURE_REQUIRED = 80 # minimum safe pressure
 
 # ---------------------------
 # FAILURE CONTROL (FOR DEMO)
 # ---------------------------
 #FAILURE_THRESHOLD = 0.35
 
-from digital_twin import create_digital_twin
+from digital_twin import create_digital_twin, network_fingerprint
 from models.network_generator import generate_network
-from models.seismic_model import seismic_stress
+from models.spatial_index import pipes_within, set_epicenter
+from models.hydraulic_model import MIN_PRESSURE_REQUIRED
+from models.flow_allocation import flow_allocation
 #from models.risk_model import compute_risk
-from models.routing_model import compute_routes
-from models.allocation_model import allocate_water
-from models.auto_rerouting import auto_reroute
-from models.time_simulation import temporal_stress
-from models.ml_failure_model import predict_failure_probability
+from ensemble import run_ensemble
+from fragility import fragility_sweep
+from simulation import HYDRAULICS, TIME_STEPS, simulate, precompute_frames, frame_state, supply_total
 
 
-from visualization import plot_water_network, plot_failure_heatmap
-from visualization_gis import plot_gis_network
-from metrics import compute_metrics
-from export import export_results
+from visualization import plot_water_network, plot_failure_heatmap, plot_fragility_surface, FRAGILITY_LABELS
+from visualization_gis import network_center, plot_gis_network, viewport_extent
+from export import EXPORT_DIR, export_frame, export_time_series, scenario_name
+import instrumentation
+from instrumentation import span
+
+# ===========================
+# 🔹 CACHED PIPELINE STAGES
+# ===========================
+# Every stage is keyed by (network key, magnitude, time_step), with the
+# network key being (network content hash, epicenter), and by the
+# service definition (connectivity, or pressure with hydraulics) where
+# it produces service results, so a rerun only recomputes what its
+# inputs changed and revisiting a scenario is instant. Cached graphs,
+# results and figures are shared between sessions and reruns and are
+# read-only: stages and page code only read them, and whatever has to
+# write (e.g. the capacity-aware allocation) works on its own copy.
+TWIN_CACHE_SIZE = 4
+SCENARIO_CACHE_SIZE = 64
+
+# The server is shared: ensembles get a few worker processes, not one per CPU
+ENSEMBLE_WORKERS = 2
+
+
+@st.cache_resource(max_entries=TWIN_CACHE_SIZE)
+def load_twin(network_key):
+    """
+    Builds the digital twin for network_key: (hash of the network
+    files, epicenter or None).
+    """
+    _, epicenter = network_key
+    with span("create_digital_twin"):
+        G_before = create_digital_twin()
+        set_epicenter(G_before, epicenter)
+
+    # ---------------------------------
+    # GEO-BASED NODE POSITIONS (lat/lon)
+    # ---------------------------------
+    fixed_pos = {
+        n: (d.get("lon"), d.get("lat"))
+        for n, d in G_before.nodes(data=True)
+        if d.get("lon") is not None and d.get("lat") is not None
+    }
+
+    return G_before, fixed_pos
+
+
+@st.cache_resource(max_entries=SCENARIO_CACHE_SIZE)
+def run_scenario(network_key, magnitude, time_step, hydraulics):
+    """
+    Failure scoring, thresholding, rerouting, routing, allocation and
+    metrics for one scenario.
+    """
+    G_before, _ = load_twin(network_key)
+    return simulate(G_before, magnitude, time_step, hydraulics=hydraulics)
+
+
+@st.cache_resource(max_entries=TWIN_CACHE_SIZE)
+def build_timeline(network_key, magnitude, hydraulics):
+    """
+    All time steps of one magnitude, stored as per-step deltas.
+    """
+    G_before, _ = load_twin(network_key)
+    return precompute_frames(G_before, magnitude, TIME_STEPS, hydraulics=hydraulics)
+
+
+@st.cache_resource(max_entries=SCENARIO_CACHE_SIZE)
+def load_frame(network_key, magnitude, time_step, hydraulics):
+    G_before, _ = load_twin(network_key)
+    return frame_state(build_timeline(network_key, magnitude, hydraulics), G_before, time_step)
+
+
+def cached_scenario(network_key, magnitude, time_step, precomputed, hydraulics):
+    """
+    The shared cached result; read-only.
+    """
+    if precomputed:
+        return load_frame(network_key, magnitude, time_step, hydraulics)
+    return run_scenario(network_key, magnitude, time_step, hydraulics)
+
+
+@st.cache_data(max_entries=SCENARIO_CACHE_SIZE)
+def run_ensemble_bands(network_key, magnitude, time_step, n_samples, hydraulics):
+    G_before, _ = load_twin(network_key)
+    return run_ensemble(
+        G_before, magnitude, time_step,
+        n_samples=n_samples, n_workers=ENSEMBLE_WORKERS, hydraulics=hydraulics
+    )
+
+
+@st.cache_data(max_entries=SCENARIO_CACHE_SIZE)
+def run_flow_allocation(network_key, magnitude, time_step, precomputed, hydraulics):
+    """
+    Capacity-aware allocation of one scenario: delivery per priority
+    level, the bottleneck pipe ids and the volume resolution. Runs on a
+    copy, since the allocation caches its arrays in the graph and the
+    cached G_after may be a view sharing G_before's graph dict.
+    """
+    G_before, _ = load_twin(network_key)
+    G_after = cached_scenario(network_key, magnitude, time_step, precomputed, hydraulics)["G_after"].copy()
+    with span("flow_allocation"):
+        flows = flow_allocation(G_after, supply_total(G_before))
+
+    pipe_ids = [d.get("pipe_id") for _, _, d in G_after.edges(data=True)]
+    return {
+        "tiers": flows["tiers"],
+        "bottlenecks": [pipe_ids[i] for i in flows["bottlenecks"].tolist()],
+        "resolution": flows["resolution"]
+    }
+
+
+@st.cache_data(max_entries=TWIN_CACHE_SIZE)
+def run_fragility_sweep(network_key, hydraulics):
+    G_before, _ = load_twin(network_key)
+    with span("fragility_sweep"):
+        return fragility_sweep(G_before, keep_exceedance=False, hydraulics=hydraulics)
+
+
+@st.cache_resource(max_entries=TWIN_CACHE_SIZE)
+def build_before_figure(network_key):
+    G_before, fixed_pos = load_twin(network_key)
+    with span("plot_before"):
+        return plot_water_network(G_before, fixed_pos, title="Before Earthquake")
+
+
+@st.cache_resource(max_entries=SCENARIO_CACHE_SIZE)
+def build_scenario_figures(network_key, magnitude, time_step, precomputed, hydraulics):
+    _, fixed_pos = load_twin(network_key)
+    G_after = cached_scenario(network_key, magnitude, time_step, precomputed, hydraulics)["G_after"]
+
+    with span("plot_water_network"):
+        after = plot_water_network(G_after, fixed_pos, title="After Earthquake & Rerouting")
+    with span("plot_failure_heatmap"):
+        heatmap = plot_failure_heatmap(G_after)
+
+    return {"after": after, "heatmap": heatmap}
+
+
+@st.cache_resource(max_entries=SCENARIO_CACHE_SIZE)
+def build_gis_figure(network_key, magnitude, time_step, precomputed, hydraulics, zoom):
+    """
+    GIS map at zoom, centered on the epicenter (else the network), with
+    full detail inside that viewport.
+    """
+    G_before, _ = load_twin(network_key)
+    G_after = cached_scenario(network_key, magnitude, time_step, precomputed, hydraulics)["G_after"]
+    _, epicenter = network_key
+    center = epicenter if epicenter is not None else network_center(G_before)
+
+    with span("plot_gis_network"):
+        return plot_gis_network(G_after, zoom=zoom, extent=viewport_extent(center, zoom), center=center)
+
 
 # ---------------------------
 # PAGE CONFIG
@@ -32,6 +178,14 @@ from export import export_results
 st.set_page_config(layout="wide")
 st.title("🌍 Earthquake-Aware Water Distribution Digital Twin")
 
+# Per-frame stage timings (cached stages only show up on a cache miss),
+# switched per session: the toggle's state lives in st.session_state
+# and only this session's frame is profiled
+profiling = st.sidebar.toggle(
+    "⏱ Profile frame timings", value=instrumentation.is_enabled(), key="profiling"
+)
+instrumentation.start_frame("app", enabled=profiling)
+
 # ===========================
 # 🔹 SIDEBAR — NETWORK CONFIG
 # ===========================
@@ -43,14 +197,34 @@ network_mode = st.sidebar.radio(
 )
 
 if network_mode == "Auto-Generated":
-    n_nodes = st.sidebar.slider("Number of Nodes", 10, 100, 25)
+    n_nodes = st.sidebar.number_input("Number of Nodes", 10, 5_000_000, 25, step=100)
+    seed = st.sidebar.number_input("Random Seed", 0, 2**31 - 1, 42)
 
     if st.sidebar.button("Generate Network"):
-        n_nodes_created, n_pipes_created = generate_network(n_nodes)
+        n_nodes_created, n_pipes_created = generate_network(int(n_nodes), seed=int(seed))
         st.sidebar.success(
             f"Generated {n_nodes_created} nodes & {n_pipes_created} pipes"
         )
 
+# Precompute every minute of the scenario once so the slider and
+# Play animation only index stored frames
+precompute = st.sidebar.checkbox("⚡ Precompute animation frames", value=False)
+
+# One service definition for every panel: connectivity to a source, or
+# also enough pressure (a hydraulic solve per scenario, per changed
+# time step, per realization)
+hydraulics = st.sidebar.checkbox("💧 Pressure-based service", value=HYDRAULICS)
+SERVICE_LABEL = "pressure (hydraulic solve)" if hydraulics else "connectivity to a source"
+st.sidebar.caption(f"Nodes count as served by {SERVICE_LABEL}")
+
+# Pipe distances from an epicenter instead of the pipe length proxy
+epicenter = None
+if st.sidebar.checkbox("🎯 Set Epicenter", value=False):
+    epicenter = (
+        st.sidebar.number_input("Epicenter Latitude", -90.0, 90.0, 23.26, format="%.4f"),
+        st.sidebar.number_input("Epicenter Longitude", -180.0, 180.0, 77.41, format="%.4f")
+    )
+
 # ---------------------------
 # SESSION STATE (MUST BE FIRST)
 # ---------------------------
@@ -68,18 +242,13 @@ colA, colB = st.columns(2)
 with colA:
     if st.button("▶ Play"):
         st.session_state.playing = True
+        if st.session_state.time >= TIME_STEPS[-1]:
+            st.session_state.time = 0
 
 with colB:
     if st.button("⏸ Pause"):
         st.session_state.playing = False
 
-if st.session_state.playing:
-    st.session_state.time += 1
-    if st.session_state.time > 10:
-        st.session_state.time = 10
-    time.sleep(0.8)
-    st.rerun()
-
 # ---------------------------
 # USER INPUT
 # ---------------------------
@@ -87,155 +256,25 @@ magnitude = st.slider("Earthquake Magnitude", 4.0, 8.0, 6.5)
 time_step = st.slider("Simulation Time (minutes)", 0, 10, st.session_state.time)
 
 # ---------------------------
-# CREATE DIGITAL TWIN
+# RUN (OR REUSE) THE SCENARIO
 # ---------------------------
-G_before = create_digital_twin()
-G_after = G_before.copy()
-
-# ---------------------------------
-# GEO-BASED NODE POSITIONS (lat/lon)
-# ---------------------------------
-fixed_pos = {
-    n: (d.get("lon"), d.get("lat"))
-    for n, d in G_before.nodes(data=True)
-    if d.get("lon") is not None and d.get("lat") is not None
-}
-
-
-# ---------------------------
-# ML FEATURE MAPS
-# ---------------------------
-material_score = {
-    "CI": 0.8,
-    "DI": 0.5,
-    "PVC": 0.3
-}
-
-soil_score = {
-    "clay": 0.7,
-    "sand": 0.8,
-    "silt": 0.75,
-    "rock": 0.3
-}
-
-
-#  VERY IMPORTANT GUARD
-if time_step == 0:
-    # No earthquake effects at time 0
-    G_after = G_before.copy()
-    G_operational = G_before.copy()
-    
-else:
-    # Earthquake effects start only after time > 0
-    G_after = G_before.copy()
-
-    for u, v, data in G_after.edges(data=True):
-        distance = data.get("length", np.random.uniform(50, 200)) / 100
-        base_stress = seismic_stress(magnitude, distance, data['soil'])
-        stress = temporal_stress(base_stress, time_step)
-
-        failure_prob = predict_failure_probability(
-            stress,
-            data['age'],
-            material_score.get(data['material'], 0.6),
-            soil_score.get(data['soil'], 0.4)
-        )
-
-        # ---------------------------------
-        # BACKBONE PIPE PROTECTION
-        # ---------------------------------
-        if data.get("pressure_cap", 0) > 100:
-            failure_prob *= 0.85
-
-        # Time-based progressive damage
-        failure_prob = min(
-            1.0,
-            failure_prob * (1 + 0.05 * time_step)
-        )
-
-        # ---------------------------------
-        # SAFETY CLAMP (VERY IMPORTANT)
-        # ---------------------------------
-        failure_prob = max(0.05, min(1.0, failure_prob))
-
-        data['stress'] = stress
-        data['failure_prob'] = failure_prob
-
-        # ---------------------------------
-        # DYNAMIC FAILURE THRESHOLD (Finds the top 30% most risky)
-        # ---------------------------------
-        
-    all_failure_probs = [
-        d["failure_prob"]
-        for _, _, d in G_after.edges(data=True)
-    ]
-
-    if all_failure_probs:
-        raw_threshold = np.percentile(all_failure_probs, 70)
-
-        # ---- SAFETY CLAMP ----
-        FAILURE_THRESHOLD = min(raw_threshold, 0.65)
-    else:
-        FAILURE_THRESHOLD = 0.6
-   
-    
-    st.write(f"🔴 Dynamic Failure Threshold: {FAILURE_THRESHOLD:.2f}")
-
-
-    for u, v, data in G_after.edges(data=True):
-        data["status"] = (
-            "failed"
-            if data["failure_prob"] > FAILURE_THRESHOLD
-            else "healthy"
-        )
-
-    # Remove failed pipes ONLY after time > 0
-    G_operational = G_after.copy()
-    failed_edges = [
-        (u, v)
-        for u, v, d in G_after.edges(data=True)
-        if d['status'] == 'failed'
-    ]
-    G_operational.remove_edges_from(failed_edges)
+network_key = (network_fingerprint(), epicenter)
 
-    # Automatic rerouting
-    G_operational = auto_reroute(G_operational)
+if epicenter is not None:
+    radius = st.sidebar.slider("Epicenter Radius (km)", 0.1, 10.0, 1.0)
+    near = pipes_within(load_twin(network_key)[0], epicenter, radius)
+    st.sidebar.caption(f"{len(near)} pipes within {radius:g} km of the epicenter")
 
-    # Copy rerouted edges back for display
-    for u, v, d in G_operational.edges(data=True):
-        if d.get("status") == "rerouted":
-            G_after.add_edge(
-                u, v,
-                length=d.get("length", 100),
-                material=d.get("material", "PVC"),
-                soil=d.get("soil", "sand"),
-                age=0,
-                status="rerouted"
-            )
+with span("scenario"):
+    scenario = cached_scenario(network_key, magnitude, time_step, precompute, hydraulics)
+with span("figures"):
+    figures = build_scenario_figures(network_key, magnitude, time_step, precompute, hydraulics)
 
+routes = scenario["routes"]
+metrics = scenario["metrics"]
 
-    # DO NOT REMOVE FAILED NODES
-    for u, v in failed_edges:
-        G_after.edges[u, v]["status"] = "failed"
-
-# ---------------------------
-# CRITICAL NODES
-# ---------------------------
-critical_nodes = [
-    n for n in G_operational.nodes
-    if G_operational.nodes[n].get('priority', 0) >= 4
-]
-
-# ---------------------------
-# ROUTING + WATER ALLOCATION
-# ---------------------------
-routes = compute_routes(G_operational, "N1", critical_nodes)
-allocation = allocate_water(G_operational, 500)
-
-# ---------------------------
-# METRICS
-# ---------------------------
-metrics = compute_metrics(G_before, G_after, critical_nodes)
+if scenario["threshold"] is not None:
+    st.write(f"🔴 Dynamic Failure Threshold: {scenario['threshold']:.2f}")
 
 # ---------------------------
 # NETWORK VISUALIZATION
@@ -245,13 +284,13 @@ col1, col2 = st.columns(2)
 with col1:
     st.subheader("Before Earthquake")
     st.plotly_chart(
-    plot_water_network(G_before, fixed_pos, title="Before Earthquake"),
+    build_before_figure(network_key),
     use_container_width=True
 )
 with col2:
     st.subheader("After Earthquake & Rerouting")
     st.plotly_chart(
-    plot_water_network(G_after, fixed_pos, title="After Earthquake & Rerouting"),
+    figures["after"],
     use_container_width=True
 )
 
@@ -259,13 +298,16 @@ with col2:
 # GIS MAP
 # ---------------------------
 st.subheader("🗺️ GIS-Based Water Network")
-st.plotly_chart(plot_gis_network(G_after), use_container_width=True)
+map_zoom = st.slider("Map Zoom", 8, 18, 14)
+with span("gis_figure"):
+    gis_figure = build_gis_figure(network_key, magnitude, time_step, precompute, hydraulics, map_zoom)
+st.plotly_chart(gis_figure, use_container_width=True)
 
 # ---------------------------
 # FAILURE HEATMAP
 # ---------------------------
 st.subheader("🔥 Failure Probability Heatmap")
-st.plotly_chart(plot_failure_heatmap(G_after), use_container_width=True)
+st.plotly_chart(figures["heatmap"], use_container_width=True)
 
 # ---------------------------
 # ROUTES
@@ -282,15 +324,112 @@ for node, path in routes.items():
 # ---------------------------
 st.subheader("📊 System Performance Metrics")
 
-m1, m2, m3 = st.columns(3)
+m1, m2, m3, m4 = st.columns(4)
 m1.metric("Failed Pipes", metrics["failed_pipes"])
 m2.metric("Critical Nodes Served (%)", metrics["critical_service_ratio"])
 m3.metric("Connectivity Loss (%)", metrics["critical_connectivity_loss"])
+m4.metric(
+    "Low-Pressure Nodes", metrics["low_pressure_nodes"],
+    help=f"Connected to a source but below {MIN_PRESSURE_REQUIRED} m of pressure"
+)
+if scenario["hydraulics"] is not None and not scenario["hydraulics"]["converged"]:
+    st.warning("The hydraulic solve did not converge; pressures are approximate.")
+
+# ---------------------------
+# MONTE CARLO ENSEMBLE
+# ---------------------------
+with st.expander("🎲 Monte Carlo Ensemble"):
+    st.caption(f"Service judged by {SERVICE_LABEL}, as in the metrics above")
+    n_samples = st.number_input("Realizations", 100, 100000, 1000, step=100)
+
+    if st.button("Run Ensemble"):
+        bands = run_ensemble_bands(network_key, magnitude, time_step, int(n_samples), hydraulics)
+
+        e1, e2 = st.columns(2)
+        for col, key, label in (
+            (e1, "critical_service_ratio", "Critical Nodes Served (%)"),
+            (e2, "unserved_demand", "Unserved Demand")
+        ):
+            band = bands[key]
+            col.metric(f"{label} — median", round(band[50], 2))
+            col.caption(f"P5–P95: {band[5]:.2f} – {band[95]:.2f}")
+
+# ---------------------------
+# CAPACITY-AWARE ALLOCATION
+# ---------------------------
+with st.expander("🚰 Capacity-Aware Allocation"):
+    st.caption("Supply routed within pipe capacities (pressure_cap), highest priority first")
+
+    if st.button("Run Allocation"):
+        flows = run_flow_allocation(network_key, magnitude, time_step, precompute, hydraulics)
+        st.dataframe([
+            {"Priority": level, "Demand": round(demand, 2), "Delivered": round(delivered, 2)}
+            for level, demand, delivered in flows["tiers"]
+        ])
+        st.caption(f"Volumes counted in steps of {flows['resolution']:g}")
+
+        if flows["bottlenecks"]:
+            st.warning(f"Bottleneck pipes: {', '.join(map(str, flows['bottlenecks']))}")
+        else:
+            st.success("No open pipe is running at capacity")
+
+# ---------------------------
+# FRAGILITY SURFACE
+# ---------------------------
+with st.expander("📈 Fragility Surface"):
+    metric = st.selectbox(
+        "Metric",
+        list(FRAGILITY_LABELS),
+        format_func=FRAGILITY_LABELS.get
+    )
+    st.caption(f"Service judged by {SERVICE_LABEL}, as in the metrics above")
+
+    if st.button("Run Magnitude × Time Sweep"):
+        sweep = run_fragility_sweep(network_key, hydraulics)
+        st.plotly_chart(plot_fragility_surface(sweep, metric), use_container_width=True)
 
 # ---------------------------
 # EXPORT
 # ---------------------------
+# This frame's pipes and nodes, as partitions of the same tables
 if st.button("📤 Export Results"):
-    df = export_results(G_after)
-    st.success("Results exported!")
-    st.dataframe(df)
\ No newline at end of file
+    with span("export_frame"):
+        paths = export_frame(scenario, scenario_name(magnitude), time_step)
+    st.success(f"Wrote {', '.join(paths.values())}")
+
+# Every minute of the scenario, streamed to partitioned Parquet files
+if st.button("🗂 Export Time Series"):
+    G_before, _ = load_twin(network_key)
+    with span("export_time_series"):
+        paths = export_time_series(G_before, magnitude, TIME_STEPS, hydraulics=hydraulics)
+    st.success(f"Wrote {len(paths)} files to {EXPORT_DIR}/")
+
+# ---------------------------
+# FRAME TIMINGS
+# ---------------------------
+frame_record = instrumentation.end_frame()
+
+if frame_record is not None:
+    with st.expander(f"⏱ Frame timings — {frame_record['total'] * 1000:.1f} ms"):
+        st.dataframe([
+            {
+                "stage": "  " * s["depth"] + s["name"],
+                "start (ms)": round(s["start"] * 1000, 2),
+                "time (ms)": round(s["seconds"] * 1000, 2)
+            }
+            for s in sorted(frame_record["spans"], key=lambda s: s["start"])
+        ])
+        if frame_record["counters"]:
+            st.json(frame_record["counters"])
+
+# ---------------------------
+# PLAY: NEXT FRAME
+# ---------------------------
+# Advanced only once this frame is fully drawn, so every minute shows
+if st.session_state.playing:
+    if time_step < TIME_STEPS[-1]:
+        time.sleep(0.8)
+        st.session_state.time = time_step + 1
+        st.rerun()
+    else:
+        st.session_state.playing = False
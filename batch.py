@@ -0,0 +1,235 @@
+"""
+Headless batch runner: simulates a list of scenarios without the
+Streamlit app or any plotting modules and writes their results.
+
+    python batch.py scenarios.csv                  # magnitude,time_step[,scenario] rows
+    python batch.py scenarios.jsonl --workers 4 --format csv
+    python batch.py --magnitudes 5 6.5 8 --time-steps 0 5 10
+    python batch.py scenarios.csv --epicenter 23.26 77.41 --epicenter 23.30 77.45
+    python batch.py --magnitudes 6.5 --allocation max_flow
+    python batch.py --magnitudes 6.5 --compact     # array-backed network
+
+Every scenario appends one JSON line of metrics to the summary file
+and, unless --summary-only, writes its pipes and nodes partitions
+under --output (see export.py). --nodes and --pipes default to the
+bundled network, wherever the runner is started from.
+
+Partitions are named by scenario and time step. A default scenario name
+is the magnitude plus every non-default run option (e.g.
+M6.5-max_flow-epi_23.26_77.41), so runs with different options keep
+their own partitions. A run whose list names the same (scenario,
+time_step) twice is refused.
+
+Start-up: importing the pipeline (pandas, scipy, networkx) takes about
+0.5 s, paid by every process including each worker, so short scenario
+lists run fastest with the default --workers 1.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from digital_twin import NODES_PATH, PIPES_PATH, create_compact_twin, create_digital_twin
+from models.spatial_index import set_epicenter
+from models.allocation_model import ALLOCATION_MODES
+from simulation import ALLOCATION, HYDRAULICS, SOURCE, TOTAL_SUPPLY, simulate
+from export import EXPORT_DIR, EXPORT_FORMATS, export_frame, scenario_name
+
+SUMMARY_FILE = "summary.jsonl"
+
+
+def run_suffix(args):
+    """
+    Name suffix of the run options that differ from their defaults.
+    """
+    parts = []
+    if args.allocation != ALLOCATION:
+        parts.append(args.allocation)
+    if args.hydraulics != HYDRAULICS:
+        parts.append("pressure" if args.hydraulics else "connectivity")
+    if args.source != SOURCE:
+        parts.append("src_" + "+".join(args.source))
+    if args.total_supply is not None:
+        parts.append(f"supply_{args.total_supply:g}")
+    if args.epicenter:
+        parts.append("epi_" + "+".join(f"{lat:g}_{lon:g}" for lat, lon in args.epicenter))
+    return "".join("-" + part for part in parts)
+
+
+def duplicate_partitions(scenarios):
+    """
+    (scenario, time_step) pairs listed more than once.
+    """
+    seen, duplicates = set(), []
+    for spec in scenarios:
+        key = (spec["scenario"], spec["time_step"])
+        if key in seen and key not in duplicates:
+            duplicates.append(key)
+        seen.add(key)
+    return duplicates
+
+
+def read_scenarios(path, suffix=""):
+    """
+    Scenario list from a CSV (header row) or JSON lines file. Each
+    scenario needs magnitude and time_step; scenario (name) is optional,
+    by default the magnitude's name plus suffix.
+    """
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".json")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    scenarios = []
+    for row in rows:
+        magnitude = float(row["magnitude"])
+        scenarios.append({
+            "scenario": row.get("scenario") or scenario_name(magnitude) + suffix,
+            "magnitude": magnitude,
+            "time_step": int(row["time_step"])
+        })
+    return scenarios
+
+
+def grid_scenarios(magnitudes, time_steps, suffix=""):
+    return [
+        {"scenario": scenario_name(m) + suffix, "magnitude": m, "time_step": t}
+        for m, t in itertools.product(magnitudes, time_steps)
+    ]
+
+
+# Set once per process (worker initializer or in-process run)
+_job = None
+
+
+def _init_worker(job):
+    global _job
+    build = create_compact_twin if job["compact"] else create_digital_twin
+    G_before = build(job["nodes"], job["pipes"])
+    set_epicenter(G_before, job["epicenter"])
+    _job = dict(job, G_before=G_before)
+
+
+def run_scenario(spec):
+    """
+    Simulates one scenario with the loaded twin and returns its summary row.
+    """
+    start = time.perf_counter()
+    result = simulate(
+        _job["G_before"],
+        spec["magnitude"],
+        spec["time_step"],
+        source=_job["source"],
+        total_supply=_job["total_supply"],
+        hydraulics=_job["hydraulics"],
+        allocation_mode=_job["allocation"]
+    )
+
+    if not _job["summary_only"]:
+        export_frame(
+            result, spec["scenario"], spec["time_step"],
+            output_dir=_job["output"], fmt=_job["format"], source=_job["source"]
+        )
+
+    threshold = result["threshold"]
+    row = {
+        **spec,
+        "threshold": None if threshold is None else float(threshold),
+        **result["metrics"]
+    }
+    flows = result["flows"]
+    if flows is not None:
+        row["delivered"] = round(float(flows["delivered"].sum()), 6)
+        row["bottleneck_pipes"] = len(flows["bottlenecks"])
+    row["seconds"] = round(time.perf_counter() - start, 6)
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="?", help="CSV or JSON lines scenario list")
+    parser.add_argument("--magnitudes", type=float, nargs="+", help="grid mode: magnitudes")
+    parser.add_argument("--time-steps", type=int, nargs="+", default=[5], help="grid mode: time steps")
+    parser.add_argument("--nodes", default=NODES_PATH)
+    parser.add_argument("--pipes", default=PIPES_PATH)
+    parser.add_argument("--source", action="append", default=SOURCE,
+                        help="supply source node (repeat for several; default: the twin's sources)")
+    parser.add_argument("--total-supply", type=float,
+                        help=f"default: the sources' capacity, else {TOTAL_SUPPLY}")
+    parser.add_argument("--allocation", choices=ALLOCATION_MODES, default=ALLOCATION,
+                        help="max_flow: respect pipe capacities and serve priority first")
+    parser.add_argument("--hydraulics", action="store_true", default=HYDRAULICS,
+                        help="also count nodes below the minimum pressure as unserved")
+    parser.add_argument("--epicenter", type=float, nargs=2, action="append", metavar=("LAT", "LON"),
+                        help="measure pipe distances from this epicenter (repeat for aftershocks)")
+    parser.add_argument("--compact", action="store_true",
+                        help="simulate on the compact array-backed network (less memory, same results)")
+    parser.add_argument("--output", default=EXPORT_DIR)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="parquet")
+    parser.add_argument("--summary", help=f"summary file (default: <output>/{SUMMARY_FILE})")
+    parser.add_argument("--summary-only", action="store_true", help="skip the per-pipe/per-node tables")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    suffix = run_suffix(args)
+    if args.scenarios:
+        scenarios = read_scenarios(args.scenarios, suffix)
+    elif args.magnitudes:
+        scenarios = grid_scenarios(args.magnitudes, args.time_steps, suffix)
+    else:
+        parser.error("give a scenario file or --magnitudes")
+
+    if not scenarios:
+        print("No scenarios to run")
+        return 0
+
+    # Same partition twice: the later scenario would overwrite the earlier
+    duplicates = duplicate_partitions(scenarios)
+    if duplicates:
+        parser.error("scenarios write the same partitions: " + ", ".join(
+            f"{name} at time_step {t}" for name, t in duplicates
+        ) + "; give them distinct scenario names")
+
+    job = {
+        "nodes": args.nodes,
+        "pipes": args.pipes,
+        "source": args.source,
+        "total_supply": args.total_supply,
+        "allocation": args.allocation,
+        "hydraulics": args.hydraulics,
+        "compact": args.compact,
+        "epicenter": args.epicenter,
+        "output": args.output,
+        "format": args.format,
+        "summary_only": args.summary_only
+    }
+
+    summary_path = args.summary or os.path.join(args.output, SUMMARY_FILE)
+    os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+
+    with open(summary_path, "a") as summary:
+        if args.workers <= 1 or len(scenarios) == 1:
+            _init_worker(job)
+            rows = map(run_scenario, scenarios)
+            for row in rows:
+                summary.write(json.dumps(row) + "\n")
+        else:
+            with ProcessPoolExecutor(
+                max_workers=min(args.workers, len(scenarios)),
+                initializer=_init_worker,
+                initargs=(job,)
+            ) as pool:
+                for row in pool.map(run_scenario, scenarios):
+                    summary.write(json.dumps(row) + "\n")
+
+    print(f"{len(scenarios)} scenarios written to {summary_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+Scaling benchmark for every simulation stage.
+
+Generates networks of increasing size, times each stage separately
+(best of --repeats runs) and records its peak traced memory in a
+separate run, then writes a JSON results file and compares it
+against a stored baseline.
+
+    python benchmark.py                          # 100, 1k, 10k, 100k nodes
+    python benchmark.py --sizes 100 1000 --save-baseline
+    python benchmark.py --baseline benchmark_baseline.json --tolerance 0.25
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from digital_twin import create_digital_twin
+from models.network_generator import generate_network
+from models.failure_scoring import score_network
+from models.auto_rerouting import auto_reroute
+from models.routing_model import compute_routes
+from models.allocation_model import allocate_water
+from models.connectivity import invalidate, operational_view, set_pipe_status
+from simulation import SOURCE, TOTAL_SUPPLY, failure_threshold
+from metrics import compute_metrics
+from export import export_frame
+from visualization import plot_water_network, plot_failure_heatmap
+from visualization_gis import plot_gis_network
+
+DEFAULT_SIZES = [100, 1_000, 10_000, 100_000]
+RESULTS_PATH = "benchmark_results.json"
+BASELINE_PATH = "benchmark_baseline.json"
+
+# A stage regresses when it is this much slower than the baseline
+# (relative) and also slower by at least MIN_REGRESSION_SECONDS.
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.01
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def measure(setup, run, repeats):
+    """
+    Best wall time of run(*setup()) over repeats, then one extra
+    traced run for peak memory. setup() is not timed.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        args = setup()
+        start = time.perf_counter()
+        run(*args)
+        best = min(best, time.perf_counter() - start)
+
+    args = setup()
+    tracemalloc.start()
+    try:
+        run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return best, peak / 2**20
+
+
+def uncached(G):
+    """
+    Setup that drops cached reachability so stages pay their full cost.
+    """
+    def setup():
+        invalidate(G)
+        return ()
+    return setup
+
+
+def apply_threshold(G, failure_probs):
+    threshold = failure_threshold(failure_probs)
+    set_pipe_status(G, None, [
+        "failed" if d["failure_prob"] > threshold else "healthy"
+        for _, _, d in G.edges(data=True)
+    ])
+    return threshold
+
+
+def benchmark_size(n_nodes, workdir, magnitude, time_step, repeats, stages=None):
+    """
+    Times every stage on one generated network. Returns result rows.
+    """
+    # Keep node density constant as the network grows
+    radius = 0.01 * (n_nodes / 25) ** 0.5
+    _, n_pipes = generate_network(
+        n_nodes, radius=radius, seed=n_nodes,
+        output_dir=workdir, formats=("parquet",)
+    )
+    nodes_path = os.path.join(workdir, "nodes.parquet")
+    pipes_path = os.path.join(workdir, "pipes.parquet")
+
+    # Prepared inputs for each stage (built once, outside the timings)
+    G_before = create_digital_twin(nodes_path, pipes_path)
+    G_after = G_before.copy()
+    failure_probs = score_network(G_after, magnitude, time_step)
+    apply_threshold(G_after, failure_probs)
+    auto_reroute(G_after, SOURCE)
+    G_operational = operational_view(G_after)
+    critical_nodes = [n for n, d in G_operational.nodes(data=True) if d.get("priority", 0) >= 4]
+    frame = {
+        "G_after": G_after,
+        "routes": compute_routes(G_operational, SOURCE, critical_nodes),
+        "allocation": allocate_water(G_operational, TOTAL_SUPPLY, SOURCE)
+    }
+    pos = {n: (d["lon"], d["lat"]) for n, d in G_before.nodes(data=True)}
+
+    plan = [
+        ("create_digital_twin", lambda: (), lambda: create_digital_twin(nodes_path, pipes_path)),
+        ("failure_scoring", lambda: (G_before.copy(),), lambda G: score_network(G, magnitude, time_step)),
+        ("thresholding", lambda: (), lambda: apply_threshold(G_after, failure_probs)),
+        ("auto_reroute", lambda: (G_after.copy(),), lambda G: auto_reroute(G, SOURCE)),
+        ("compute_routes", lambda: (), lambda: compute_routes(G_operational, SOURCE, critical_nodes)),
+        ("allocate_water", uncached(G_operational), lambda: allocate_water(G_operational, TOTAL_SUPPLY, SOURCE)),
+        ("compute_metrics", uncached(G_after), lambda: compute_metrics(G_before, G_after, critical_nodes)),
+        ("export_frame", lambda: (), lambda: export_frame(frame, "benchmark", time_step)),
+        ("plot_water_network", lambda: (), lambda: plot_water_network(G_after, pos)),
+        ("plot_gis_network", lambda: (), lambda: plot_gis_network(G_after)),
+        ("plot_failure_heatmap", lambda: (), lambda: plot_failure_heatmap(G_after)),
+    ]
+
+    rows = []
+    for stage, setup, run in plan:
+        if stages and stage not in stages:
+            continue
+
+        # Stages that write files (export) do so inside the scratch dir
+        with working_directory(workdir):
+            seconds, peak_mb = measure(setup, run, repeats)
+
+        rows.append({
+            "nodes": n_nodes,
+            "pipes": n_pipes,
+            "stage": stage,
+            "seconds": round(seconds, 6),
+            "peak_mb": round(peak_mb, 3)
+        })
+        print(f"{n_nodes:>9} nodes  {stage:<22} {seconds:10.4f} s  {peak_mb:10.2f} MB", flush=True)
+
+    return rows
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns the (size, stage) rows that regressed against the baseline.
+    """
+    reference = {(r["nodes"], r["stage"]): r for r in baseline["results"]}
+    regressions = []
+
+    for row in results["results"]:
+        base = reference.get((row["nodes"], row["stage"]))
+        if base is None:
+            continue
+
+        slower = row["seconds"] - base["seconds"]
+        if row["seconds"] > base["seconds"] * (1 + tolerance) and slower > MIN_REGRESSION_SECONDS:
+            regressions.append({
+                **row,
+                "baseline_seconds": base["seconds"],
+                "ratio": round(row["seconds"] / base["seconds"], 2) if base["seconds"] else None
+            })
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--stages", nargs="+", help="only run these stages")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--magnitude", type=float, default=6.5)
+    parser.add_argument("--time-step", type=int, default=5)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="also store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "magnitude": args.magnitude,
+            "time_step": args.time_step,
+            "repeats": args.repeats
+        },
+        "results": []
+    }
+
+    for n_nodes in args.sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            results["results"] += benchmark_size(
+                n_nodes, workdir, args.magnitude, args.time_step, args.repeats, args.stages
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+
+    for r in regressions:
+        print(
+            f"REGRESSION {r['nodes']} nodes {r['stage']}: "
+            f"{r['seconds']:.4f} s vs {r['baseline_seconds']:.4f} s baseline"
+        )
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3 @@
+# Tests live in tests/. test_generator.py is a manual script that
+# rewrites data/, so it is not collected.
+collect_ignore = ["test_generator.py"]
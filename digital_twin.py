@@ -1,44 +1,159 @@
+import os
+import hashlib
 import numpy as np
 import networkx as nx
 import pandas as pd
 
-def create_digital_twin():
+from models.compact_network import from_tables
+from models.connectivity import set_sources
+
+# The bundled network, found from any working directory
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+NODES_PATH = os.path.join(DATA_DIR, "nodes.csv")
+PIPES_PATH = os.path.join(DATA_DIR, "pipes.csv")
+
+PRESSURE_CAPS = [60, 80, 120, 150]
+PRESSURE_CAP_SEED = 42   # fixed so the same files always give the same twin
+
+# Content hashes by (path, size, mtime) of the files, so unchanged
+# files are not read again
+_fingerprints = {}
+
+def network_fingerprint(nodes_path=NODES_PATH, pipes_path=PIPES_PATH):
+    """
+    Content hash of the network files, used as a cache key. The files
+    are only hashed again when their path, size or mtime changes.
+    """
+    paths = (nodes_path, pipes_path)
+    signature = tuple(
+        (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        for path, stat in zip(paths, map(os.stat, paths))
+    )
+
+    if signature not in _fingerprints:
+        h = hashlib.sha256()
+        for path in paths:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+        _fingerprints.clear()
+        _fingerprints[signature] = h.hexdigest()
+
+    return _fingerprints[signature]
+
+def read_table(path):
+    """
+    Reads a network table from CSV or Parquet (by file extension).
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".parquet", ".pq"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+def table_sources(nodes):
+    """
+    Supply sources of a nodes table: {node: capacity} for nodes with a
+    positive "capacity", or None if the table has no such column.
+    """
+    if "capacity" not in nodes:
+        return None
+    capacity = pd.to_numeric(nodes["capacity"], errors="coerce").fillna(0)
+    is_source = capacity > 0
+    return dict(zip(nodes["node_id"][is_source].tolist(), capacity[is_source].tolist())) or None
+
+def create_digital_twin(nodes_path=NODES_PATH, pipes_path=PIPES_PATH, seed=PRESSURE_CAP_SEED):
     G = nx.Graph()
 
-    nodes = pd.read_csv("data/nodes.csv")
-    pipes = pd.read_csv("data/pipes.csv")
+    nodes = read_table(nodes_path)
+    pipes = read_table(pipes_path)
 
     # -------------------------
-    # ADD NODES
+    # ADD NODES (bulk, column-wise)
     # -------------------------
+    lat = nodes["lat"].tolist()
+    lon = nodes["lon"].tolist()
 
-    for _, n in nodes.iterrows():
-        G.add_node(
-    n['node_id'],
-    pos=(n['lon'], n['lat']),
-    lat=n['lat'],
-    lon=n['lon'],
-    priority=n['priority'],
-    type=n['type'],
-    demand=n['demand']
-)
+    G.add_nodes_from(
+        (
+            node_id,
+            {
+                "pos": (x, y),
+                "lat": y,
+                "lon": x,
+                "priority": priority,
+                "type": node_type,
+                "demand": demand
+            }
+        )
+        for node_id, x, y, priority, node_type, demand in zip(
+            nodes["node_id"].tolist(),
+            lon,
+            lat,
+            nodes["priority"].tolist(),
+            nodes["type"].tolist(),
+            nodes["demand"].tolist()
+        )
+    )
 
     # -------------------------
     # ADD PIPES (WITH is_physical)
     # -------------------------
+    if "is_physical" in pipes:
+        is_physical = pipes["is_physical"].astype(bool).tolist()   # to show real pipes
+    else:
+        is_physical = [True] * len(pipes)
 
-    for _, p in pipes.iterrows():
-        G.add_edge(
-            p['from'], p['to'],
-            pipe_id=p['pipe_id'],
-            length=p['length'],
-            material=p['material'],
-            age=p['age'],
-            soil=p['soil'],
-            pressure_cap= np.random.choice([60, 80, 120, 150]),
-            status="healthy",
-            is_physical=bool(p.get("is_physical", 1)) #to show real pipes
+    rng = np.random.default_rng(seed)
+    pressure_cap = rng.choice(PRESSURE_CAPS, size=len(pipes)).tolist()
 
+    G.add_edges_from(
+        (
+            u, v,
+            {
+                "pipe_id": pipe_id,
+                "length": length,
+                "material": material,
+                "age": age,
+                "soil": soil,
+                "pressure_cap": cap,
+                "status": "healthy",
+                "is_physical": physical
+            }
         )
+        for pipe_id, u, v, length, material, age, soil, cap, physical in zip(
+            pipes["pipe_id"].tolist(),
+            pipes["from"].tolist(),
+            pipes["to"].tolist(),
+            pipes["length"].tolist(),
+            pipes["material"].tolist(),
+            pipes["age"].tolist(),
+            pipes["soil"].tolist(),
+            pressure_cap,
+            is_physical
+        )
+    )
+
+    # Reservoirs / treatment plants (otherwise the default source)
+    sources = table_sources(nodes)
+    if sources:
+        set_sources(G, sources)
+
+    return G
+
+def create_compact_twin(nodes_path=NODES_PATH, pipes_path=PIPES_PATH, seed=PRESSURE_CAP_SEED):
+    """
+    Same twin as create_digital_twin, built straight into the compact
+    array-backed network (see models/compact_network.py).
+    """
+    nodes = read_table(nodes_path)
+    pipes = read_table(pipes_path)
+
+    rng = np.random.default_rng(seed)
+    pressure_cap = rng.choice(PRESSURE_CAPS, size=len(pipes))
+
+    net = from_tables(nodes, pipes, pressure_cap)
 
-    return G
\ No newline at end of file
+    sources = table_sources(nodes)
+    if sources:
+        set_sources(net, sources)
+    return net
@@ -0,0 +1,225 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from metrics import mask_metrics
+from models.allocation_model import proportional_shares
+from models.failure_scoring import pipe_columns, score_pipes
+from models.connectivity import source_nodes
+from models.hydraulic_model import hydraulic_arrays, solve_arrays
+from simulation import HYDRAULICS, SOURCE, TOTAL_SUPPLY, supply_total
+from export import scenario_name, stream_partition
+
+# ==================================================
+# MONTE CARLO FAILURE ENSEMBLE
+# ==================================================
+# Instead of failing the top 30% riskiest pipes, every realization
+# fails each pipe independently with its failure_prob. Workers receive
+# the network once, as compact read-only arrays, and each chunk of
+# realizations gets its own seeded RNG stream, so results only depend
+# on the seed (not on the number of workers).
+#
+# Service is judged as in simulate: by connectivity, or with
+# hydraulics also by pressure (one solve per realization).
+ENSEMBLE_PERCENTILES = (5, 50, 95)
+CHUNK_SIZE = 250
+SAMPLE_COLUMNS = ("failed_pipes", "critical_service_ratio", "overall_service_ratio", "unserved_demand")
+
+
+def network_arrays(G, failure_prob, source=SOURCE, hydraulics=HYDRAULICS):
+    """
+    Flattens G into the integer/float arrays the ensemble works on
+    (with hydraulics, also its hydraulic_arrays).
+    """
+    nodes = list(G.nodes)
+    index = {n: i for i, n in enumerate(nodes)}
+
+    edges = list(G.edges)
+    u = np.fromiter((index[a] for a, _ in edges), dtype=np.int64, count=len(edges))
+    v = np.fromiter((index[b] for _, b in edges), dtype=np.int64, count=len(edges))
+
+    demand = np.array([G.nodes[n].get("demand", 0) for n in nodes], dtype=float)
+    priority = np.array([G.nodes[n].get("priority", 0) for n in nodes], dtype=float)
+
+    return {
+        "n_nodes": len(nodes),
+        "u": u,
+        "v": v,
+        "failure_prob": np.asarray(failure_prob, dtype=float),
+        "demand": demand,
+        "weight": demand * priority,
+        "critical": priority >= 4,
+        "sources": np.array([index[s] for s in source_nodes(G, source)], dtype=np.int64),
+        "hydraulic": hydraulic_arrays(G) if hydraulics else None
+    }
+
+
+def evaluate_realization(net, failed, total_supply=TOTAL_SUPPLY):
+    """
+    Connectivity, allocation and metrics for one set of failed pipes,
+    with the proportional_shares and mask_metrics kernels behind
+    allocate_water and compute_metrics.
+    """
+    keep = ~failed
+    n = net["n_nodes"]
+
+    if net["hydraulic"] is None:
+        graph = coo_matrix(
+            (np.ones(keep.sum(), dtype=np.int8), (net["u"][keep], net["v"][keep])),
+            shape=(n, n)
+        ).tocsr()
+        _, labels = connected_components(graph, directed=False)
+        supplied = np.isin(labels, labels[net["sources"]])
+        served, low_pressure = supplied, 0
+    else:
+        hydraulic = solve_arrays(net["hydraulic"], net["sources"], keep)
+        supplied, served = hydraulic["supplied"], hydraulic["served"]
+        low_pressure = int((supplied & ~served).sum())
+
+    allocation = proportional_shares(total_supply, net["weight"], supplied)
+    metrics = mask_metrics(int(failed.sum()), served, net["critical"], low_pressure)
+    return (
+        metrics["failed_pipes"],
+        metrics["critical_service_ratio"],
+        metrics["overall_service_ratio"],
+        np.maximum(net["demand"] - allocation, 0).sum()
+    )
+
+
+def _run_chunk(net, task):
+    seed, n_samples, total_supply = task
+    rng = np.random.default_rng(seed)
+
+    results = np.empty((n_samples, 4))
+    for i in range(n_samples):
+        failed = rng.random(len(net["failure_prob"])) < net["failure_prob"]
+        results[i] = evaluate_realization(net, failed, total_supply)
+
+    return results
+
+
+# Workers are spawned, not forked: forking a multithreaded host (e.g.
+# the Streamlit server) can copy held locks into the child and deadlock.
+# Set once per worker process by the pool initializer
+_network = None
+
+
+def _init_worker(arrays):
+    global _network
+    _network = arrays
+
+
+def _run_worker_chunk(task):
+    return _run_chunk(_network, task)
+
+
+def _sample_frames(chunks, collected):
+    """
+    Passes chunk results through to collected while yielding them as
+    DataFrames for the exporter, numbering realizations across chunks.
+    """
+    start = 0
+    for chunk in chunks:
+        collected.append(chunk)
+        frame = pd.DataFrame(chunk, columns=SAMPLE_COLUMNS)
+        frame.insert(0, "realization", np.arange(start, start + len(chunk)))
+        start += len(chunk)
+        yield frame
+
+
+def _bands(samples):
+    return {
+        "mean": float(samples.mean()),
+        **{p: float(np.percentile(samples, p)) for p in ENSEMBLE_PERCENTILES}
+    }
+
+
+def run_ensemble(
+    G_before,
+    magnitude,
+    time_step,
+    n_samples=1000,
+    n_workers=None,
+    seed=0,
+    total_supply=None,
+    source=SOURCE,
+    export_dir=None,
+    scenario=None,
+    export_format="parquet",
+    hydraulics=HYDRAULICS
+):
+    """
+    Samples pipe failures from failure_prob over n_samples realizations
+    and returns percentile bands of the service metrics.
+    n_workers=1 runs in-process; None uses one worker per CPU.
+
+    export_dir: if set, every realization's metrics are streamed to the
+    "ensemble" results table there as the chunks complete.
+    hydraulics: count nodes below the minimum pressure as unserved,
+    as simulate does.
+    """
+    if n_samples < 1:
+        raise ValueError("n_samples must be at least 1")
+
+    if time_step == 0:
+        # No earthquake effects at time 0
+        failure_prob = np.zeros(G_before.number_of_edges())
+    else:
+        _, failure_prob = score_pipes(
+            **pipe_columns(G_before),
+            magnitude=magnitude,
+            time_step=time_step
+        )
+
+    arrays = network_arrays(G_before, failure_prob, source, hydraulics)
+    total_supply = supply_total(G_before, source, total_supply)
+
+    # Fixed-size chunks with independent child seeds
+    sizes = [CHUNK_SIZE] * (n_samples // CHUNK_SIZE)
+    if n_samples % CHUNK_SIZE:
+        sizes.append(n_samples % CHUNK_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(s, size, total_supply) for s, size in zip(seeds, sizes)]
+
+    chunks = []
+
+    def collect(results):
+        if export_dir is None:
+            chunks.extend(results)
+            return
+        stream_partition(
+            _sample_frames(results, chunks),
+            "ensemble",
+            scenario_name(magnitude) if scenario is None else scenario,
+            time_step,
+            export_dir,
+            export_format
+        )
+
+    n_workers = n_workers or os.cpu_count() or 1
+    if n_workers == 1 or len(tasks) == 1:
+        collect(_run_chunk(arrays, t) for t in tasks)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(n_workers, len(tasks)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(arrays,)
+        ) as pool:
+            collect(pool.map(_run_worker_chunk, tasks))
+
+    samples = np.vstack(chunks)
+
+    return {
+        "n_samples": n_samples,
+        "failed_pipes": _bands(samples[:, 0]),
+        "critical_service_ratio": _bands(samples[:, 1]),
+        "overall_service_ratio": _bands(samples[:, 2]),
+        "unserved_demand": _bands(samples[:, 3]),
+        "samples": samples
+    }
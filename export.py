@@ -1,14 +1,330 @@
+import os
+import numpy as np
 import pandas as pd
 
-def export_results(G):
-    rows = []
-    for u, v, d in G.edges(data=True):
-        rows.append({
-            "pipe": f"{u}-{v}",
-            "status": d['status'],
-            "failure_probability": d.get('failure_prob', 0)
-        })
-
-    df = pd.DataFrame(rows)
-    df.to_csv("simulation_results.csv", index=False)
-    return df
\ No newline at end of file
+from models.compact_network import STATUS_NAMES, is_compact, node_positions
+from models.connectivity import reachable_nodes, supplied_mask
+
+# ===========================
+# 🔹 RESULTS EXPORT
+# ===========================
+# Results are written as one table per kind ("pipes", "nodes",
+# "ensemble"), partitioned Hive-style by scenario and time step:
+#
+#   results/pipes/scenario=M6.5/time_step=3/part-0.parquet
+#
+# so a whole time series or ensemble run is appended partition by
+# partition, each written in row chunks, and read back with e.g.
+# pyarrow.dataset.dataset("results/pipes", partitioning="hive").
+EXPORT_DIR = "results"
+EXPORT_CHUNK_SIZE = 250_000
+EXPORT_FORMATS = ("parquet", "csv")
+
+
+def write_table(df_chunks, path, fmt):
+    """
+    Writes DataFrame chunks to one CSV or Parquet file without
+    holding the whole table in memory.
+    """
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in df_chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        for n, chunk in enumerate(df_chunks):
+            chunk.to_csv(path, mode="w" if n == 0 else "a", header=n == 0, index=False)
+
+
+def _row_chunks(columns, chunk_size):
+    total = len(next(iter(columns.values())))
+    for start in range(0, max(total, 1), chunk_size):
+        yield pd.DataFrame({k: col[start:start + chunk_size] for k, col in columns.items()})
+
+
+def scenario_name(magnitude):
+    return f"M{magnitude:g}"
+
+
+def stream_partition(df_chunks, table, scenario, time_step, output_dir=EXPORT_DIR, fmt="parquet"):
+    """
+    Writes DataFrame chunks, as they are produced, to one partition of
+    a results table. Rewriting a partition replaces it.
+    Returns the file path.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}; use one of {EXPORT_FORMATS}")
+
+    folder = os.path.join(output_dir, table, f"scenario={scenario}", f"time_step={time_step}")
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"part-0.{fmt}")
+
+    write_table(df_chunks, path, fmt)
+    return path
+
+
+def write_partition(columns, table, scenario, time_step, output_dir=EXPORT_DIR,
+                    fmt="parquet", chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Writes one partition from equal-length column arrays, chunk by chunk.
+    """
+    return stream_partition(
+        _row_chunks(columns, chunk_size), table, scenario, time_step, output_dir, fmt
+    )
+
+
+# ---------------------------
+# ONE FRAME
+# ---------------------------
+def route_members(routes):
+    """
+    Nodes and pipes ({u, v} frozensets) on any critical supply route.
+    """
+    nodes, pipes = set(), set()
+    for path in routes.values():
+        if path:
+            nodes.update(path)
+            pipes.update(frozenset(p) for p in zip(path, path[1:]))
+    return nodes, pipes
+
+
+def node_mask(net, nodes):
+    """
+    Boolean array over a compact network's nodes, set at the given ids.
+    """
+    mask = np.zeros(len(net["nodes"]), dtype=bool)
+    mask[node_positions(net, list(nodes))] = True
+    return mask
+
+
+def route_pipe_mask(net, route_nodes, route_pipes):
+    """
+    Boolean array over a compact network's pipes on a route: only
+    pipes with both ends on a route are looked up.
+    """
+    on_route = node_mask(net, route_nodes)
+    u, v = net["u"], net["v"]
+    candidates = np.flatnonzero(on_route[u] & on_route[v])
+
+    labels = net["nodes"]
+    mask = np.zeros(len(u), dtype=bool)
+    mask[candidates] = [
+        frozenset(pipe) in route_pipes
+        for pipe in zip(labels[u[candidates]].tolist(), labels[v[candidates]].tolist())
+    ]
+    return mask
+
+
+def pipe_results(G_after, routes, hydraulics=None, flows=None):
+    """
+    Pipe-level result columns of one frame (with flows when the frame
+    has hydraulics, and bottlenecks with a max-flow allocation).
+    """
+    route_nodes, route_pipes = route_members(routes)
+
+    if is_compact(G_after):
+        pipe, labels = G_after["pipe"], G_after["nodes"]
+        columns = {
+            "pipe_id": pipe["pipe_id"],
+            "from": labels[G_after["u"]],
+            "to": labels[G_after["v"]],
+            "status": np.array(STATUS_NAMES, dtype=object)[pipe["status"]],
+            "stress": pipe["stress"],
+            "failure_prob": pipe["failure_prob"],
+            "on_route": route_pipe_mask(G_after, route_nodes, route_pipes)
+        }
+    else:
+        edges = list(G_after.edges(data=True))
+        columns = {
+            "pipe_id": [d.get("pipe_id") for _, _, d in edges],
+            "from": [u for u, _, _ in edges],
+            "to": [v for _, v, _ in edges],
+            "status": [d.get("status") for _, _, d in edges],
+            "stress": np.array([d.get("stress", np.nan) for _, _, d in edges], dtype=float),
+            "failure_prob": np.array([d.get("failure_prob", np.nan) for _, _, d in edges], dtype=float),
+            "on_route": np.array([frozenset((u, v)) in route_pipes for u, v, _ in edges], dtype=bool)
+        }
+    if hydraulics is not None:
+        columns["flow"] = hydraulics["flow"]
+    if flows is not None:
+        columns["bottleneck"] = bottleneck_mask(flows, len(columns["on_route"]))
+    return columns
+
+
+def bottleneck_mask(flows, n_pipes):
+    mask = np.zeros(n_pipes, dtype=bool)
+    mask[flows["bottlenecks"]] = True
+    return mask
+
+
+def node_results(G_after, allocation, routes, source=None, hydraulics=None):
+    """
+    Node-level result columns of one frame (with pressures and
+    pressure-driven deliveries when the frame has hydraulics).
+    """
+    route_nodes, _ = route_members(routes)
+
+    if is_compact(G_after):
+        nodes = G_after["nodes"]
+        supplied = supplied_mask(G_after, source) if hydraulics is None else hydraulics["supplied"]
+        allocated = np.zeros(len(nodes))
+        allocated[node_positions(G_after, list(allocation))] = list(allocation.values())
+        on_route = node_mask(G_after, route_nodes)
+    else:
+        nodes = list(G_after.nodes)
+        if hydraulics is None:
+            supplied = reachable_nodes(G_after, source)
+            supplied = np.array([n in supplied for n in nodes], dtype=bool)
+        else:
+            supplied = hydraulics["supplied"]
+        allocated = np.array([allocation.get(n, 0.0) for n in nodes], dtype=float)
+        on_route = np.array([n in route_nodes for n in nodes], dtype=bool)
+
+    columns = {
+        "node_id": nodes,
+        "supplied": supplied,
+        "allocation": allocated,
+        "on_route": on_route
+    }
+    if hydraulics is not None:
+        columns["pressure"] = hydraulics["pressure"]
+        columns["delivered"] = hydraulics["delivered"]
+        columns["served"] = hydraulics["served"]
+    return columns
+
+
+def export_frame(result, scenario, time_step, output_dir=EXPORT_DIR,
+                 fmt="parquet", chunk_size=EXPORT_CHUNK_SIZE, source=None):
+    """
+    Writes the pipes and nodes partitions of one scenario result
+    (as returned by simulate or frame_state).
+    """
+    G_after, routes = result["G_after"], result["routes"]
+    hydraulics = result.get("hydraulics")
+    return {
+        "pipes": write_partition(
+            pipe_results(G_after, routes, hydraulics, result.get("flows")), "pipes", scenario, time_step,
+            output_dir, fmt, chunk_size
+        ),
+        "nodes": write_partition(
+            node_results(G_after, result["allocation"], routes, source, hydraulics),
+            "nodes", scenario, time_step, output_dir, fmt, chunk_size
+        )
+    }
+
+
+# ---------------------------
+# WHOLE TIME SERIES
+# ---------------------------
+def export_time_series(G_before, magnitude, time_steps=None, scenario=None,
+                       output_dir=EXPORT_DIR, fmt="parquet", chunk_size=EXPORT_CHUNK_SIZE,
+                       allocation_mode=None, hydraulics=None):
+    """
+    Steps one scenario through time_steps (incrementally, without graph
+    copies) and writes each step's pipes and nodes partitions as soon
+    as it is computed, so only one step is held in memory.
+    Returns the list of written paths.
+    """
+    from simulation import ALLOCATION, HYDRAULICS, TIME_STEPS, advance_step, start_incremental
+    from models.failure_scoring import pipe_columns, score_pipes
+
+    time_steps = TIME_STEPS if time_steps is None else time_steps
+    scenario = scenario_name(magnitude) if scenario is None else scenario
+
+    state = start_incremental(
+        G_before, magnitude,
+        hydraulics=HYDRAULICS if hydraulics is None else hydraulics,
+        allocation_mode=ALLOCATION if allocation_mode is None else allocation_mode
+    )
+    columns = pipe_columns(G_before)
+    n_pipes = len(state["edges"])
+
+    # Static columns and lookups, built once for the whole series
+    compact = is_compact(G_before)
+    if compact:
+        nodes = G_before["nodes"]
+        pipe_ids = G_before["pipe"]["pipe_id"]
+        pipe_from, pipe_to = nodes[G_before["u"]], nodes[G_before["v"]]
+    else:
+        edges = state["edges"]
+        pipe_ids = [d.get("pipe_id") for _, _, d in G_before.edges(data=True)]
+        pipe_from = [u for u, _ in edges]
+        pipe_to = [v for _, v in edges]
+        pipe_index = {frozenset(e): i for i, e in enumerate(edges)}
+        nodes = list(G_before.nodes)
+        node_index = {n: i for i, n in enumerate(nodes)}
+    weights = np.array([state["weights"][n] for n in (nodes.tolist() if compact else nodes)], dtype=float)
+    status_names = np.array(STATUS_NAMES, dtype=object)
+
+    paths = []
+    for t in time_steps:
+        scores = None
+        if t > 0:
+            scores = score_pipes(**columns, magnitude=magnitude, time_step=t)
+        step = advance_step(state, t, scores=scores)
+
+        route_nodes, route_pipes = route_members(step["routes"])
+        if compact:
+            on_route = route_pipe_mask(G_before, route_nodes, route_pipes)
+        else:
+            on_route = np.zeros(n_pipes, dtype=bool)
+            on_route[[pipe_index[p] for p in route_pipes if p in pipe_index]] = True
+
+        pipe_table = {
+            "pipe_id": pipe_ids,
+            "from": pipe_from,
+            "to": pipe_to,
+            "status": status_names[state["failed"].astype(np.int8)],
+            "stress": scores[0] if scores else np.full(n_pipes, np.nan),
+            "failure_prob": scores[1] if scores else np.full(n_pipes, np.nan),
+            "on_route": on_route
+        }
+        hydraulics, flows = step["hydraulics"], step["flows"]
+        if hydraulics is not None:
+            pipe_table["flow"] = hydraulics["flow"]
+        if flows is not None:
+            pipe_table["bottleneck"] = bottleneck_mask(flows, n_pipes)
+        paths.append(write_partition(pipe_table, "pipes", scenario, t, output_dir, fmt, chunk_size))
+
+        if compact:
+            supplied = state["supplied_mask"]
+        else:
+            supplied = np.zeros(len(nodes), dtype=bool)
+            supplied[[node_index[n] for n in state["supplied"]]] = True
+        weighted_demand = state["weighted_demand"]
+        if flows is not None:
+            allocation = np.where(supplied, flows["delivered"], 0.0)
+        else:
+            allocation = np.where(
+                supplied,
+                state["total_supply"] * weights / weighted_demand if weighted_demand else 0.0,
+                0.0
+            )
+        if compact:
+            node_on_route = node_mask(G_before, route_nodes)
+        else:
+            node_on_route = np.zeros(len(nodes), dtype=bool)
+            node_on_route[[node_index[n] for n in route_nodes]] = True
+
+        node_table = {
+            "node_id": nodes,
+            "supplied": supplied,
+            "allocation": allocation,
+            "on_route": node_on_route
+        }
+        if hydraulics is not None:
+            node_table["pressure"] = hydraulics["pressure"]
+            node_table["delivered"] = hydraulics["delivered"]
+            node_table["served"] = hydraulics["served"]
+        paths.append(write_partition(node_table, "nodes", scenario, t, output_dir, fmt, chunk_size))
+
+    return paths
@@ -0,0 +1,90 @@
+import numpy as np
+
+from ensemble import evaluate_realization, network_arrays
+from models.failure_scoring import pipe_columns, score_pipes
+from simulation import HYDRAULICS, SOURCE, TIME_STEPS, failure_threshold, supply_total
+
+# ==================================================
+# MAGNITUDE x TIME FRAGILITY SWEEP
+# ==================================================
+# Scores every pipe for a whole grid of magnitudes and time steps in
+# one broadcast call per block of magnitudes, then applies the same
+# dynamic threshold as simulate at each grid point and measures
+# service on the compact arrays the ensemble uses (by pressure too
+# with hydraulics, as in simulate).
+DEFAULT_MAGNITUDES = np.round(np.arange(4.0, 8.01, 0.25), 2)
+
+# Upper bound on grid-point x pipe values scored at once
+SWEEP_BLOCK_VALUES = 5_000_000
+
+
+def fragility_sweep(
+    G_before,
+    magnitudes=DEFAULT_MAGNITUDES,
+    time_steps=TIME_STEPS,
+    total_supply=None,
+    source=SOURCE,
+    keep_exceedance=True,
+    hydraulics=HYDRAULICS
+):
+    """
+    Evaluates every (magnitude, time_step) pair of the grid.
+
+    Returns a dict of (n_magnitudes, n_time_steps) arrays
+    ("threshold", "failed_pipes", "critical_service_ratio",
+    "overall_service_ratio", "unserved_demand"), plus "exceedance":
+    per-pipe failure probabilities of shape
+    (n_magnitudes, n_time_steps, n_pipes) in G_before.edges order.
+    As in simulate, nothing fails at time step 0.
+    """
+    magnitudes = np.asarray(magnitudes, dtype=float)
+    time_steps = np.asarray(time_steps)
+    shape = (len(magnitudes), len(time_steps))
+
+    columns = pipe_columns(G_before)
+    n_pipes = G_before.number_of_edges()
+    net = network_arrays(G_before, np.zeros(n_pipes), source, hydraulics)
+    total_supply = supply_total(G_before, source, total_supply)
+    quiet = time_steps == 0
+
+    result = {
+        "magnitudes": magnitudes,
+        "time_steps": time_steps,
+        "edges": list(G_before.edges),
+        "threshold": np.full(shape, np.nan),
+        "failed_pipes": np.zeros(shape, dtype=np.int64),
+        "critical_service_ratio": np.zeros(shape),
+        "overall_service_ratio": np.zeros(shape),
+        "unserved_demand": np.zeros(shape),
+        "exceedance": np.zeros(shape + (n_pipes,), dtype=np.float32) if keep_exceedance else None
+    }
+
+    block = max(1, SWEEP_BLOCK_VALUES // max(1, len(time_steps) * n_pipes))
+
+    for start in range(0, len(magnitudes), block):
+        rows = slice(start, start + block)
+
+        # (block, n_time_steps, n_pipes) in one broadcast pass
+        _, failure_prob = score_pipes(**columns, magnitude=magnitudes[rows], time_step=time_steps)
+        failure_prob[:, quiet] = 0
+
+        if keep_exceedance:
+            result["exceedance"][rows] = failure_prob
+
+        for i, probs in enumerate(failure_prob, start):
+            for j, t_probs in enumerate(probs):
+                if quiet[j]:
+                    failed = np.zeros(n_pipes, dtype=bool)
+                else:
+                    threshold = failure_threshold(t_probs)
+                    result["threshold"][i, j] = threshold
+                    failed = t_probs > threshold
+
+                (
+                    result["failed_pipes"][i, j],
+                    result["critical_service_ratio"][i, j],
+                    result["overall_service_ratio"][i, j],
+                    result["unserved_demand"][i, j]
+                ) = evaluate_realization(net, failed, total_supply)
+
+    return result
@@ -0,0 +1,151 @@
+"""
+Lightweight per-frame timing and counters for the simulation pipeline.
+
+    with span("auto_reroute"):
+        ...
+    count("dijkstra_runs")
+
+Disabled by default: span() then returns a shared no-op context and
+count() returns after one flag check. Enable with enable() or the
+TWIN_PROFILE=1 environment variable, or for one thread's frame only with
+start_frame(enabled=True) (e.g. one Streamlit session). Each frame (start_frame() ...
+end_frame()) can also be appended as one JSON line to TWIN_PROFILE_JSONL
+and/or dumped as a cProfile file into TWIN_CPROFILE_DIR.
+"""
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+
+_enabled = os.environ.get("TWIN_PROFILE", "") not in ("", "0")
+_jsonl_path = os.environ.get("TWIN_PROFILE_JSONL") or None
+_cprofile_dir = os.environ.get("TWIN_CPROFILE_DIR") or None
+
+# One frame record per thread (Streamlit runs sessions in threads)
+_state = threading.local()
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def enable(flag=True, jsonl_path=None, cprofile_dir=None):
+    global _enabled, _jsonl_path, _cprofile_dir
+    _enabled = bool(flag)
+    if jsonl_path is not None:
+        _jsonl_path = jsonl_path
+    if cprofile_dir is not None:
+        _cprofile_dir = cprofile_dir
+
+
+def is_enabled():
+    return _enabled
+
+
+def _on():
+    # A frame's own setting wins over the process-wide one
+    return getattr(_state, "enabled", _enabled)
+
+
+def _frame():
+    frame = getattr(_state, "frame", None)
+    if frame is None:
+        frame = _state.frame = {"label": None, "spans": [], "counters": {}, "depth": 0}
+    return frame
+
+
+def start_frame(label="frame", enabled=None):
+    """
+    Starts a new frame record (and a cProfile run if configured).
+    enabled: profile this thread until end_frame() regardless of
+    enable(); None follows the process-wide setting.
+    """
+    _state.enabled = _enabled if enabled is None else bool(enabled)
+    if not _state.enabled:
+        return
+
+    _state.frame = {
+        "label": label,
+        "started": time.time(),
+        "t0": time.perf_counter(),
+        "spans": [],
+        "counters": {},
+        "depth": 0
+    }
+
+    if _cprofile_dir:
+        _state.profiler = cProfile.Profile()
+        _state.profiler.enable()
+
+
+def end_frame():
+    """
+    Closes the current frame and returns its record:
+    {"label", "total", "spans": [{"name", "start", "seconds", "depth"}], "counters"}.
+    """
+    enabled = _on()
+    _state.__dict__.pop("enabled", None)
+    if not enabled:
+        return None
+
+    frame = _frame()
+    record = {
+        "label": frame["label"],
+        "started": frame.get("started"),
+        "total": time.perf_counter() - frame.get("t0", time.perf_counter()),
+        "spans": frame["spans"],
+        "counters": frame["counters"]
+    }
+
+    profiler = getattr(_state, "profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(_cprofile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(
+            _cprofile_dir, f"{record['label']}-{int(record['started'] * 1000)}.prof"
+        ))
+        _state.profiler = None
+
+    if _jsonl_path:
+        with open(_jsonl_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    _state.frame = None
+    return record
+
+
+@contextlib.contextmanager
+def _timed_span(name):
+    frame = _frame()
+    depth = frame["depth"]
+    frame["depth"] = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        frame["depth"] = depth
+        frame["spans"].append({
+            "name": name,
+            "start": start - frame.get("t0", start),
+            "seconds": time.perf_counter() - start,
+            "depth": depth
+        })
+
+
+def span(name):
+    """
+    Context manager timing one pipeline stage.
+    """
+    if not _on():
+        return _NULL_SPAN
+    return _timed_span(name)
+
+
+def count(name, n=1):
+    """
+    Adds n to a per-frame counter (e.g. edges scored, graph copies).
+    """
+    if not _on():
+        return
+    counters = _frame()["counters"]
+    counters[name] = counters.get(name, 0) + n
@@ -1,6 +1,8 @@
-import networkx as nx
+import numpy as np
+from models.compact_network import FAILED, is_compact, node_positions
+from models.connectivity import reachable_nodes, supplied_mask
 
-def compute_metrics(G_before, G_after, critical_nodes=None):
+def compute_metrics(G_before, G_after, critical_nodes=None, source=None, hydraulics=None):
     """
     Computes detailed metrics for water network performance.
     
@@ -11,17 +13,26 @@ def compute_metrics(G_before, G_after, critical_nodes=None):
             The graph after failures.
         critical_nodes: list (optional)
             List of nodes considered "critical".
+        source: node id or ids (optional)
+            Nodes supplying the network (default: the twin's sources).
+        hydraulics: dict (optional)
+            solve_hydraulics result for G_after; nodes below the
+            minimum pressure then count as unserved.
     
     Returns:
         dict of metrics
     """
+    if is_compact(G_after):
+        return compact_metrics(G_after, critical_nodes, source, hydraulics)
+
     # -----------------------------
     # Identify node categories
     # -----------------------------
     if critical_nodes is None:
         critical_nodes = [n for n, d in G_before.nodes(data=True) if d.get('priority', 0) >= 4]
     
-    normal_nodes = [n for n in G_before.nodes if n not in critical_nodes]
+    critical_set = set(critical_nodes)
+    normal_nodes = [n for n in G_before.nodes if n not in critical_set]
 
     # -----------------------------
     # Failed pipes
@@ -32,27 +43,88 @@ def compute_metrics(G_before, G_after, critical_nodes=None):
 )
 
 
+    # -----------------------------
+    # Nodes still connected to a source (failed pipes carry no water)
+    # and, with hydraulics, at or above the minimum pressure
+    # -----------------------------
+    if hydraulics is None:
+        supplied = reachable_nodes(G_after, source)
+        low_pressure = 0
+    else:
+        supplied = {n for n, ok in zip(G_after.nodes, hydraulics["served"].tolist()) if ok}
+        low_pressure = int((hydraulics["supplied"] & ~hydraulics["served"]).sum())
+
+    critical_served = sum(1 for n in critical_nodes if n in supplied)
+    normal_served = sum(1 for n in normal_nodes if n in supplied)
+
+    return service_metrics(
+        failed_pipes,
+        critical_served, len(critical_nodes),
+        normal_served, len(normal_nodes),
+        low_pressure
+    )
+
+
+def compact_metrics(net, critical_nodes=None, source=None, hydraulics=None):
+    """
+    compute_metrics on a compact network (the node set is shared, so
+    only the after-state is needed).
+    """
+    if critical_nodes is None:
+        critical = net["node"]["priority"] >= 4
+    else:
+        critical = np.zeros(len(net["nodes"]), dtype=bool)
+        critical[node_positions(net, list(critical_nodes))] = True
+
+    if hydraulics is None:
+        supplied = supplied_mask(net, source)
+        low_pressure = 0
+    else:
+        supplied = hydraulics["served"]
+        low_pressure = int((hydraulics["supplied"] & ~supplied).sum())
+
+    return mask_metrics(int((net["pipe"]["status"] == FAILED).sum()), supplied, critical, low_pressure)
+
+
+def mask_metrics(failed_pipes, served, critical, low_pressure=0):
+    """
+    service_metrics from boolean served and critical node masks.
+    """
+    critical_served = int((served & critical).sum())
+    return service_metrics(
+        failed_pipes,
+        critical_served, int(critical.sum()),
+        int(served.sum()) - critical_served, int((~critical).sum()),
+        low_pressure
+    )
+
+
+def service_metrics(failed_pipes, critical_served, total_critical, normal_served, total_normal,
+                    low_pressure=0):
+    """
+    Builds the metrics dict from served/total node counts, so callers
+    that track those counts incrementally skip the graph pass.
+    low_pressure: connected nodes left unserved by low pressure.
+    """
     # -----------------------------
     # Critical node connectivity
     # -----------------------------
-    critical_served = sum(1 for n in critical_nodes if nx.has_path(G_after, "N1", n))
-    critical_service_ratio = (critical_served / len(critical_nodes)) * 100
-    critical_connectivity_loss = ((len(critical_nodes) - critical_served) / len(critical_nodes)) * 100
+    critical_service_ratio = (critical_served / total_critical) * 100 if total_critical else 0
+    critical_connectivity_loss = ((total_critical - critical_served) / total_critical) * 100 if total_critical else 0
 
     # -----------------------------
     # Normal node connectivity
     # -----------------------------
-    normal_served = sum(1 for n in normal_nodes if nx.has_path(G_after, "N1", n))
-    normal_service_ratio = (normal_served / len(normal_nodes)) * 100 if normal_nodes else 0
-    normal_connectivity_loss = ((len(normal_nodes) - normal_served) / len(normal_nodes)) * 100 if normal_nodes else 0
+    normal_service_ratio = (normal_served / total_normal) * 100 if total_normal else 0
+    normal_connectivity_loss = ((total_normal - normal_served) / total_normal) * 100 if total_normal else 0
 
     # -----------------------------
     # Overall connectivity (all nodes)
     # -----------------------------
-    all_nodes = critical_nodes + normal_nodes
+    total_nodes = total_critical + total_normal
     all_served = critical_served + normal_served
-    overall_service_ratio = (all_served / len(all_nodes)) * 100
-    overall_connectivity_loss = ((len(all_nodes) - all_served) / len(all_nodes)) * 100
+    overall_service_ratio = (all_served / total_nodes) * 100
+    overall_connectivity_loss = ((total_nodes - all_served) / total_nodes) * 100
 
     # -----------------------------
     # Return metrics
@@ -67,7 +139,8 @@ def compute_metrics(G_before, G_after, critical_nodes=None):
         "normal_connectivity_loss": round(normal_connectivity_loss, 2),
         "overall_service_ratio": round(overall_service_ratio, 2),
         "overall_connectivity_loss": round(overall_connectivity_loss, 2),
-        "total_critical_nodes": len(critical_nodes),
-        "total_normal_nodes": len(normal_nodes),
+        "low_pressure_nodes": low_pressure,
+        "total_critical_nodes": total_critical,
+        "total_normal_nodes": total_normal,
         "baseline_service": 40  # optional: baseline for comparison
     }
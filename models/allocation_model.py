@@ -1,30 +1,31 @@
-import networkx as nx
+import numpy as np
+from models.compact_network import is_compact
+from models.connectivity import operational_view, pipe_network, reachable_nodes, supplied_mask
+from models.flow_allocation import flow_allocation
+
+# "proportional": total_supply split by demand x priority over the
+# nodes connected to a source. "max_flow": capacity-aware, highest
+# priority first (see flow_allocation).
+ALLOCATION_MODES = ("proportional", "max_flow")
 
 def get_operational_graph(G):
     """
-    Returns a copy of the graph with failed pipes removed.
+    Returns a read-only view of the graph with failed pipes removed.
     """
-    H = G.copy()
-
-    failed_edges = [
-        (u, v)
-        for u, v, d in G.edges(data=True)
-        if d.get("status") == "failed"
-    ]
+    return operational_view(G)
 
-    H.remove_edges_from(failed_edges)
-    return H
+def allocate_water(G, total_supply, source=None, mode="proportional"):
+    if mode == "max_flow":
+        return flow_allocation(pipe_network(G), total_supply, source)["allocation"]
+    if mode not in ALLOCATION_MODES:
+        raise ValueError(f"Unknown allocation mode {mode!r}; use one of {ALLOCATION_MODES}")
 
-def allocate_water(G, total_supply, source="N1"):
+    if is_compact(G):
+        return compact_allocation(G, total_supply, source)
     
-    #  STEP 2A: Create operational graph
-    H = get_operational_graph(G)
-
-    #  STEP 2B: Use H instead of G
-    reachable = [
-        n for n in G.nodes
-        if nx.has_path(H, source, n)
-    ]
+    #  STEP 2: One traversal from all sources over non-failed pipes (cached per graph state)
+    supplied = reachable_nodes(G, source)
+    reachable = [n for n in G.nodes if n in supplied]
 
 
     if not reachable:
@@ -57,3 +58,23 @@ def allocate_water(G, total_supply, source="N1"):
         )
 
     return allocation
+
+def compact_allocation(net, total_supply, source=None):
+    """
+    allocate_water on a compact network, with the same split.
+    """
+    supplied = supplied_mask(net, source)
+    weight = net["node"]["demand"] * net["node"]["priority"].astype(int)
+    shares = proportional_shares(total_supply, weight, supplied)
+    return dict(zip(net["nodes"][supplied].tolist(), shares[supplied].tolist()))
+
+def proportional_shares(total_supply, weight, supplied):
+    """
+    The allocate_water split on arrays: total_supply shared by weight
+    (demand x priority) over the supplied mask, zero elsewhere.
+    """
+    shares = np.zeros(len(weight))
+    weighted_demand = weight[supplied].sum()
+    if weighted_demand > 0:
+        shares[supplied] = total_supply * weight[supplied] / weighted_demand
+    return shares
@@ -1,22 +1,69 @@
-import networkx as nx
+import heapq
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from models.compact_network import STATUS_CODES, add_pipes, csr_graph, is_compact, node_positions
 from models.routing_model import add_rerouted_pipe
+from models.connectivity import is_open, pipe_network, reachable_nodes, source_nodes, supplied_mask
+from instrumentation import count
 
 MAX_REROUTE_DISTANCE = 800
-MIN_PRESSURE_REQUIRED = 80  # kept for future extension
 
-def auto_reroute(G, source="N1"):
+def nearest_donors(G, donors, targets, cutoff=MAX_REROUTE_DISTANCE, weight="length"):
+    """
+    Finds the closest donor for every target with one multi-source
+    Dijkstra seeded from all donors and bounded by cutoff.
+
+    Returns {target: (donor, distance)} for targets within cutoff.
+    """
+    count("dijkstra_runs")
+    remaining = set(targets)
+    found = {}
+
+    settled = set()
+    best = {}
+    heap = []
+    counter = 0   # tie-breaker so nodes are never compared
+
+    for donor in donors:
+        best[donor] = 0
+        heap.append((0, counter, donor, donor))
+        counter += 1
+    heapq.heapify(heap)
+
+    adj = pipe_network(G).adj
+    while heap and remaining:
+        dist, _, u, donor = heapq.heappop(heap)
+        if u in settled:
+            continue
+        settled.add(u)
+
+        if u in remaining:
+            found[u] = (donor, dist)
+            remaining.discard(u)
+
+        for v, d in adj[u].items():
+            if v in settled or not is_open(d):
+                continue
+            new_dist = dist + d.get(weight, 1)
+            if new_dist <= cutoff and new_dist < best.get(v, float("inf")):
+                best[v] = new_dist
+                counter += 1
+                heapq.heappush(heap, (new_dist, counter, v, donor))
+
+    return found
+
+def auto_reroute(G, source=None):
     """
     Automatically reroutes water to disconnected critical nodes
     using shortest available safe paths.
     """
+    if is_compact(G):
+        return compact_reroute(G, source)
 
     # ------------------------------------
-    # STEP 1: Nodes still connected to source
+    # STEP 1: Nodes still connected to a source
     # ------------------------------------
-    reachable = {
-        n for n in G.nodes
-        if nx.has_path(G, source, n)
-    }
+    reachable = reachable_nodes(G, source)
 
     # ------------------------------------
     # STEP 2: Critical nodes that lost supply
@@ -26,39 +73,68 @@ def auto_reroute(G, source="N1"):
         if d.get("priority", 0) >= 4 and n not in reachable
     ]
 
+    if not critical_lost:
+        return G
+
     # ------------------------------------
-    # STEP 3: Reroute each lost critical node
+    # STEP 3: Nearest donor for every lost critical node (one search)
+    # ------------------------------------
+    sources = set(source_nodes(G, source))
+    donors = [n for n in reachable if n not in sources]
+    best = nearest_donors(G, donors, critical_lost)
+
+    # ------------------------------------
+    # STEP 4: Add logical rerouted pipe
     # ------------------------------------
     for critical in critical_lost:
-        best_donor = None
-        best_distance = float("inf")
+        if critical not in best:
+            continue
 
-        for donor in reachable:
+        best_donor, best_distance = best[critical]
+        add_rerouted_pipe(
+            G,
+            best_donor,
+            critical,
+            length=best_distance,
+            failure_prob=0.1
+        )
 
-            if donor == source:
-                continue
+    return G
 
-            try:
-                dist = nx.shortest_path_length(
-                    G, donor, critical, weight="length"
-                )
-            except nx.NetworkXNoPath:
-                continue
 
-            if dist <= MAX_REROUTE_DISTANCE and dist < best_distance:
-                best_distance = dist
-                best_donor = donor
-
-        # ------------------------------------
-        # STEP 4: Add logical rerouted pipe
-        # ------------------------------------
-        if best_donor:
-            add_rerouted_pipe(
-                G,
-                best_donor,
-                critical,
-                length=best_distance,
-                failure_prob=0.1
-            )
+def compact_reroute(net, source=None, cutoff=MAX_REROUTE_DISTANCE):
+    """
+    auto_reroute on a compact network: one scipy Dijkstra from all
+    donors over open pipe lengths, bounded by cutoff.
+    """
+    supplied = supplied_mask(net, source)
+    critical_lost = np.flatnonzero((net["node"]["priority"] >= 4) & ~supplied)
+    if not len(critical_lost):
+        return net
 
-    return G
+    is_donor = supplied.copy()
+    is_donor[node_positions(net, list(source_nodes(net, source)))] = False
+    donors = np.flatnonzero(is_donor)
+    if not len(donors):
+        return net
+
+    count("dijkstra_runs")
+    length = np.nan_to_num(net["pipe"]["length"].astype(float), nan=1.0)
+    distance, _, donor = dijkstra(
+        csr_graph(net, data=length[net["adj_pipe"]]),
+        indices=donors,
+        min_only=True,
+        limit=cutoff,
+        return_predecessors=True
+    )
+
+    found = critical_lost[np.isfinite(distance[critical_lost])]
+    if len(found):
+        add_pipes(
+            net, donor[found], found,
+            status=STATUS_CODES["rerouted"],
+            is_physical=False,
+            failure_prob=0.1,
+            length=distance[found]
+        )
+    return net
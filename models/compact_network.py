@@ -0,0 +1,504 @@
+import numpy as np
+import networkx as nx
+from scipy.sparse import csr_matrix
+
+# ==================================================
+# COMPACT (CSR) NETWORK
+# ==================================================
+# The same network as the networkx twin, held in arrays: topology as
+# CSR index arrays and every node/pipe attribute as a typed NumPy
+# column, with material, soil, node type and status stored as small
+# integer codes. A pipe takes a few dozen bytes instead of the
+# hundreds a networkx edge dict needs.
+#
+# A compact network is a plain dict:
+#   "nodes"        node ids; a node's position is its index everywhere
+#   "u", "v"       pipe endpoints (node indices), one entry per pipe
+#   "indptr"       CSR row pointers, n_nodes + 1
+#   "adj_node"     neighbour of every CSR entry (each pipe appears twice)
+#   "adj_pipe"     pipe index of every CSR entry
+#   "node", "pipe" {column: array} node and pipe attributes
+#   "categories"   {column: array of names} for coded columns
+#   "version"      bumped by connectivity.invalidate() on status edits
+#   "cache"        derived arrays, dropped when the version changes
+#   "topology"     bumped when pipes are added or removed
+# and, once set, "sources" ({node: capacity}), "epicenter" and the
+# topology caches ("pipe_index", "hydraulic_arrays", "flow_arrays";
+# see topology_cached).
+STATUS_NAMES = ("healthy", "failed", "rerouted")
+STATUS_CODES = {name: code for code, name in enumerate(STATUS_NAMES)}
+FAILED = STATUS_CODES["failed"]
+
+NODE_CATEGORIES = ("type",)
+PIPE_CATEGORIES = ("material", "soil")
+
+# Integer columns keep these widths; columns holding floats stay float64
+NODE_INT_DTYPES = {"demand": np.int32, "priority": np.int8}
+PIPE_INT_DTYPES = {"length": np.int32, "age": np.int16, "pressure_cap": np.int16}
+
+# Scores are absent until the network is scored
+SCORE_COLUMNS = ("stress", "failure_prob")
+
+
+def is_compact(G):
+    return isinstance(G, dict) and "indptr" in G
+
+
+def _numeric(values, int_dtype):
+    """
+    Integer data keeps a narrow integer column, anything else float64.
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind in "iub":
+        info = np.iinfo(int_dtype)
+        if arr.size == 0 or (arr.min() >= info.min and arr.max() <= info.max):
+            return arr.astype(int_dtype)
+        return arr.astype(np.int64)
+    return arr.astype(float)
+
+
+def _ids(values):
+    """
+    String ids as a fixed-width unicode array (no per-id Python
+    objects); other ids (e.g. integers) are kept as they are.
+    """
+    import pandas as pd
+
+    arr = np.asarray(values)
+    if arr.dtype == object and pd.api.types.infer_dtype(arr, skipna=False) == "string":
+        return arr.astype(str)
+    return arr
+
+
+def _encode(values):
+    """
+    Categorical codes and their names; missing values get -1. Codes
+    are int8 unless there are more categories than int8 can number.
+    """
+    import pandas as pd
+
+    codes, names = pd.factorize(pd.Series(values, dtype=object))
+    dtype = next(t for t in (np.int8, np.int16, np.int32) if len(names) <= np.iinfo(t).max)
+    return codes.astype(dtype), np.asarray(names, dtype=object)
+
+
+def _encode_status(values):
+    return np.fromiter(
+        (STATUS_CODES.get(s, 0) for s in values),
+        dtype=np.int8,
+        count=len(values)
+    )
+
+
+def _csr(n_nodes, u, v):
+    """
+    Symmetric adjacency as CSR arrays: (indptr, neighbour, pipe index).
+    """
+    pipes = np.arange(len(u), dtype=np.int32)
+    rows = np.concatenate([u, v])
+    order = np.argsort(rows, kind="stable")
+
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_nodes), out=indptr[1:])
+
+    adj_node = np.concatenate([v, u])[order].astype(np.int32)
+    adj_pipe = np.concatenate([pipes, pipes])[order]
+    return indptr, adj_node, adj_pipe
+
+
+def _assemble(nodes, u, v, node, pipe, categories):
+    indptr, adj_node, adj_pipe = _csr(len(nodes), u, v)
+    return {
+        "nodes": nodes,
+        "u": u,
+        "v": v,
+        "indptr": indptr,
+        "adj_node": adj_node,
+        "adj_pipe": adj_pipe,
+        "node": node,
+        "pipe": pipe,
+        "categories": categories,
+        "version": 0,
+        "cache": {},
+        "topology": 0
+    }
+
+
+# ------------------------------------
+# CONVERSION
+# ------------------------------------
+def from_graph(G):
+    """
+    Compact copy of a networkx twin. Node and pipe order follow
+    G.nodes and G.edges.
+    """
+    nodes = list(G.nodes)
+    index = {n: i for i, n in enumerate(nodes)}
+    node_data = [d for _, d in G.nodes(data=True)]
+    edges = list(G.edges(data=True))
+
+    u = np.fromiter((index[a] for a, _, _ in edges), dtype=np.int32, count=len(edges))
+    v = np.fromiter((index[b] for _, b, _ in edges), dtype=np.int32, count=len(edges))
+
+    node = {
+        "demand": _numeric([d.get("demand", 0) for d in node_data], NODE_INT_DTYPES["demand"]),
+        "priority": _numeric([d.get("priority", 0) for d in node_data], NODE_INT_DTYPES["priority"]),
+        "lat": np.array([d.get("lat", np.nan) for d in node_data], dtype=float),
+        "lon": np.array([d.get("lon", np.nan) for d in node_data], dtype=float)
+    }
+    pipe = {
+        "pipe_id": _ids(np.array([d.get("pipe_id") for _, _, d in edges], dtype=object)),
+        "length": _numeric([d.get("length", np.nan) for _, _, d in edges], PIPE_INT_DTYPES["length"]),
+        "age": _numeric([d.get("age", 0) for _, _, d in edges], PIPE_INT_DTYPES["age"]),
+        "pressure_cap": _numeric([d.get("pressure_cap", 0) for _, _, d in edges], PIPE_INT_DTYPES["pressure_cap"]),
+        "is_physical": np.array([d.get("is_physical", True) for _, _, d in edges], dtype=bool),
+        "status": _encode_status([d.get("status") for _, _, d in edges])
+    }
+    for col in SCORE_COLUMNS:
+        pipe[col] = np.array([d.get(col, np.nan) for _, _, d in edges], dtype=float)
+
+    categories = {}
+    node["type"], categories["type"] = _encode([d.get("type") for d in node_data])
+    for col in PIPE_CATEGORIES:
+        pipe[col], categories[col] = _encode([d.get(col) for _, _, d in edges])
+
+    return _assemble(_ids(np.array(nodes, dtype=object)), u, v, node, pipe, categories)
+
+
+def _first_last(keys):
+    """
+    For duplicated keys, the first occurrence gives the position and
+    the last one the data (as networkx does on repeated adds).
+    Returns (first, last) row indices of every unique key, by first.
+    """
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    last = np.zeros(len(first), dtype=np.int64)
+    last[inverse] = np.arange(len(keys))    # later rows overwrite earlier ones
+    order = np.argsort(first, kind="stable")
+    return first[order], last[order]
+
+
+def from_tables(nodes, pipes, pressure_cap):
+    """
+    Builds a compact network straight from the node and pipe tables,
+    without a networkx graph. Node and pipe order match what
+    create_digital_twin produces for the same tables.
+    """
+    # -------------------------
+    # NODES (pipe endpoints missing from the node table are appended)
+    # -------------------------
+    node_ids = nodes["node_id"].to_numpy(dtype=object)
+    first, last = _first_last(node_ids.astype(str))
+
+    ends = np.column_stack([
+        pipes["from"].to_numpy(dtype=object),
+        pipes["to"].to_numpy(dtype=object)
+    ]).ravel()
+    ends = ends[~np.isin(ends.astype(str), node_ids.astype(str))]
+    extra, _ = _first_last(ends.astype(str))
+
+    labels = _ids(np.concatenate([node_ids[first], ends[extra]]))
+    n_extra = len(extra)
+
+    def node_column(col, fill):
+        values = nodes[col].to_numpy()[last]
+        if n_extra:
+            values = np.concatenate([values.astype(object), np.full(n_extra, fill, dtype=object)]).tolist()
+        return values
+
+    node = {
+        "demand": _numeric(node_column("demand", 0), NODE_INT_DTYPES["demand"]),
+        "priority": _numeric(node_column("priority", 0), NODE_INT_DTYPES["priority"]),
+        "lat": np.array(node_column("lat", np.nan), dtype=float),
+        "lon": np.array(node_column("lon", np.nan), dtype=float)
+    }
+    categories = {}
+    node["type"], categories["type"] = _encode(node_column("type", None))
+
+    # -------------------------
+    # PIPES (in networkx G.edges order)
+    # -------------------------
+    order = np.argsort(labels.astype(str), kind="stable")
+    sorted_labels = labels.astype(str)[order]
+    a = order[np.searchsorted(sorted_labels, pipes["from"].to_numpy(dtype=object).astype(str))]
+    b = order[np.searchsorted(sorted_labels, pipes["to"].to_numpy(dtype=object).astype(str))]
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+
+    first, last = _first_last(lo.astype(np.int64) * len(labels) + hi)
+    # G.edges walks nodes in order, then each node's neighbours in the
+    # order their first pipe was added
+    walk = np.lexsort((first, lo[first]))
+    first, last = first[walk], last[walk]
+
+    u = lo[first].astype(np.int32)
+    v = hi[first].astype(np.int32)
+
+    def pipe_column(col):
+        return pipes[col].to_numpy()[last]
+
+    if "is_physical" in pipes:
+        is_physical = pipe_column("is_physical").astype(bool)
+    else:
+        is_physical = np.ones(len(last), dtype=bool)
+
+    pipe = {
+        "pipe_id": _ids(pipe_column("pipe_id")),
+        "length": _numeric(pipe_column("length"), PIPE_INT_DTYPES["length"]),
+        "age": _numeric(pipe_column("age"), PIPE_INT_DTYPES["age"]),
+        "pressure_cap": _numeric(np.asarray(pressure_cap)[last], PIPE_INT_DTYPES["pressure_cap"]),
+        "is_physical": is_physical,
+        "status": np.zeros(len(last), dtype=np.int8)
+    }
+    for col in SCORE_COLUMNS:
+        pipe[col] = np.full(len(last), np.nan)
+    for col in PIPE_CATEGORIES:
+        pipe[col], categories[col] = _encode(pipe_column(col))
+
+    return _assemble(labels, u, v, node, pipe, categories)
+
+
+def decode(net, col, codes=None):
+    """
+    Category names of a coded node/pipe column (None where missing).
+    """
+    if codes is None:
+        codes = net["pipe"][col] if col in net["pipe"] else net["node"][col]
+    names = np.append(net["categories"][col], None)
+    return names[codes]     # code -1 picks the trailing None
+
+
+def to_graph(net):
+    """
+    networkx twin with the same nodes, pipes and attributes.
+    """
+    G = nx.Graph()
+    nodes = net["nodes"].tolist()
+    node = net["node"]
+
+    G.add_nodes_from(
+        (
+            n,
+            {
+                "pos": (x, y),
+                "lat": y,
+                "lon": x,
+                "priority": priority,
+                "type": node_type,
+                "demand": demand
+            }
+        )
+        for n, x, y, priority, node_type, demand in zip(
+            nodes,
+            node["lon"].tolist(),
+            node["lat"].tolist(),
+            node["priority"].tolist(),
+            decode(net, "type").tolist(),
+            node["demand"].tolist()
+        )
+    )
+
+    pipe = net["pipe"]
+    columns = {
+        "pipe_id": pipe["pipe_id"].tolist(),
+        "length": pipe["length"].tolist(),
+        "material": decode(net, "material").tolist(),
+        "age": pipe["age"].tolist(),
+        "soil": decode(net, "soil").tolist(),
+        "pressure_cap": pipe["pressure_cap"].tolist(),
+        "status": np.array(STATUS_NAMES, dtype=object)[pipe["status"]].tolist(),
+        "is_physical": pipe["is_physical"].tolist()
+    }
+    scores = {col: pipe[col].tolist() for col in SCORE_COLUMNS if not np.isnan(pipe[col]).all()}
+
+    names = list(columns) + list(scores)
+    rows = zip(*columns.values(), *scores.values())
+    G.add_edges_from(
+        (nodes[a], nodes[b], dict(zip(names, row)))
+        for a, b, row in zip(net["u"].tolist(), net["v"].tolist(), rows)
+    )
+    return G
+
+
+# ------------------------------------
+# DERIVED ARRAYS
+# ------------------------------------
+def cached(net, key, build):
+    """
+    build() once per network version.
+    """
+    cache = net["cache"]
+    if cache.get("version") != net["version"]:
+        cache.clear()
+        cache["version"] = net["version"]
+    if key not in cache:
+        cache[key] = build()
+    return cache[key]
+
+
+# Static per-node and per-pipe arrays (spatial index, hydraulic and
+# allocation inputs) only depend on which pipes exist, not on their
+# status, so they are kept across status edits and shared by copies
+# of a twin. They live in the network itself (G.graph on a networkx
+# twin), keyed by its topology version: pipes added or removed through
+# add_pipes or connectivity.invalidate(G, topology=True) bump it, and a
+# copy that changes its pipes rebuilds into its own store. The node
+# and pipe counts are part of the key too, so a filtered view sharing
+# G.graph never reads the full graph's arrays.
+def _store(G):
+    return G if is_compact(G) else G.graph
+
+
+def topology_version(G):
+    if is_compact(G):
+        return G.get("topology", 0), len(G["nodes"]), len(G["u"])
+    return G.graph.get("topology", 0), G.number_of_nodes(), G.number_of_edges()
+
+
+def topology_changed(G):
+    """
+    Marks G's pipes as added or removed, so topology caches rebuild.
+    """
+    store = _store(G)
+    store["topology"] = store.get("topology", 0) + 1
+
+
+def endpoint_arrays(G):
+    """
+    Node ids and pipe endpoint indices (int64) of a networkx or compact
+    network, in G.nodes / G.edges order.
+    """
+    if is_compact(G):
+        return G["nodes"], G["u"].astype(np.int64), G["v"].astype(np.int64)
+    nodes = list(G.nodes)
+    index = {n: i for i, n in enumerate(nodes)}
+    n_pipes = G.number_of_edges()
+    u = np.fromiter((index[a] for a, _ in G.edges), dtype=np.int64, count=n_pipes)
+    v = np.fromiter((index[b] for _, b in G.edges), dtype=np.int64, count=n_pipes)
+    return np.array(nodes, dtype=object), u, v
+
+
+def topology_cached(G, key, build):
+    """
+    build(G) once per topology of G, stored under key.
+    """
+    store = _store(G)
+    version = topology_version(G)
+    entry = store.get(key)
+    if entry is None or entry[0] != version:
+        entry = (version, build(G))
+        store[key] = entry
+    return entry[1]
+
+
+def node_positions(net, labels):
+    """
+    Node indices of the given node ids (-1 for unknown ids).
+    """
+    def build():
+        keys = net["nodes"].astype(str)
+        order = np.argsort(keys, kind="stable")
+        return order, keys[order]
+
+    # Node ids never change, so this survives status edits
+    if "node_order" not in net:
+        net["node_order"] = build()
+    order, keys = net["node_order"]
+
+    labels = np.asarray(labels, dtype=object).astype(str)
+    at = np.minimum(np.searchsorted(keys, labels), len(keys) - 1)
+    found = keys[at] == labels if len(keys) else np.zeros(len(labels), dtype=bool)
+    return np.where(found, order[at], -1)
+
+
+def node_position(net, label):
+    i = node_positions(net, [label])[0]
+    if i < 0:
+        raise nx.NodeNotFound(f"Node {label} is not in the network")
+    return int(i)
+
+
+def open_entries(net):
+    """
+    Boolean mask over CSR entries whose pipe is not failed.
+    """
+    return cached(net, "open_entries", lambda: net["pipe"]["status"][net["adj_pipe"]] != FAILED)
+
+
+def csr_graph(net, data=None):
+    """
+    scipy CSR matrix over open pipes only (failed entries are dropped,
+    since scipy.sparse.csgraph treats stored zeros as edges).
+    data: optional value per CSR entry, ones by default.
+    """
+    keep = open_entries(net)
+    n = len(net["nodes"])
+
+    # Row pointers of the kept entries: open entries counted before each row
+    kept_before = np.concatenate([[0], np.cumsum(keep, dtype=np.int64)])
+    indptr = kept_before[net["indptr"]]
+
+    values = np.ones(int(keep.sum()), dtype=np.int8) if data is None else np.asarray(data)[keep]
+    return csr_matrix((values, net["adj_node"][keep], indptr), shape=(n, n))
+
+
+def copy(net):
+    """
+    Copy of net whose statuses, scores and pipes can change without
+    touching net. Node ids, topology and static columns are shared
+    until a change replaces them (as networkx copies share G.graph).
+    """
+    clone = dict(net)
+    clone["node"] = dict(net["node"])
+    clone["pipe"] = dict(net["pipe"])
+    clone["pipe"]["status"] = net["pipe"]["status"].copy()
+    clone["cache"] = {}
+    return clone
+
+
+def add_pipes(net, u, v, **columns):
+    """
+    Appends pipes between node indices u and v, with the given column
+    values (scalars or one per pipe). Other columns get their missing
+    value: NaN, code -1, False, 0 or None. Rebuilds the CSR arrays.
+    """
+    u = np.asarray(u, dtype=net["u"].dtype)
+    v = np.asarray(v, dtype=net["v"].dtype)
+    n = len(u)
+
+    for col, values in net["pipe"].items():
+        if col in columns:
+            extra = np.broadcast_to(np.asarray(columns[col]), n)
+        elif col in PIPE_CATEGORIES:
+            extra = np.full(n, -1, dtype=values.dtype)
+        elif values.dtype.kind == "f":
+            extra = np.full(n, np.nan)
+        elif values.dtype.kind in "iub":
+            extra = np.zeros(n, dtype=values.dtype)
+        else:
+            extra = np.full(n, None, dtype=object)
+        net["pipe"][col] = np.concatenate([values, extra])
+
+    net["u"] = np.concatenate([net["u"], u])
+    net["v"] = np.concatenate([net["v"], v])
+    net["indptr"], net["adj_node"], net["adj_pipe"] = _csr(len(net["nodes"]), net["u"], net["v"])
+    net["version"] += 1
+    topology_changed(net)
+    return net
+
+
+def set_status(net, pipes, status):
+    """
+    Sets the status of the given pipe indices and invalidates caches.
+    """
+    net["pipe"]["status"][pipes] = STATUS_CODES[status]
+    net["version"] += 1
+    return net
+
+
+def memory_bytes(net):
+    """
+    Bytes held by the network's arrays (object columns count their pointers).
+    """
+    arrays = [net["nodes"], net["u"], net["v"], net["indptr"], net["adj_node"], net["adj_pipe"]]
+    arrays += list(net["node"].values()) + list(net["pipe"].values())
+    return sum(a.nbytes for a in arrays)
@@ -0,0 +1,395 @@
+import weakref
+from collections import deque
+import networkx as nx
+import numpy as np
+from scipy.sparse.csgraph import breadth_first_order, connected_components
+
+from models.compact_network import STATUS_CODES, cached, csr_graph, is_compact, node_position, node_positions
+from models.compact_network import topology_changed
+from instrumentation import count
+
+# ------------------------------------
+# REACHABILITY CACHE
+# ------------------------------------
+# One traversal per graph state, shared by allocation, metrics,
+# routing and rerouting. Entries are keyed by the graph object and
+# dropped automatically when the graph is garbage collected.
+#
+# The state is an explicit version: every pipe status change goes
+# through set_pipe_status (or close_pipes / open_pipes) and every pipe
+# added or removed through a helper calling invalidate(G, topology=True).
+# A bare d["status"] = ... write is not seen by the cache.
+_cache = weakref.WeakKeyDictionary()
+
+
+def graph_version(G):
+    """
+    O(1) token identifying the current state of G: its node count and
+    the version bumped by invalidate().
+    """
+    if is_compact(G):
+        return G["version"]
+    return (G.number_of_nodes(), G.graph.get("version", 0))
+
+
+def invalidate(G, topology=False):
+    """
+    Marks G as changed so cached reachability is recomputed.
+    topology: pipes were added or removed, so topology caches (see
+    compact_network.topology_cached) are rebuilt too.
+    """
+    if topology:
+        topology_changed(G)
+    if is_compact(G):
+        G["version"] += 1
+        return
+    G.graph["version"] = G.graph.get("version", 0) + 1
+
+
+def set_pipe_status(G, edges, status):
+    """
+    Sets pipe statuses and invalidates cached reachability.
+
+    edges: (u, v) pairs (pipe indices on a compact network), or None
+    for every pipe in G.edges order. status: one status name for all
+    of them, or one name per pipe.
+    """
+    if is_compact(G):
+        if isinstance(status, str):
+            codes = STATUS_CODES[status]
+        else:
+            codes = np.array([STATUS_CODES[s] for s in status], dtype=np.int8)
+        G["pipe"]["status"][slice(None) if edges is None else edges] = codes
+        invalidate(G)
+        return G
+
+    if edges is None:
+        data = (d for _, _, d in G.edges(data=True))
+    else:
+        data = (G.edges[u, v] for u, v in edges)
+    if isinstance(status, str):
+        for d in data:
+            d["status"] = status
+    else:
+        for d, s in zip(data, status):
+            d["status"] = s
+
+    invalidate(G)
+    return G
+
+
+# ------------------------------------
+# SUPPLY SOURCES
+# ------------------------------------
+# A twin carries its reservoirs / treatment plants as {node: capacity}
+# (capacity None when unknown). Every search treats them as one virtual
+# super-source joined to all of them: a single multi-start traversal,
+# so the cost does not grow with the number of sources. Functions
+# taking source accept a node id, a collection of ids, or None for the
+# twin's own sources.
+DEFAULT_SOURCE = "N1"
+
+
+def _graph_attrs(G):
+    return G if is_compact(G) else G.graph
+
+
+def set_sources(G, sources):
+    """
+    Declares the supply sources of G: {node: capacity} or node ids.
+    """
+    if not isinstance(sources, dict):
+        sources = dict.fromkeys(source_nodes(G, sources))
+    _graph_attrs(G)["sources"] = dict(sources)
+
+
+def get_sources(G):
+    """
+    {node: capacity} of G's sources (DEFAULT_SOURCE if none declared).
+    """
+    return _graph_attrs(G).get("sources") or {DEFAULT_SOURCE: None}
+
+
+def source_nodes(G, source=None):
+    """
+    Tuple of source node ids for a source argument.
+    """
+    if source is None:
+        return tuple(get_sources(G))
+    if isinstance(source, (list, tuple, set, frozenset, dict)):
+        return tuple(source)
+    return (source,)
+
+
+def source_capacity(G, source=None):
+    """
+    Combined capacity of the sources, or None if any is unknown.
+    """
+    capacities = get_sources(G)
+    values = [capacities.get(s) for s in source_nodes(G, source)]
+    if any(c is None for c in values):
+        return None
+    return sum(values)
+
+
+def is_open(d):
+    """
+    Pipes marked as failed carry no water.
+    """
+    return d.get("status") != "failed"
+
+
+# ------------------------------------
+# OPERATIONAL VIEW
+# ------------------------------------
+# "Network minus failed pipes" without copying it: a filtered view that
+# shares every node and edge dict with the graph it wraps.
+def operational_view(G):
+    """
+    Read-only view of G without its failed pipes. Pipes added or
+    re-marked in G (e.g. reroutes) show up in the view immediately.
+    A compact network is its own view: its searches skip failed pipes.
+    """
+    if is_compact(G):
+        return G
+    view = nx.subgraph_view(G, filter_edge=lambda u, v: is_open(G.adj[u][v]))
+    view._pipe_network = G
+    return view
+
+
+def pipe_network(G):
+    """
+    The graph behind an operational view, or G itself. Searches that
+    skip failed pipes on their own run on it directly, avoiding the
+    view's per-edge filter and sharing its cached reachability.
+    """
+    return getattr(G, "_pipe_network", G)
+
+
+def _entry(G):
+    version = graph_version(G)
+    entry = _cache.get(G)
+
+    if entry is None or entry["version"] != version:
+        entry = {"version": version, "reachable": {}, "labels": None}
+        _cache[G] = entry
+
+    return entry
+
+
+def _traverse(G, starts, seen, stop=()):
+    """
+    Breadth-first search over open pipes from all starts at once,
+    adding visited nodes to seen. Nodes in stop are not entered.
+    """
+    count("bfs_traversals")
+    adj = G.adj
+    frontier = [n for n in dict.fromkeys(starts) if n not in seen]
+    seen.update(frontier)
+
+    while frontier:
+        next_frontier = []
+        for u in frontier:
+            for v, d in adj[u].items():
+                if v not in seen and v not in stop and is_open(d):
+                    seen.add(v)
+                    next_frontier.append(v)
+        frontier = next_frontier
+
+    return seen
+
+
+def reachable_nodes(G, source=None):
+    """
+    Returns the frozenset of nodes connected to any source through
+    non-failed pipes. Computed once per graph state.
+    """
+    if is_compact(G):
+        return frozenset(G["nodes"][supplied_mask(G, source)].tolist())
+
+    G = pipe_network(G)
+    sources = source_nodes(G, source)
+    for s in sources:
+        if s not in G:
+            raise nx.NodeNotFound(f"Source {s} is not in G")
+
+    key = frozenset(sources)
+    entry = _entry(G)
+    reachable = entry["reachable"].get(key)
+
+    if reachable is None:
+        reachable = frozenset(_traverse(G, sources, set()))
+        entry["reachable"][key] = reachable
+
+    return reachable
+
+
+def component_labels(G):
+    """
+    Returns {node: component_id} over non-failed pipes, one pass over G.
+    """
+    if is_compact(G):
+        return dict(zip(G["nodes"].tolist(), compact_labels(G).tolist()))
+
+    G = pipe_network(G)
+    entry = _entry(G)
+
+    if entry["labels"] is None:
+        labels = {}
+        for label, n in enumerate(G.nodes):
+            if n in labels:
+                continue
+            for m in _traverse(G, [n], set()):
+                labels[m] = label
+        entry["labels"] = labels
+
+    return entry["labels"]
+
+
+def is_supplied(G, n, source=None):
+    if is_compact(G):
+        return bool(supplied_mask(G, source)[node_position(G, n)])
+    return n in reachable_nodes(G, source)
+
+
+# ------------------------------------
+# COMPACT NETWORKS
+# ------------------------------------
+# Same questions answered with scipy.sparse.csgraph on the CSR arrays;
+# results are cached on the network until its version changes.
+def supplied_mask(net, source=None):
+    """
+    Boolean array over nodes: connected to any source through open pipes.
+    """
+    sources = source_nodes(net, source)
+    starts = node_positions(net, list(sources))
+    if (starts < 0).any():
+        raise nx.NodeNotFound(f"Source {sources[int(np.argmin(starts))]} is not in the network")
+
+    def build():
+        # Several sources: every component holding one, from one labelling pass
+        if len(starts) > 1:
+            labels = compact_labels(net)
+            return np.isin(labels, labels[starts])
+
+        count("bfs_traversals")
+        mask = np.zeros(len(net["nodes"]), dtype=bool)
+        mask[breadth_first_order(
+            csr_graph(net), starts[0],
+            directed=True, return_predecessors=False
+        )] = True
+        return mask
+
+    return cached(net, ("supplied", frozenset(sources)), build)
+
+
+def compact_labels(net):
+    """
+    Component id of every node over open pipes.
+    """
+    def build():
+        count("bfs_traversals")
+        return connected_components(csr_graph(net), directed=True, connection="weak")[1]
+
+    return cached(net, "labels", build)
+
+
+# ------------------------------------
+# INCREMENTAL UPDATES
+# ------------------------------------
+# Keep a supplied set current while pipes close and reopen between
+# time steps. Each change only searches around the pipe involved, so
+# the cost follows the size of the change rather than the network.
+# Pipes are applied one at a time so that every closure splits at most
+# one component in two.
+def _cut_side(G, u, v, sources):
+    """
+    Called after pipe (u, v) closed. Grows a BFS from u and from v in
+    lockstep over open pipes; returns None if they meet again or both
+    sides still hold a source, else the set of nodes on the side that
+    holds none.
+    """
+    adj = G.adj
+    queues = (deque([u]), deque([v]))
+    seen = ({u}, {v})
+
+    while queues[0] and queues[1]:
+        for side in (0, 1):
+            x = queues[side].popleft()
+            for y, d in adj[x].items():
+                if y in seen[side] or not is_open(d):
+                    continue
+                if y in seen[1 - side]:
+                    return None
+                seen[side].add(y)
+                queues[side].append(y)
+            if not queues[side]:
+                break
+
+    # One side is exhausted: it is a whole component
+    done = 0 if not queues[0] else 1
+    if sources.isdisjoint(seen[done]):
+        return seen[done]
+
+    # A source kept the small side; finish exploring the other one,
+    # stopping early if it holds a source too
+    queue, lost = queues[1 - done], seen[1 - done]
+    if not sources.isdisjoint(lost):
+        return None
+    while queue:
+        x = queue.popleft()
+        for y, d in adj[x].items():
+            if y not in lost and is_open(d):
+                if y in sources:
+                    return None
+                lost.add(y)
+                queue.append(y)
+    return lost
+
+
+def close_pipes(G, reachable, edges, source=None):
+    """
+    Marks the given pipes failed one at a time and updates reachable
+    (a set, modified in place). Returns the set of nodes that lost supply.
+    """
+    sources = set(source_nodes(G, source))
+    lost = set()
+
+    for u, v in edges:
+        G.edges[u, v]["status"] = "failed"
+
+        # An open pipe never joins a supplied node to an unsupplied one,
+        # so only pipes inside the supplied part can cut anything off
+        if u not in reachable or v not in reachable:
+            continue
+        count("bfs_traversals")
+        side = _cut_side(G, u, v, sources)
+        if side:
+            reachable.difference_update(side)
+            lost |= side
+
+    invalidate(G)
+    return lost
+
+
+def open_pipes(G, reachable, edges, status="healthy"):
+    """
+    Reopens the given pipes and updates reachable (a set, modified in
+    place). Returns the set of nodes that regained supply.
+    """
+    gained = set()
+
+    for u, v in edges:
+        G.edges[u, v]["status"] = status
+
+        if (u in reachable) == (v in reachable):
+            continue
+        start = v if u in reachable else u
+
+        # Search only the newly joined part: reachable acts as the boundary
+        found = _traverse(G, [start], set(), reachable)
+        reachable |= found
+        gained |= found
+
+    invalidate(G)
+    return gained
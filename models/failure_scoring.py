@@ -0,0 +1,176 @@
+import numpy as np
+
+from models.seismic_model import seismic_stress_batch
+from models.time_simulation import temporal_stress
+from models.ml_failure_model import predict_failure_probability_batch
+from models.compact_network import decode, is_compact
+from models.spatial_index import epicenter_distances, get_epicenter
+from instrumentation import count
+
+# ---------------------------
+# ML FEATURE MAPS
+# ---------------------------
+material_score = {
+    "CI": 0.8,
+    "DI": 0.5,
+    "PVC": 0.3
+}
+
+soil_score = {
+    "clay": 0.7,
+    "sand": 0.8,
+    "silt": 0.75,
+    "rock": 0.3
+}
+
+DEFAULT_MATERIAL_SCORE = 0.6
+DEFAULT_SOIL_SCORE = 0.4
+
+BACKBONE_PRESSURE_CAP = 100   # pipes above this are protected mains
+BACKBONE_PROTECTION = 0.85
+MIN_FAILURE_PROB = 0.05
+MAX_FAILURE_PROB = 1.0
+MISSING_LENGTH_SEED = 0
+
+# seismic_stress takes distance in units of 100 m, the scale of the
+# pipe length / 100 proxy used when there is no epicenter
+STRESS_DISTANCE_UNIT_KM = 0.1
+
+
+def map_scores(values, table, default):
+    """
+    Maps an array of category names to scores, one dict lookup per category.
+    """
+    uniques, inverse = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    scores = np.array([table.get(u, default) for u in uniques], dtype=float)
+    return scores[inverse]
+
+
+def score_pipes(length, soil, age, material, pressure_cap, magnitude, time_step, distance=None):
+    """
+    Scores every pipe in one pass.
+
+    All pipe attributes are passed as equal-length columns.
+    distance is each pipe's distance (km) from the epicenter; without
+    it (or where it is NaN) pipe length / 100 stands in for it.
+    time_step may be a scalar or a 1-D array of steps; in the latter
+    case results have shape (len(time_step), n_pipes). magnitude may
+    likewise be a 1-D array, adding a leading axis:
+    (len(magnitude), [len(time_step),] n_pipes).
+    Returns (stress, failure_prob) as float arrays.
+    """
+    length = np.asarray(length, dtype=float)
+    age = np.asarray(age, dtype=float)
+    pressure_cap = np.asarray(pressure_cap, dtype=float)
+
+    # Pipes without a length get a random (but reproducible) proxy distance
+    missing = np.isnan(length)
+    if missing.any():
+        rng = np.random.default_rng(MISSING_LENGTH_SEED)
+        length = length.copy()
+        length[missing] = rng.uniform(50, 200, size=missing.sum())
+
+    # A 1-D array of steps broadcasts as rows: (n_steps, n_pipes)
+    time_step = np.asarray(time_step, dtype=float)
+    if time_step.ndim == 1:
+        time_step = time_step[:, None]
+
+    # A 1-D array of magnitudes adds a leading axis in front of that
+    magnitude = np.asarray(magnitude, dtype=float)
+    if magnitude.ndim == 1:
+        magnitude = magnitude.reshape((-1,) + (1,) * max(time_step.ndim, 1))
+
+    if distance is None:
+        distance = length / 100
+    else:
+        distance = np.asarray(distance, dtype=float) / STRESS_DISTANCE_UNIT_KM
+        distance = np.where(np.isnan(distance), length / 100, distance)
+
+    base_stress = seismic_stress_batch(magnitude, distance, soil)
+    stress = temporal_stress(base_stress, time_step)
+
+    # ------------------------------------
+    # ML-based prediction (batched)
+    # ------------------------------------
+    features = np.broadcast_arrays(
+        stress,
+        age,
+        map_scores(material, material_score, DEFAULT_MATERIAL_SCORE),
+        map_scores(soil, soil_score, DEFAULT_SOIL_SCORE)
+    )
+    failure_prob = predict_failure_probability_batch(
+        np.column_stack([f.ravel() for f in features])
+    ).reshape(stress.shape)
+
+    # ---------------------------------
+    # BACKBONE PIPE PROTECTION
+    # ---------------------------------
+    failure_prob = np.where(
+        pressure_cap > BACKBONE_PRESSURE_CAP,
+        failure_prob * BACKBONE_PROTECTION,
+        failure_prob
+    )
+
+    # Time-based progressive damage
+    failure_prob = np.minimum(MAX_FAILURE_PROB, failure_prob * (1 + 0.05 * time_step))
+
+    # ---------------------------------
+    # SAFETY CLAMP
+    # ---------------------------------
+    failure_prob = np.clip(failure_prob, MIN_FAILURE_PROB, MAX_FAILURE_PROB)
+
+    count("edges_scored", failure_prob.size)
+    return stress, failure_prob
+
+
+def pipe_columns(G):
+    """
+    Extracts the scoring inputs of every pipe as columns, in G.edges order.
+    Includes epicenter distances when the twin has an epicenter.
+    """
+    if is_compact(G):
+        pipe = G["pipe"]
+        columns = {
+            "length": pipe["length"],
+            "soil": decode(G, "soil"),
+            "age": pipe["age"],
+            "material": decode(G, "material"),
+            "pressure_cap": pipe["pressure_cap"]
+        }
+    else:
+        edge_data = [d for _, _, d in G.edges(data=True)]
+        columns = {
+            "length": [d.get("length", np.nan) for d in edge_data],
+            "soil": [d["soil"] for d in edge_data],
+            "age": [d["age"] for d in edge_data],
+            "material": [d["material"] for d in edge_data],
+            "pressure_cap": [d.get("pressure_cap", 0) for d in edge_data]
+        }
+
+    if get_epicenter(G) is not None:
+        columns["distance"] = epicenter_distances(G)
+    return columns
+
+
+def write_scores(G, stress, failure_prob):
+    """
+    Writes per-pipe stress and failure_prob arrays (G.edges order) to G.
+    """
+    if is_compact(G):
+        G["pipe"]["stress"] = np.asarray(stress, dtype=float)
+        G["pipe"]["failure_prob"] = np.asarray(failure_prob, dtype=float)
+        return
+
+    for (_, _, d), s, p in zip(G.edges(data=True), stress.tolist(), failure_prob.tolist()):
+        d["stress"] = s
+        d["failure_prob"] = p
+
+
+def score_network(G, magnitude, time_step):
+    """
+    Scores all pipes of G and writes 'stress' and 'failure_prob'
+    back to the edges. Returns the failure probabilities in G.edges order.
+    """
+    stress, failure_prob = score_pipes(**pipe_columns(G), magnitude=magnitude, time_step=time_step)
+    write_scores(G, stress, failure_prob)
+    return failure_prob
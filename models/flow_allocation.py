@@ -0,0 +1,241 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import breadth_first_order, maximum_flow
+
+from models.compact_network import endpoint_arrays, is_compact, node_positions, topology_cached
+from models.connectivity import get_sources, source_nodes
+from models.hydraulic_model import open_pipes_mask
+from instrumentation import count
+
+# ==================================================
+# CAPACITY-AWARE ALLOCATION (PRIORITY-TIERED MAX FLOW)
+# ==================================================
+# Water moves from a super-source, limited to total_supply, through the
+# sources (limited to their capacities when known) and the open pipes
+# (each carrying at most its pressure_cap, in either direction) to the
+# nodes, each taking at most its demand.
+#
+# Priority comes first: one max flow per priority level, highest
+# first, each on the residual graph left by the levels above it, so a
+# lower level only gets what the higher ones cannot use and never
+# takes water away from them. Pipes without a pressure_cap (e.g.
+# emergency reroutes) are not capacity-limited.
+#
+# Bottlenecks are the open pipes on the final minimum cut: saturated
+# pipes separating the nodes water can still reach from those it
+# cannot, where extra capacity would let more demand be served.
+#
+# scipy's max flow needs integer capacities, so volumes are rounded to
+# 1 / FLOW_RESOLUTION supply units (coarser when the deliverable volume,
+# the smaller of the supply and the total demand, is very large; the
+# result reports the resolution used).
+FLOW_RESOLUTION = 1000
+MAX_CAPACITY = 2 ** 30
+
+
+# ------------------------------------
+# NETWORK ARRAYS
+# ------------------------------------
+def _build_arrays(G):
+    nodes, u, v = endpoint_arrays(G)
+    if is_compact(G):
+        node, pipe = G["node"], G["pipe"]
+        capacity = pipe["pressure_cap"].astype(float)
+        demand = node["demand"].astype(float)
+        priority = node["priority"].astype(np.int64)
+    else:
+        capacity = np.array([d.get("pressure_cap", np.nan) for _, _, d in G.edges(data=True)], dtype=float)
+        node_data = [d for _, d in G.nodes(data=True)]
+        demand = np.array([d.get("demand", 0) for d in node_data], dtype=float)
+        priority = np.array([d.get("priority", 0) for d in node_data], dtype=np.int64)
+
+    demand = np.nan_to_num(demand)
+    levels = np.unique(priority[demand > 0])[::-1]
+    return {
+        "nodes": nodes,
+        "u": u,
+        "v": v,
+        "capacity": capacity,
+        "demand": demand,
+        "priority": priority,
+        "levels": levels,
+        "tier": np.searchsorted(-levels, -priority)
+    }
+
+
+def flow_arrays(G):
+    """
+    Static per-node and per-pipe allocation inputs (G.nodes / G.edges
+    order); see compact_network.topology_cached.
+    """
+    return topology_cached(G, "flow_arrays", _build_arrays)
+
+
+def _source_capacities(G, arrays, source):
+    sources = list(source_nodes(G, source))
+    if is_compact(G):
+        index = node_positions(G, sources)
+    else:
+        positions = {n: i for i, n in enumerate(arrays["nodes"].tolist())}
+        index = np.array([positions[s] for s in sources], dtype=np.int64)
+    capacities = get_sources(G)
+    limits = np.array([
+        np.inf if capacities.get(s) is None else capacities[s] for s in sources
+    ], dtype=float)
+    return index, limits
+
+
+# ------------------------------------
+# FLOW GRAPH
+# ------------------------------------
+def _capacity_graph(arrays, is_open, sources, limits, total_supply, scale):
+    """
+    Integer capacity matrix over the nodes, the super-source (n), the
+    supply node behind it (n + 1) and one sink per priority level
+    (n + 2 + k).
+    """
+    n = len(arrays["demand"])
+    n_levels = len(arrays["levels"])
+    cap = total_supply * scale
+
+    pipes = np.flatnonzero(is_open & (arrays["u"] != arrays["v"]))
+    pu, pv = arrays["u"][pipes], arrays["v"][pipes]
+    pipe_cap = np.nan_to_num(arrays["capacity"][pipes] * scale, nan=cap)
+
+    takers = np.flatnonzero((arrays["demand"] > 0) & (arrays["tier"] < n_levels))
+
+    rows = np.concatenate([pu, pv, [n], np.full(len(sources), n + 1), takers])
+    cols = np.concatenate([pv, pu, [n + 1], sources, n + 2 + arrays["tier"][takers]])
+    data = np.concatenate([
+        pipe_cap, pipe_cap, [cap],
+        np.minimum(limits * scale, cap),
+        arrays["demand"][takers] * scale
+    ])
+    data = np.rint(np.clip(data, 0, MAX_CAPACITY)).astype(np.int64)
+
+    # Parallel pipes add up into one arc
+    size = n + 2 + n_levels
+    graph = coo_matrix((data, (rows, cols)), shape=(size, size)).tocsr()
+    graph.data = np.minimum(graph.data, MAX_CAPACITY).astype(np.int32)
+    graph.eliminate_zeros()
+    return graph, pipes, takers
+
+
+def _residual(capacity, flow):
+    residual = (capacity - flow).tocsr()
+    residual.data = residual.data.astype(np.int32)
+    residual.eliminate_zeros()
+    return residual
+
+
+def _entries(matrix, rows, cols):
+    if not len(rows):
+        return np.zeros(0)
+    return np.asarray(matrix[rows, cols], dtype=float).ravel()
+
+
+def _reachable(graph, start):
+    reached = np.zeros(graph.shape[0], dtype=bool)
+    reached[breadth_first_order(graph, start, directed=True, return_predecessors=False)] = True
+    return reached
+
+
+# ------------------------------------
+# SOLVER
+# ------------------------------------
+def _reusable(warm, is_open, total_supply, sources):
+    """
+    A previous solution stays optimal when nothing reopened and every
+    newly closed pipe carried no water: the feasible flows only shrank
+    and the old optimum is still one of them.
+    """
+    if warm is None or warm["total_supply"] != total_supply or warm["sources"] != sources:
+        return False
+    previous = warm["is_open"]
+    if len(previous) != len(is_open) or (is_open & ~previous).any():
+        return False
+    closed = previous & ~is_open
+    return not np.nan_to_num(warm["flow"][closed]).any()
+
+
+def flow_allocation(G, total_supply, source=None, warm=None, is_open=None):
+    """
+    Capacity-aware allocation of total_supply: priority levels served
+    highest first, each by a max flow on what the levels above left.
+
+    warm: a previous result of this function on the same network
+    (e.g. the last time step), reused when no pipe that carried water
+    changed. is_open: optional open-pipe mask (G.edges order) instead
+    of reading pipe statuses.
+
+    Returns a dict with "allocation" ({node: delivered} for nodes
+    connected to a source), "delivered" (G.nodes order), "flow" (net
+    pipe flow u -> v, G.edges order, NaN on closed pipes),
+    "bottlenecks" (pipe indices, G.edges order), "tiers"
+    ([(priority, demand, delivered)], highest first) and "resolution"
+    (the volume step flows were counted in).
+    """
+    arrays = flow_arrays(G)
+    n = len(arrays["demand"])
+    is_open = open_pipes_mask(G) if is_open is None else np.asarray(is_open, dtype=bool)
+    sources, limits = _source_capacities(G, arrays, source)
+    sources_key = tuple(sources.tolist())
+
+    # No more than the total demand can flow, so a larger supply does
+    # not coarsen the resolution
+    deliverable = min(total_supply, arrays["demand"].sum())
+    scale = min(FLOW_RESOLUTION, MAX_CAPACITY / max(deliverable, 1))
+    capacity, pipes, takers = _capacity_graph(arrays, is_open, sources, limits, total_supply, scale)
+
+    if _reusable(warm, is_open, total_supply, sources_key):
+        flow = warm["flow_matrix"]
+    else:
+        flow = coo_matrix(capacity.shape, dtype=np.int32).tocsr()
+        supplied_total = 0
+        for k in range(len(arrays["levels"])):
+            if supplied_total >= capacity[n, n + 1]:
+                break
+            count("max_flow_runs")
+            result = maximum_flow(_residual(capacity, flow), n, n + 2 + k, method="dinic")
+            flow = (flow + result.flow).tocsr()
+            supplied_total += result.flow_value
+
+    # ---------------------------
+    # RESULTS (full-size arrays)
+    # ---------------------------
+    delivered = np.zeros(n)
+    delivered[takers] = _entries(flow, takers, n + 2 + arrays["tier"][takers]) / scale
+
+    # Parallel pipes share their summed arc's flow by capacity
+    pu, pv = arrays["u"][pipes], arrays["v"][pipes]
+    arc_flow = _entries(flow, pu, pv)
+    arc_cap = _entries(capacity, pu, pv)
+    own_cap = np.nan_to_num(arrays["capacity"][pipes] * scale, nan=np.inf)
+    share = np.divide(np.minimum(own_cap, arc_cap), arc_cap, out=np.zeros(len(pipes)), where=arc_cap > 0)
+    pipe_flow = np.full(len(arrays["u"]), np.nan)
+    pipe_flow[pipes] = arc_flow * share / scale
+
+    reached = _reachable(_residual(capacity, flow), n)
+    bottlenecks = pipes[reached[pu] != reached[pv]]
+
+    connected = np.flatnonzero(_reachable(capacity, n + 1)[:n])
+    nodes = arrays["nodes"]
+    allocation = dict(zip(nodes[connected].tolist(), delivered[connected].tolist()))
+
+    tiers = []
+    for k, level in enumerate(arrays["levels"].tolist()):
+        members = arrays["tier"] == k
+        tiers.append((level, float(arrays["demand"][members].sum()), float(delivered[members].sum())))
+
+    return {
+        "allocation": allocation,
+        "delivered": delivered,
+        "flow": pipe_flow,
+        "bottlenecks": bottlenecks,
+        "tiers": tiers,
+        "resolution": 1 / scale,
+        "total_supply": total_supply,
+        "sources": sources_key,
+        "is_open": is_open,
+        "flow_matrix": flow
+    }
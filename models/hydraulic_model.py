@@ -0,0 +1,318 @@
+import warnings
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import spsolve
+
+from models.compact_network import FAILED, decode, endpoint_arrays, is_compact, node_positions, topology_cached
+from models.connectivity import source_nodes
+from instrumentation import count
+
+# ==================================================
+# STEADY-STATE HYDRAULICS (HAZEN-WILLIAMS, GGA)
+# ==================================================
+# Heads and flows over the open pipes of the supplied part of the
+# network, solved with the global gradient algorithm (Todini-Pilati,
+# as in EPANET): every Newton step solves one sparse symmetric system
+# in the junction heads. Sources hold a fixed head; pipes and nodes cut
+# off from every source carry no flow and get no head.
+#
+# Demand is pressure-driven (Wagner, as EPANET 2.2's PDA): a node takes
+# its full demand at MIN_PRESSURE_REQUIRED or above, nothing at
+# MIN_DELIVERY_PRESSURE or below, and ((p - P0) / (Pf - P0)) ** 0.5 of
+# it in between. Each node's delivery is solved as a flow to a
+# reservoir at MIN_DELIVERY_PRESSURE above the node, with barrier
+# gradients outside [0, demand], so a network that cannot carry its
+# demand delivers less instead of reaching negative pressures.
+#
+# Units: heads and pressures in metres (the scale of pressure_cap and
+# MIN_PRESSURE_REQUIRED), flows in m^3/s, lengths and diameters in m.
+# Node demand is a daily volume in m^3: the 40-150 per node of the
+# bundled and generated data are city blocks, which the 150-400 mm
+# mains carry with little loss, while long thin branches and rerouted
+# supply lose pressure.
+MIN_PRESSURE_REQUIRED = 80    # minimum service pressure (m), full demand from here
+MIN_DELIVERY_PRESSURE = 0     # no delivery at or below this pressure (m)
+SOURCE_HEAD = 150             # head held at every source (m)
+
+DEMAND_UNIT = 1 / 86400       # m^3/day -> m^3/s
+
+# Pipe size from its pressure class: higher classes are larger mains
+PRESSURE_CLASSES = (60, 80, 120, 150)
+CLASS_DIAMETERS = (0.15, 0.20, 0.30, 0.40)
+
+# Hazen-Williams roughness, lost with age
+HAZEN_WILLIAMS_C = {
+    "CI": 100,
+    "DI": 130,
+    "PVC": 150
+}
+DEFAULT_C = 120
+C_LOSS_PER_YEAR = 0.5
+MIN_C = 60
+
+HW_EXPONENT = 1.852
+HW_COEFFICIENT = 10.67
+
+# Newton iterations stop once sum|dQ| / sum|Q| falls below ACCURACY
+ACCURACY = 1e-3
+MAX_ITERATIONS = 40
+MIN_GRADIENT = 1e-7           # keeps zero-flow pipes in the system (as EPANET)
+BARRIER_GRADIENT = 1e8        # holds delivery within [0, demand] (as EPANET)
+PDD_EXPONENT = 0.5
+START_VELOCITY = 0.3          # m/s, initial flow guess without a warm start
+
+
+def pipe_resistance(length, material, age, pressure_cap):
+    """
+    Hazen-Williams resistance r (headloss = r * Q|Q|^0.852) and
+    diameter of every pipe.
+    """
+    length = np.nan_to_num(np.asarray(length, dtype=float), nan=1.0)
+    age = np.nan_to_num(np.asarray(age, dtype=float), nan=0.0)
+
+    uniques, inverse = np.unique(np.asarray(material, dtype=object).astype(str), return_inverse=True)
+    c_new = np.array([HAZEN_WILLIAMS_C.get(m, DEFAULT_C) for m in uniques], dtype=float)[inverse]
+    roughness = np.maximum(MIN_C, c_new - C_LOSS_PER_YEAR * age)
+
+    diameter = np.interp(np.asarray(pressure_cap, dtype=float), PRESSURE_CLASSES, CLASS_DIAMETERS)
+    resistance = HW_COEFFICIENT * np.maximum(length, 1.0) / (
+        roughness ** HW_EXPONENT * diameter ** 4.87
+    )
+    return resistance, diameter
+
+
+# ------------------------------------
+# NETWORK ARRAYS
+# ------------------------------------
+def _build_arrays(G):
+    nodes, u, v = endpoint_arrays(G)
+    if is_compact(G):
+        node, pipe = G["node"], G["pipe"]
+        material = decode(G, "material")
+        length, age, cap = pipe["length"], pipe["age"], pipe["pressure_cap"]
+        demand = node["demand"].astype(float)
+        elevation = node["elevation"] if "elevation" in node else np.zeros(len(nodes))
+    else:
+        pipe_data = [d for _, _, d in G.edges(data=True)]
+        material = [d.get("material") for d in pipe_data]
+        length = [d.get("length", np.nan) for d in pipe_data]
+        age = [d.get("age", 0) for d in pipe_data]
+        cap = [d.get("pressure_cap", 0) for d in pipe_data]
+        node_data = [d for _, d in G.nodes(data=True)]
+        demand = np.array([d.get("demand", 0) for d in node_data], dtype=float)
+        elevation = np.array([d.get("elevation", 0.0) for d in node_data], dtype=float)
+
+    resistance, diameter = pipe_resistance(length, material, age, cap)
+    return {
+        "nodes": nodes,
+        "u": u,
+        "v": v,
+        "resistance": resistance,
+        "diameter": diameter,
+        "demand": demand * DEMAND_UNIT,
+        "elevation": np.nan_to_num(np.asarray(elevation, dtype=float))
+    }
+
+
+def hydraulic_arrays(G):
+    """
+    Static per-node and per-pipe hydraulic inputs (G.nodes / G.edges
+    order); see compact_network.topology_cached.
+    """
+    return topology_cached(G, "hydraulic_arrays", _build_arrays)
+
+
+def open_pipes_mask(G):
+    """
+    Pipes that carry water (not failed), in G.edges order.
+    """
+    if is_compact(G):
+        return G["pipe"]["status"] != FAILED
+    return np.fromiter(
+        (d.get("status") != "failed" for _, _, d in G.edges(data=True)),
+        dtype=bool,
+        count=G.number_of_edges()
+    )
+
+
+def _delivery_loss(delivered, demand):
+    """
+    Pressure above MIN_DELIVERY_PRESSURE needed for each delivery
+    (m^3/s) and its gradient, with barriers below 0 and above demand
+    (EPANET's demandheadloss).
+    """
+    span = MIN_PRESSURE_REQUIRED - MIN_DELIVERY_PRESSURE
+    n = 1 / PDD_EXPONENT
+    ratio = delivered / demand
+    partial = (ratio > 0) & (ratio < 1)
+
+    gradient = np.full(len(ratio), BARRIER_GRADIENT)
+    gradient[partial] = np.maximum(n * span * ratio[partial] ** (n - 1) / demand[partial], MIN_GRADIENT)
+
+    loss = np.where(ratio <= 0, BARRIER_GRADIENT * delivered, span + BARRIER_GRADIENT * (delivered - demand))
+    loss[partial] = gradient[partial] * delivered[partial] / n
+    return loss, gradient
+
+
+def _source_index(G, arrays, source):
+    sources = list(source_nodes(G, source))
+    if is_compact(G):
+        return node_positions(G, sources)
+    index = {n: i for i, n in enumerate(arrays["nodes"].tolist())}
+    return np.array([index[s] for s in sources], dtype=np.int64)
+
+
+# ------------------------------------
+# SOLVER
+# ------------------------------------
+def solve_hydraulics(G, source=None, warm=None, is_open=None):
+    """
+    Steady-state heads and flows of G.
+
+    warm: a previous result of this function on the same network
+    (e.g. the last time step); its flows start the Newton iterations.
+    is_open: optional open-pipe mask (G.edges order) instead of
+    reading pipe statuses.
+
+    Returns a dict of arrays "head", "pressure" (G.nodes order, NaN
+    where unsupplied), "delivered" (demand met, in the node demand's
+    units), "flow" (G.edges order, m^3/s, NaN on closed or cut-off
+    pipes), "served" (supplied and at or above MIN_PRESSURE_REQUIRED,
+    i.e. given its full demand), plus "iterations" and "converged"
+    (a RuntimeWarning is issued when MAX_ITERATIONS is reached first).
+    """
+    arrays = hydraulic_arrays(G)
+    is_open = open_pipes_mask(G) if is_open is None else np.asarray(is_open, dtype=bool)
+    return solve_arrays(arrays, _source_index(G, arrays, source), is_open, warm)
+
+
+def solve_arrays(arrays, sources, is_open, warm=None):
+    """
+    solve_hydraulics on hydraulic_arrays output, with the sources as
+    node positions and an open-pipe mask (for callers that hold the
+    arrays without the network, e.g. ensemble workers).
+    """
+    u, v = arrays["u"], arrays["v"]
+    n_nodes = len(arrays["demand"])
+
+    # Supplied nodes: components of the open pipes holding a source
+    count("bfs_traversals")
+    graph = coo_matrix(
+        (np.ones(is_open.sum(), dtype=np.int8), (u[is_open], v[is_open])),
+        shape=(n_nodes, n_nodes)
+    )
+    _, labels = connected_components(graph, directed=False)
+    supplied = np.isin(labels, labels[sources])
+
+    fixed = np.zeros(n_nodes, dtype=bool)
+    fixed[sources] = True
+    junctions = np.flatnonzero(supplied & ~fixed)
+    column = np.full(n_nodes, -1, dtype=np.int64)
+    column[junctions] = np.arange(len(junctions))
+
+    active = np.flatnonzero(is_open & supplied[u])
+    pu, pv = u[active], v[active]
+    ju, jv = column[pu], column[pv]
+    r = arrays["resistance"][active]
+
+    # Fixed heads enter each pipe's energy equation as a constant
+    fixed_head = np.where(fixed, SOURCE_HEAD, 0.0)
+    head_fixed = fixed_head[pu] - fixed_head[pv]
+
+    # Deliveries: junctions with demand draw towards a reservoir at
+    # MIN_DELIVERY_PRESSURE above them
+    demand = arrays["demand"][junctions]
+    takers = np.flatnonzero(demand > 0)
+    outlet_head = arrays["elevation"][junctions][takers] + MIN_DELIVERY_PRESSURE
+
+    # ---------------------------
+    # STARTING FLOWS
+    # ---------------------------
+    flow = START_VELOCITY * np.pi * arrays["diameter"][active] ** 2 / 4
+    delivered = demand.copy()
+    if warm is not None and len(warm["flow"]) == len(u):
+        previous = warm["flow"][active]
+        flow = np.where(np.isnan(previous), flow, previous)
+        delivered = warm["delivered"][junctions] * DEMAND_UNIT
+
+    # Node-pipe incidence pattern of the junction system, built once
+    in_u, in_v = ju >= 0, jv >= 0
+    both = in_u & in_v
+    rows = np.concatenate([ju[in_u], jv[in_v], ju[both], jv[both], takers])
+    cols = np.concatenate([ju[in_u], jv[in_v], jv[both], ju[both], takers])
+
+    heads = np.zeros(len(junctions))
+    converged = not len(active)
+    iterations = 0
+
+    while not converged and iterations < MAX_ITERATIONS:
+        iterations += 1
+        count("hydraulic_iterations")
+
+        magnitude = np.abs(flow)
+        loss = r * flow * magnitude ** (HW_EXPONENT - 1)
+        gradient = np.maximum(HW_EXPONENT * r * magnitude ** (HW_EXPONENT - 1), MIN_GRADIENT)
+        g = 1.0 / gradient
+
+        # (A^T G^-1 A) H = -d - A^T (Q + G^-1 (A_F H_F - f(Q))), with
+        # each delivery d entering as one more pipe to its outlet
+        carried = flow + g * (head_fixed - loss)
+        delivery_loss, delivery_gradient = _delivery_loss(delivered[takers], demand[takers])
+        rhs = -delivered.copy()
+        rhs[takers] += (delivery_loss + outlet_head) / delivery_gradient
+        np.subtract.at(rhs, ju[in_u], carried[in_u])
+        np.add.at(rhs, jv[in_v], carried[in_v])
+
+        if len(junctions):
+            system = coo_matrix(
+                (np.concatenate([g[in_u], g[in_v], -g[both], -g[both], 1.0 / delivery_gradient]), (rows, cols)),
+                shape=(len(junctions), len(junctions))
+            ).tocsc()
+            heads = np.atleast_1d(spsolve(system, rhs, permc_spec="MMD_AT_PLUS_A"))
+
+        # Flow correction from the new heads
+        head_u = np.where(in_u, heads[np.maximum(ju, 0)], 0.0)
+        head_v = np.where(in_v, heads[np.maximum(jv, 0)], 0.0)
+        step = g * (head_u - head_v + head_fixed - loss)
+        flow = flow + step
+        delivery_step = (delivery_loss - (heads[takers] - outlet_head)) / delivery_gradient
+        delivered[takers] -= delivery_step
+
+        change = np.abs(step).sum() + np.abs(delivery_step).sum()
+        converged = change <= ACCURACY * max(np.abs(flow).sum() + delivered.sum(), 1e-12)
+
+    if not converged:
+        warnings.warn(
+            f"Hydraulic solve stopped after {MAX_ITERATIONS} iterations without converging; "
+            "heads and flows are approximate",
+            RuntimeWarning,
+            stacklevel=2
+        )
+
+    # ---------------------------
+    # RESULTS (full-size arrays)
+    # ---------------------------
+    head = np.full(n_nodes, np.nan)
+    head[fixed] = SOURCE_HEAD
+    head[junctions] = heads
+    pressure = head - arrays["elevation"]
+
+    pipe_flow = np.full(len(u), np.nan)
+    pipe_flow[active] = flow
+
+    met = np.zeros(n_nodes)
+    met[fixed] = arrays["demand"][fixed] / DEMAND_UNIT
+    met[junctions] = np.clip(delivered, 0, demand) / DEMAND_UNIT
+
+    return {
+        "head": head,
+        "pressure": pressure,
+        "delivered": met,
+        "flow": pipe_flow,
+        "supplied": supplied,
+        "served": supplied & (fixed | (pressure >= MIN_PRESSURE_REQUIRED)),
+        "iterations": iterations,
+        "converged": bool(converged)
+    }
@@ -1,11 +1,17 @@
+import os
 import numpy as np
-from sklearn.linear_model import LogisticRegression
 
-#Prevents dominance of large-scale features (e.g., length vs soil).
-
-from sklearn.preprocessing import StandardScaler
+# ------------------------------------
+# MODEL ARTIFACT
+# ------------------------------------
+# The fitted model is stored as plain NumPy arrays so workers and
+# Streamlit reruns can load it without retraining or importing sklearn.
+MODEL_VERSION = 1
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts")
+MODEL_PATH = os.path.join(MODEL_DIR, f"failure_model_v{MODEL_VERSION}.npz")
 
 # Example training data (In real deployment, it would be trained on historical pipe failure records.)
+# Features: [stress, age, material_score, soil_score]
 X_train = np.array([
     [0.2, 10, 0.3, 0.2],
     [0.8, 40, 0.8, 0.7],
@@ -13,30 +19,125 @@ X_train = np.array([
     [0.9, 50, 0.9, 0.8]
 ])
 
-scaler = StandardScaler()
-X_train = scaler.fit_transform(X_train)
+y_train = [0, 1, 1, 1]
 
-model = LogisticRegression()
 
-y_train = [0, 1, 1, 1]
-model.fit(X_train, y_train)
+def train_model():
+    """
+    Fits the StandardScaler + LogisticRegression pair and returns
+    its parameters as NumPy arrays. sklearn is only needed here.
+    """
+    from sklearn.linear_model import LogisticRegression
+
+    #Prevents dominance of large-scale features (e.g., length vs soil).
+    from sklearn.preprocessing import StandardScaler
+
+    scaler = StandardScaler()
+    X = scaler.fit_transform(X_train)
+
+    clf = LogisticRegression()
+    clf.fit(X, y_train)
+
+    return {
+        "version": MODEL_VERSION,
+        "mean": scaler.mean_,
+        "scale": scaler.scale_,
+        "coef": clf.coef_[0],
+        "intercept": float(clf.intercept_[0])
+    }
 
-def predict_failure_probability(stress, age, material, soil):
 
+def save_model(params, path=MODEL_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(
+        path,
+        version=np.array(params["version"]),
+        mean=params["mean"],
+        scale=params["scale"],
+        coef=params["coef"],
+        intercept=np.array(params["intercept"])
+    )
+
+
+def load_model(path=MODEL_PATH):
     """
-    Predicts probability of pipe failure.
+    Loads a saved model artifact.
+    Returns None if it is missing or was written by another MODEL_VERSION.
+    """
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path, allow_pickle=False) as data:
+        if int(data["version"]) != MODEL_VERSION:
+            return None
+
+        return {
+            "version": MODEL_VERSION,
+            "mean": data["mean"],
+            "scale": data["scale"],
+            "coef": data["coef"],
+            "intercept": float(data["intercept"])
+        }
+
+
+def _fold_scaler(params):
+    """
+    Folds standardization into the linear model so inference is
+    one dot product: (x - mean) / scale @ coef + b == x @ w + b'.
+    """
+    weights = params["coef"] / params["scale"]
+    bias = params["intercept"] - float(np.dot(params["mean"], weights))
+    return weights, bias
+
+
+def _init_model():
+    params = load_model()
+
+    if params is None:
+        try:
+            params = train_model()
+        except ImportError:
+            return None
+
+        try:
+            save_model(params)
+        except OSError:
+            pass   # read-only install: keep the in-memory model
+
+    return params
+
+
+model = _init_model()
+
+if model is not None:
+    _weights, _bias = _fold_scaler(model)
+
+
+def predict_failure_probability_batch(X):
+    """
+    Predicts failure probability for an (n, 4) array of
+    [stress, age, material, soil] rows.
     Falls back to deterministic rule if ML model is unavailable.
     """
+    X = np.asarray(X, dtype=float)
 
     # ------------------------------------
-    # STEP 3: Deterministic fallback
+    # Deterministic fallback
     # ------------------------------------
     if model is None:
-        # Simple risk-based estimation
-        return min(0.9, stress * 0.3)
+        return np.minimum(0.9, X[:, 0] * 0.3)
 
     # ------------------------------------
-    # ML-based prediction
+    # ML-based prediction: linear score + sigmoid
     # ------------------------------------
-    X = scaler.transform([[stress, age, material, soil]])
-    return model.predict_proba(X)[0][1]   # Probability of failure
\ No newline at end of file
+    z = X @ _weights + _bias
+    return 0.5 * (1.0 + np.tanh(0.5 * z))   # numerically stable sigmoid
+
+
+def predict_failure_probability(stress, age, material, soil):
+
+    """
+    Predicts probability of pipe failure.
+    Falls back to deterministic rule if ML model is unavailable.
+    """
+    return float(predict_failure_probability_batch([[stress, age, material, soil]])[0])
@@ -1,57 +1,186 @@
-import random
+import os
+import numpy as np
 import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components, minimum_spanning_tree
+from scipy.spatial import cKDTree
+
+from digital_twin import DATA_DIR
+from export import write_table
+
+EARTH_RADIUS_M = 6371000.0
+
+MATERIALS = np.array(["CI", "DI", "PVC"])
+SOILS = np.array(["rock", "clay", "sand"])
+
+K_NEIGHBORS = 4        # candidate mains per node (spatial k-nearest neighbours)
+LOOP_FRACTION = 0.3    # share of non-tree candidates kept to form loops
+CHUNK_SIZE = 500_000   # rows per write when saving
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in metres (vectorized).
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def _local_xy(lat, lon, center_lat, center_lon):
+    """
+    Equirectangular projection to metres around the network centre,
+    accurate enough for neighbour search at city scale.
+    """
+    x = np.radians(lon - center_lon) * EARTH_RADIUS_M * np.cos(np.radians(center_lat))
+    y = np.radians(lat - center_lat) * EARTH_RADIUS_M
+    return np.column_stack([x, y])
+
+
+def _looped_mains(xy, k, loop_fraction, rng):
+    """
+    Builds pipe endpoints (i < j): a minimum spanning tree over the
+    k-nearest-neighbour graph, links joining any isolated clusters to
+    the main one, and a random share of the remaining kNN links as loops.
+    """
+    n = len(xy)
+    if n < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    k = min(k, n - 1)
+    tree = cKDTree(xy)
+    dist, nbr = tree.query(xy, k=k + 1)
+
+    # Candidate links, deduplicated as (min, max) pairs
+    i = np.repeat(np.arange(n), k)
+    j = nbr[:, 1:].ravel()
+    d = dist[:, 1:].ravel()
+    lo, hi = np.minimum(i, j), np.maximum(i, j)
+    pair = lo * n + hi
+    pair, first = np.unique(pair, return_index=True)
+    lo, hi, d = lo[first], hi[first], d[first]
+
+    # Spanning tree (shortest mains first); tiny offset keeps zero lengths as edges
+    graph = coo_matrix((d + 1e-9, (lo, hi)), shape=(n, n)).tocsr()
+    mst = minimum_spanning_tree(graph).tocoo()
+    tree_u = np.minimum(mst.row, mst.col).astype(np.int64)
+    tree_v = np.maximum(mst.row, mst.col).astype(np.int64)
+
+    # Join every other cluster to the largest one via its nearest node
+    n_comp, labels = connected_components(mst, directed=False)
+    if n_comp > 1:
+        main = np.bincount(labels).argmax()
+        main_nodes = np.flatnonzero(labels == main)
+        _, rep = np.unique(labels, return_index=True)
+        rep = rep[labels[rep] != main]
+        _, nearest = cKDTree(xy[main_nodes]).query(xy[rep])
+        link = main_nodes[nearest]
+        tree_u = np.concatenate([tree_u, np.minimum(rep, link)])
+        tree_v = np.concatenate([tree_v, np.maximum(rep, link)])
+
+    # Loops: non-tree candidates kept with probability loop_fraction
+    in_tree = np.isin(pair, tree_u * n + tree_v)
+    loops = ~in_tree & (rng.random(len(pair)) < loop_fraction)
+
+    u = np.concatenate([tree_u, lo[loops]])
+    v = np.concatenate([tree_v, hi[loops]])
+    order = np.argsort(v, kind="stable")
+    return u[order], v[order]
+
+
+def _chunks(columns, prefixes, chunk_size):
+    """
+    Yields DataFrame slices of the column arrays, turning integer ids
+    into "N12"/"P7" style labels one chunk at a time.
+    """
+    total = len(next(iter(columns.values())))
+    for start in range(0, max(total, 1), chunk_size):
+        part = {k: col[start:start + chunk_size] for k, col in columns.items()}
+        for k, prefix in prefixes.items():
+            part[k] = np.char.add(prefix, part[k].astype(str))
+        yield pd.DataFrame(part)
 
 
 def generate_network(
     n_nodes=25,
     center_lat=23.26,
     center_lon=77.41,
-    radius=0.01
+    radius=0.01,
+    seed=None,
+    k_neighbors=K_NEIGHBORS,
+    loop_fraction=LOOP_FRACTION,
+    output_dir=DATA_DIR,
+    formats=("csv",),
+    chunk_size=CHUNK_SIZE
 ):
-    nodes = []
-    pipes = []
+    """
+    Generates a synthetic, connected, looped network and writes
+    nodes/pipes tables to output_dir in each of formats ("csv", "parquet").
+    Returns (number of nodes, number of pipes).
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, n_nodes + 1)
 
     # -----------------------
     # CREATE NODES
     # -----------------------
-    for i in range(1, n_nodes + 1):
-        if i == 1:
-            node_type = "critical"   # N1 = SOURCE
-        elif i <= 3:
-            node_type = "critical"
-        else:
-            node_type = "residential"
-
-        nodes.append({
-            "node_id": f"N{i}",
-            "type": node_type,
-            "demand": random.randint(40, 150),
-            "priority": 5 if i == 1 else (
-                random.randint(4, 5) if node_type == "critical" else random.randint(1, 3)
-        ),            
-            "lat": center_lat + random.uniform(-radius, radius),
-            "lon": center_lon + random.uniform(-radius, radius)
-        })
+    # N1 = SOURCE, N1..N3 critical, the rest residential
+    critical = ids <= 3
+    priority = np.where(critical, rng.integers(4, 6, n_nodes), rng.integers(1, 4, n_nodes))
+    priority[0] = 5
+
+    lat = center_lat + rng.uniform(-radius, radius, n_nodes)
+    lon = center_lon + rng.uniform(-radius, radius, n_nodes)
+
+    nodes = {
+        "node_id": ids,
+        "type": np.where(critical, "critical", "residential"),
+        "demand": rng.integers(40, 151, n_nodes),
+        "priority": priority,
+        "lat": lat,
+        "lon": lon
+    }
 
     # -----------------------
-    # CREATE PIPES
+    # CREATE PIPES (looped mains)
     # -----------------------
-    for i in range(2, n_nodes + 1):
-        pipes.append({
-            "pipe_id": f"P{i}",
-            "from": f"N{random.randint(1, i - 1)}",
-            "to": f"N{i}",
-            "length": random.randint(200, 800),
-            "material": random.choice(["CI", "DI", "PVC"]),
-            "age": random.randint(5, 50),
-            "soil": random.choice(["rock", "clay", "sand"]),
-            "pressure_cap": random.randint(70, 130)
-        })
+    u, v = _looped_mains(
+        _local_xy(lat, lon, center_lat, center_lon),
+        k_neighbors,
+        loop_fraction,
+        rng
+    )
+    n_pipes = len(u)
+
+    pipes = {
+        "pipe_id": np.arange(1, n_pipes + 1),
+        "from": u + 1,
+        "to": v + 1,
+        "length": np.maximum(1, np.rint(haversine_m(lat[u], lon[u], lat[v], lon[v]))).astype(np.int64),
+        "material": MATERIALS[rng.integers(0, len(MATERIALS), n_pipes)],
+        "age": rng.integers(5, 51, n_pipes),
+        "soil": SOILS[rng.integers(0, len(SOILS), n_pipes)],
+        "pressure_cap": rng.integers(70, 131, n_pipes)
+    }
 
     # -----------------------
-    # SAVE TO CSV (IMPORTANT)
+    # SAVE (IMPORTANT)
     # -----------------------
-    pd.DataFrame(nodes).to_csv("data/nodes.csv", index=False)
-    pd.DataFrame(pipes).to_csv("data/pipes.csv", index=False)
+    os.makedirs(output_dir, exist_ok=True)
+    for fmt in formats:
+        ext = "parquet" if fmt == "parquet" else "csv"
+        write_table(
+            _chunks(nodes, {"node_id": "N"}, chunk_size),
+            os.path.join(output_dir, f"nodes.{ext}"),
+            fmt
+        )
+        write_table(
+            _chunks(pipes, {"pipe_id": "P", "from": "N", "to": "N"}, chunk_size),
+            os.path.join(output_dir, f"pipes.{ext}"),
+            fmt
+        )
 
-    return len(nodes), len(pipes)
+    return n_nodes, n_pipes
@@ -1,25 +1,161 @@
+import itertools
+from heapq import heappop, heappush
+
 import networkx as nx
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from models.compact_network import csr_graph, is_compact, node_positions
+from models.connectivity import invalidate, is_open, pipe_network, reachable_nodes, source_nodes, supplied_mask
+from instrumentation import count
+
+RISK_PENALTY = 50
+PRIORITY_BONUS = 20
+
+# The priority bonus can push a pipe's cost below zero, which Dijkstra
+# cannot handle (and which would reward looping through high-priority
+# nodes). Directed costs are clamped to this floor; routes are unchanged
+# whenever every cost is already non-negative.
+MIN_ROUTE_WEIGHT = 0.0
 
 def edge_weight(G, u, v):
     edge = G.edges[u, v]
     return (
         edge['length']
-        + 50 * edge.get('risk', 0)
-        - 20 * G.nodes[v]['priority']
+        + RISK_PENALTY * edge.get('risk', 0)
+        - PRIORITY_BONUS * G.nodes[v]['priority']
     )
 
+def route_weights(G):
+    """
+    Materializes the cost of travelling every open pipe in both
+    directions once: {(u, v): cost}. Entering v earns v's priority bonus.
+    """
+    bonus = {
+        n: PRIORITY_BONUS * d.get('priority', 0)
+        for n, d in G.nodes(data=True)
+    }
+
+    weights = {}
+    for u, v, d in G.edges(data=True):
+        if not is_open(d):
+            continue
+        base = d['length'] + RISK_PENALTY * d.get('risk', 0)
+        weights[u, v] = max(MIN_ROUTE_WEIGHT, base - bonus[v])
+        weights[v, u] = max(MIN_ROUTE_WEIGHT, base - bonus[u])
+
+    return weights
+
+def shortest_path_tree(G, sources, weights):
+    """
+    Dijkstra grown from all sources at once over the directed costs in
+    weights (pairs without a cost are not travelled). Returns {node:
+    predecessor} for every reached node (None for the sources). Nodes
+    are settled in the same order as networkx's Dijkstra, so among
+    equally short routes the first one found is kept, as there.
+    """
+    pred = {s: None for s in sources}
+    seen = {s: 0 for s in sources}
+    settled = set()
+    order = itertools.count()
+    fringe = []
+    for s in sources:
+        heappush(fringe, (0, next(order), s))
+
+    while fringe:
+        dist, _, v = heappop(fringe)
+        if v in settled:
+            continue
+        settled.add(v)
+        for u in G.adj[v]:
+            cost = weights.get((v, u))
+            if cost is None or u in settled:
+                continue
+            if u not in seen or dist + cost < seen[u]:
+                seen[u] = dist + cost
+                pred[u] = v
+                heappush(fringe, (dist + cost, next(order), u))
+
+    return pred
+
 def compute_routes(G, source, targets):
+    """
+    Routes from the nearest source to every target using one
+    shortest-path tree grown from all sources at once (source: node id,
+    ids, or None for the twin's sources). Unreachable targets map to None.
+    """
+    if is_compact(G):
+        return compact_routes(G, source, targets)
+
+    # Failed pipes get no weight, so an operational view's filter is redundant
+    G = pipe_network(G)
+    weights = route_weights(G)
+
+    sources = source_nodes(G, source)
+    for s in sources:
+        if s not in G:
+            raise nx.NodeNotFound(f"Source {s} is not in G")
+
+    # Edges without a weight (failed pipes) are hidden from the search
+    count("dijkstra_runs")
+    pred = shortest_path_tree(G, sources, weights)
+
     routes = {}
     for t in targets:
-        try:
-            routes[t] = nx.shortest_path(
-                G,
-                source=source,
-                target=t,
-                weight=lambda u, v, d: edge_weight(G, u, v)
-            )
-        except nx.NetworkXNoPath:
+        if t not in pred:
+            routes[t] = None
+            continue
+
+        path = [t]
+        while pred[path[-1]] is not None:
+            path.append(pred[path[-1]])
+        routes[t] = path[::-1]
+
+    return routes
+
+def compact_routes(net, source, targets):
+    """
+    compute_routes on a compact network: one scipy Dijkstra over the
+    open pipes with the same clamped directed costs as route_weights.
+    Among equally short routes the one picked may differ from networkx.
+    """
+    pipe, node = net["pipe"], net["node"]
+    entry_pipe = net["adj_pipe"]
+
+    risk = pipe["risk"][entry_pipe] if "risk" in pipe else 0
+    cost = np.maximum(
+        MIN_ROUTE_WEIGHT,
+        pipe["length"][entry_pipe] + RISK_PENALTY * risk
+        - PRIORITY_BONUS * node["priority"][net["adj_node"]].astype(float)
+    )
+
+    starts = node_positions(net, list(source_nodes(net, source)))
+    if (starts < 0).any():
+        raise nx.NodeNotFound("A source is not in the network")
+
+    # min_only: one tree from all sources, as if from a super-source
+    count("dijkstra_runs")
+    _, pred, _ = dijkstra(
+        csr_graph(net, data=cost),
+        indices=starts,
+        min_only=True,
+        return_predecessors=True
+    )
+    is_start = np.zeros(len(net["nodes"]), dtype=bool)
+    is_start[starts] = True
+
+    labels = net["nodes"]
+    routes = {}
+    for t, i in zip(targets, node_positions(net, list(targets)).tolist()):
+        if i < 0 or (pred[i] < 0 and not is_start[i]):
             routes[t] = None
+            continue
+
+        path = [i]
+        while pred[path[-1]] >= 0:
+            path.append(pred[path[-1]])
+        routes[t] = labels[path[::-1]].tolist()
+
     return routes
 
 def remove_failed_pipes(G):
@@ -31,6 +167,7 @@ def remove_failed_pipes(G):
         if d.get("status") == "failed"
     ]
     G.remove_edges_from(failed_edges)
+    invalidate(G, topology=True)
     return G
 
 # ------------------------------
@@ -44,11 +181,17 @@ def add_rerouted_pipe(G, u, v, length, failure_prob=0.1):
         failure_prob=failure_prob,
         length=length
     )
+    invalidate(G, topology=True)
     return G
 
 
-def mark_supply_status(G, source="N1"):
+def mark_supply_status(G, source=None):
+    if is_compact(G):
+        G["node"]["supplied"] = supplied_mask(G, source).copy()
+        return G
+
+    supplied = reachable_nodes(G, source)
     for n in G.nodes:
-        G.nodes[n]["supplied"] = nx.has_path(G, source, n)
+        G.nodes[n]["supplied"] = n in supplied
     return G
 
@@ -1,4 +1,14 @@
+import numpy as np
+
 soil_factor = {"rock": 1.0, "clay": 1.4, "sand": 1.6}
 
 def seismic_stress(magnitude, distance, soil):
-    return magnitude * soil_factor[soil] / (distance + 1)
\ No newline at end of file
+    return magnitude * soil_factor[soil] / (distance + 1)
+
+def seismic_stress_batch(magnitude, distance, soils):
+    """
+    Vectorized seismic_stress over arrays of distances and soil names.
+    """
+    uniques, inverse = np.unique(np.asarray(soils), return_inverse=True)
+    factors = np.array([soil_factor[s] for s in uniques], dtype=float)
+    return magnitude * factors[inverse] / (np.asarray(distance, dtype=float) + 1)
\ No newline at end of file
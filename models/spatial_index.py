@@ -0,0 +1,219 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from models.compact_network import is_compact, topology_cached
+
+# ==================================================
+# EPICENTER DISTANCES + PIPE SPATIAL INDEX
+# ==================================================
+# A pipe is the straight segment between its end nodes' lat/lon. Its
+# distance from an epicenter is the haversine distance to the closest
+# point of that segment.
+#
+# The index is a KD-tree over pipe pieces as 3-D unit vectors, where a
+# chord radius maps exactly to a great-circle radius (no trouble at the
+# poles or the antimeridian). Pipes longer than the typical (median)
+# pipe are split into pieces no longer than it, so a radius query only
+# has to be widened by the longest half-piece, not by the longest pipe
+# of the network, to find every candidate. Exact segment distances
+# then filter them, so only pipes near the epicenter are ever touched.
+EARTH_RADIUS_KM = 6371.0088
+
+# Upper bound on the pieces of one pipe (past it a pipe's pieces grow)
+MAX_PIPE_PIECES = 256
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in km between (arrays of) points in degrees.
+    Inputs broadcast against each other.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    h = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def _unit_vectors(lat, lon):
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _chord(distance_km):
+    return 2 * np.sin(np.minimum(distance_km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+def _wrap(dlon):
+    return (dlon + 180.0) % 360.0 - 180.0
+
+
+def _epicenters(epicenters):
+    """
+    (lat, lon) or a sequence of them as (n, 2) arrays of lat and lon.
+    """
+    points = np.atleast_2d(np.asarray(epicenters, dtype=float))
+    return points[:, 0], points[:, 1]
+
+
+# ------------------------------------
+# EPICENTER ON THE TWIN
+# ------------------------------------
+def set_epicenter(G, epicenters):
+    """
+    Sets the epicenter(s) pipe distances are measured from: a
+    (lat, lon) pair, a list of them (e.g. main shock plus
+    aftershocks; each pipe uses the nearest), or None to go back to
+    the pipe length proxy.
+    """
+    if epicenters is not None:
+        epicenters = tuple(map(tuple, np.atleast_2d(np.asarray(epicenters, dtype=float)).tolist()))
+        pipe_index(G)    # built before any copy is made, so copies share it
+
+    if is_compact(G):
+        G["epicenter"] = epicenters
+    else:
+        G.graph["epicenter"] = epicenters
+
+
+def get_epicenter(G):
+    if is_compact(G):
+        return G.get("epicenter")
+    return G.graph.get("epicenter")
+
+
+# ------------------------------------
+# PIPE SEGMENTS + INDEX
+# ------------------------------------
+def _segments(G):
+    """
+    End point lat/lon of every pipe, in G.edges order (NaN if unknown).
+    """
+    if is_compact(G):
+        lat, lon = G["node"]["lat"], G["node"]["lon"]
+        return lat[G["u"]], lon[G["u"]], lat[G["v"]], lon[G["v"]]
+
+    nodes = G.nodes
+    coords = [
+        (
+            nodes[u].get("lat", np.nan), nodes[u].get("lon", np.nan),
+            nodes[v].get("lat", np.nan), nodes[v].get("lon", np.nan)
+        )
+        for u, v in G.edges
+    ]
+    lat_u, lon_u, lat_v, lon_v = np.array(coords, dtype=float).reshape(-1, 4).T
+    return lat_u, lon_u, lat_v, lon_v
+
+
+def _normalize(points, fallback):
+    norm = np.linalg.norm(points, axis=1, keepdims=True)
+    return np.divide(points, norm, out=fallback.copy(), where=norm > 0)
+
+
+def _build_index(G):
+    lat_u, lon_u, lat_v, lon_v = _segments(G)
+
+    located = np.flatnonzero(~np.isnan(lat_u + lon_u + lat_v + lon_v))
+    ends_u = _unit_vectors(lat_u[located], lon_u[located])
+    ends_v = _unit_vectors(lat_v[located], lon_v[located])
+
+    # Half-pipe chord of every pipe; longer ones are cut into pieces
+    half = np.linalg.norm(_normalize(ends_u + ends_v, ends_u) - ends_u, axis=1)
+    target = np.median(half) if len(half) else 0.0
+    pieces = np.ones(len(half), dtype=np.int64)
+    if target > 0:
+        pieces = np.clip(np.ceil(half / target), 1, MAX_PIPE_PIECES).astype(np.int64)
+
+    owner = np.repeat(np.arange(len(located)), pieces)
+    k = np.arange(len(owner)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    f0 = (k / pieces[owner])[:, None]
+    f1 = ((k + 1) / pieces[owner])[:, None]
+    a = _normalize(ends_u[owner] * (1 - f0) + ends_v[owner] * f0, ends_u[owner])
+    b = _normalize(ends_u[owner] * (1 - f1) + ends_v[owner] * f1, ends_u[owner])
+    mid = _normalize(a + b, a)
+
+    # Farthest any point of a piece lies from its midpoint
+    reach = np.maximum(np.linalg.norm(mid - a, axis=1), np.linalg.norm(mid - b, axis=1))
+
+    return {
+        "lat_u": lat_u,
+        "lon_u": lon_u,
+        "lat_v": lat_v,
+        "lon_v": lon_v,
+        "located": located,
+        "owner": owner,
+        "tree": cKDTree(mid),
+        "reach": float(reach.max()) if len(reach) else 0.0
+    }
+
+
+def pipe_index(G):
+    """
+    Spatial index of G's pipes; see compact_network.topology_cached.
+    """
+    return topology_cached(G, "pipe_index", _build_index)
+
+
+# ------------------------------------
+# DISTANCES + QUERIES
+# ------------------------------------
+def _segment_distances(index, pipes, lat, lon):
+    """
+    Distances (km) from each epicenter to the closest point of each
+    of the given pipes, shape (len(lat), len(pipes)).
+    """
+    lat0, lon0 = np.asarray(lat, dtype=float)[:, None], np.asarray(lon, dtype=float)[:, None]
+    lat_u, lon_u = index["lat_u"][pipes], index["lon_u"][pipes]
+    lat_v, lon_v = index["lat_v"][pipes], index["lon_v"][pipes]
+
+    # Closest point found in a local flat projection around each
+    # epicenter (pipes are short), then measured along the sphere
+    scale = np.cos(np.radians(lat0))
+    ax, ay = _wrap(lon_u - lon0) * scale, lat_u - lat0
+    dlon = _wrap(lon_v - lon_u)
+    dx, dy = dlon * scale, lat_v - lat_u
+
+    length_sq = dx * dx + dy * dy
+    t = np.divide(-(ax * dx + ay * dy), length_sq, out=np.zeros_like(length_sq), where=length_sq > 0)
+    t = np.clip(t, 0.0, 1.0)
+
+    return haversine_km(lat0, lon0, lat_u + t * (lat_v - lat_u), lon_u + t * dlon)
+
+
+def epicenter_distances(G, epicenters=None):
+    """
+    Distance (km) of every pipe (G.edges order) from the nearest of
+    the epicenters (default: the twin's). NaN for pipes without
+    coordinates.
+    """
+    epicenters = get_epicenter(G) if epicenters is None else epicenters
+    index = pipe_index(G)
+    lat, lon = _epicenters(epicenters)
+
+    pipes = np.arange(len(index["lat_u"]))
+    return _segment_distances(index, pipes, lat, lon).min(axis=0)
+
+
+def pipes_within(G, epicenters, radius_km):
+    """
+    Indices (G.edges order) of the pipes within radius_km of an
+    epicenter. For a list of epicenters returns one array per epicenter.
+    """
+    index = pipe_index(G)
+    lat, lon = _epicenters(epicenters)
+    located = index["located"]
+
+    candidates = index["tree"].query_ball_point(
+        _unit_vectors(lat, lon), _chord(radius_km) + index["reach"]
+    )
+
+    found = []
+    for lat0, lon0, near in zip(lat, lon, candidates):
+        pipes = located[np.unique(index["owner"][np.asarray(near, dtype=np.int64)])]
+        distance = _segment_distances(index, pipes, [lat0], [lon0])[0]
+        found.append(pipes[distance <= radius_km])
+
+    if np.ndim(epicenters) == 1:
+        return found[0]
+    return found
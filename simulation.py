@@ -0,0 +1,599 @@
+import numpy as np
+
+from models.routing_model import compute_routes
+from models.allocation_model import allocate_water
+from models.auto_rerouting import auto_reroute
+from models.failure_scoring import pipe_columns, score_network, score_pipes, write_scores
+from models.hydraulic_model import open_pipes_mask, solve_hydraulics
+from models.flow_allocation import flow_allocation
+from models.compact_network import STATUS_CODES, STATUS_NAMES, copy as copy_compact, is_compact, node_positions
+from models.connectivity import (
+    close_pipes, open_pipes, operational_view, reachable_nodes, set_pipe_status, source_capacity,
+    source_nodes, supplied_mask
+)
+from metrics import compute_metrics, service_metrics
+from instrumentation import count, span
+
+SOURCE = None        # the twin's own sources (connectivity.get_sources)
+TOTAL_SUPPLY = 500   # used when the sources have no capacities
+TIME_STEPS = list(range(0, 11))   # simulation minutes shown by the app
+HYDRAULICS = False   # opt-in: also judge service by pressure (one solve per changed step)
+ALLOCATION = "proportional"   # or "max_flow": pipe capacities, priority first
+
+# ---------------------------------
+# DYNAMIC FAILURE THRESHOLD
+# ---------------------------------
+FAILURE_PERCENTILE = 70           # top 30% riskiest pipes fail
+MAX_FAILURE_THRESHOLD = 0.65
+DEFAULT_FAILURE_THRESHOLD = 0.6
+
+
+def failure_threshold(failure_probs):
+    """
+    Finds the top 30% most risky pipes, with a safety clamp.
+    """
+    if len(failure_probs):
+        raw_threshold = np.percentile(failure_probs, FAILURE_PERCENTILE)
+
+        # ---- SAFETY CLAMP ----
+        return min(raw_threshold, MAX_FAILURE_THRESHOLD)
+
+    return DEFAULT_FAILURE_THRESHOLD
+
+
+def supply_total(G, source=SOURCE, total_supply=None):
+    """
+    Water shared out by allocation: total_supply if given, else the
+    combined capacity of the sources, else TOTAL_SUPPLY.
+    """
+    if total_supply is not None:
+        return total_supply
+    capacity = source_capacity(G, source)
+    return TOTAL_SUPPLY if capacity is None else capacity
+
+
+def copy_network(G, as_view=False):
+    """
+    Copy of a networkx or compact network. as_view: a read-only
+    networkx view instead, for callers that write nothing to it.
+    """
+    if is_compact(G):
+        return copy_compact(G)
+    return G.copy(as_view=as_view)
+
+
+def critical_node_ids(G):
+    """
+    Nodes of priority 4 and above, in G.nodes order.
+    """
+    if is_compact(G):
+        return G["nodes"][G["node"]["priority"] >= 4].tolist()
+    return [n for n, d in G.nodes(data=True) if d.get("priority", 0) >= 4]
+
+
+def simulate(G_before, magnitude, time_step, scores=None, source=SOURCE, total_supply=None,
+             hydraulics=HYDRAULICS, allocation_mode=ALLOCATION):
+    """
+    Failure scoring, thresholding, rerouting, routing, allocation,
+    hydraulics and metrics for one scenario. G_before (a networkx twin
+    or a compact network) is not modified; G_after is of the same kind.
+
+    scores: optional precomputed (stress, failure_prob) arrays in
+    G_before.edges order, used instead of scoring the pipes again.
+    source: node id, ids, or None for the twin's sources.
+    hydraulics: solve heads and flows and count nodes below
+    MIN_PRESSURE_REQUIRED as unserved.
+    allocation_mode: "proportional" or "max_flow"; the latter also
+    returns its pipe flows and bottleneck pipes as "flows".
+    """
+    FAILURE_THRESHOLD = None
+    source = source_nodes(G_before, source)
+    total_supply = supply_total(G_before, source, total_supply)
+
+    #  VERY IMPORTANT GUARD
+    if time_step == 0:
+        # No earthquake effects at time 0: nothing is written to the
+        # pipes, so a read-only view of G_before stands in for a copy
+        G_after = copy_network(G_before, as_view=True)
+        G_operational = operational_view(G_after)
+
+    else:
+        # Earthquake effects start only after time > 0
+        G_after = copy_network(G_before)
+        count("graph_copies")
+
+        # Score every pipe in one batched pass
+        with span("failure_scoring"):
+            if scores is None:
+                all_failure_probs = score_network(G_after, magnitude, time_step)
+            else:
+                write_scores(G_after, *scores)
+                all_failure_probs = scores[1]
+
+        with span("thresholding"):
+            FAILURE_THRESHOLD = failure_threshold(all_failure_probs)
+
+            set_pipe_status(G_after, None, np.where(
+                np.asarray(all_failure_probs) > FAILURE_THRESHOLD, "failed", "healthy"
+            ).tolist())
+
+        # Failed pipes are hidden by a view, not removed from a copy
+        with span("operational_graph"):
+            G_operational = operational_view(G_after)
+
+        # Automatic rerouting: logical pipes go straight into G_after,
+        # so they are drawn and also seen through G_operational
+        with span("auto_reroute"):
+            auto_reroute(G_after, source)
+
+    # ---------------------------
+    # CRITICAL NODES
+    # ---------------------------
+    critical_nodes = critical_node_ids(G_after)
+
+    # ---------------------------
+    # ROUTING + WATER ALLOCATION
+    # ---------------------------
+    with span("compute_routes"):
+        routes = compute_routes(G_operational, source, critical_nodes)
+
+    flows = None
+    with span("allocate_water"):
+        if allocation_mode == "max_flow":
+            flows = flow_allocation(G_after, total_supply, source)
+            allocation = flows["allocation"]
+        else:
+            allocation = allocate_water(G_operational, total_supply, source, allocation_mode)
+
+    # ---------------------------
+    # HYDRAULICS
+    # ---------------------------
+    hydraulic = None
+    if hydraulics:
+        with span("hydraulics"):
+            hydraulic = solve_hydraulics(G_after, source)
+
+    # ---------------------------
+    # METRICS
+    # ---------------------------
+    with span("compute_metrics"):
+        metrics = compute_metrics(G_before, G_after, critical_nodes, source, hydraulic)
+
+    return {
+        "G_after": G_after,
+        "G_operational": G_operational,
+        "threshold": FAILURE_THRESHOLD,
+        "critical_nodes": critical_nodes,
+        "routes": routes,
+        "allocation": allocation,
+        "flows": flows,
+        "hydraulics": hydraulic,
+        "metrics": metrics
+    }
+
+
+# ==================================================
+# INCREMENTAL TIME STEPPING
+# ==================================================
+# Failure probabilities only grow with time_step, so between steps
+# most pipes keep their status. The stepper keeps one working graph and
+# applies only the status changes: newly failed pipes close (and the
+# few that drop back under a rising threshold reopen), and the
+# supplied set, served counts, weighted demand and routes are updated
+# from those changes instead of being rebuilt from the whole network.
+#
+# auto_reroute is not replayed here: it only follows open pipes, so a
+# node that lost supply never reaches a donor and no reroute is added.
+#
+# Hydraulics (opt-in) are re-solved on every step where a pipe changed
+# status, over the whole network, warm-started from the previous
+# step's flows: that solve, not the status changes, then dominates the
+# step's cost. A max-flow allocation
+# is kept as long as no pipe that carried water changed.
+#
+# A compact network steps the same way, except that its supplied set
+# comes from one csgraph search per step with status changes (vectorized
+# over the whole network) rather than from searches around each pipe.
+def start_incremental(G_before, magnitude, source=SOURCE, total_supply=None,
+                      hydraulics=HYDRAULICS, allocation_mode=ALLOCATION):
+    """
+    Builds the stepping state of one scenario at time step 0.
+    G_before is not modified.
+    """
+    source = source_nodes(G_before, source)
+    total_supply = supply_total(G_before, source, total_supply)
+    G = copy_network(G_before)
+    count("graph_copies")
+
+    failed = ~open_pipes_mask(G)
+    supplied = set(reachable_nodes(G, source))
+    critical_nodes = critical_node_ids(G)
+    critical_set = set(critical_nodes)
+    critical_served = sum(1 for n in critical_nodes if n in supplied)
+
+    if is_compact(G):
+        # Pipes are addressed by index
+        edges = np.arange(len(failed))
+        node = G["node"]
+        weights = dict(zip(
+            G["nodes"].tolist(),
+            (node["demand"].astype(float) * node["priority"].astype(float)).tolist()
+        ))
+        critical_mask = node["priority"] >= 4
+    else:
+        edges = list(G.edges)
+        weights = {
+            n: d.get("demand", 0) * d.get("priority", 0)
+            for n, d in G.nodes(data=True)
+        }
+        critical_mask = np.fromiter((n in critical_set for n in G.nodes), dtype=bool, count=G.number_of_nodes())
+
+    state = {
+        "G": G,
+        "n_nodes": len(critical_mask),
+        "magnitude": magnitude,
+        "source": source,
+        "total_supply": total_supply,
+        "edges": edges,
+        "columns": None,
+        "initial_failed": failed,
+        "failed": failed.copy(),
+        "supplied": supplied,
+        "weights": weights,
+        "weighted_demand": sum(weights[n] for n in supplied),
+        "critical_nodes": critical_nodes,
+        "critical_set": critical_set,
+        "critical_mask": critical_mask,
+        "critical_served": critical_served,
+        "normal_served": len(supplied) - critical_served,
+        "routes": compute_routes(G, source, critical_nodes),
+        "route_pipes": None,
+        "hydraulics": hydraulics,
+        "hydraulic": None,
+        "allocation_mode": allocation_mode,
+        "flows": None,
+        "supplied_mask": supplied_mask(G, source).copy() if is_compact(G) else None
+    }
+    state["route_pipes"] = _route_pipes(state["routes"])
+    return state
+
+
+def _pipe_ends(G, pipes):
+    """
+    (u, v) node ids of the given pipes: pairs already, or pipe indices
+    of a compact network.
+    """
+    if is_compact(G):
+        labels = G["nodes"]
+        return zip(labels[G["u"][pipes]].tolist(), labels[G["v"][pipes]].tolist())
+    return pipes
+
+
+def _compact_supply_changes(state, closing, opening):
+    """
+    Applies status changes (pipe indices) to a compact stepping state
+    and returns the nodes that lost and regained supply.
+    """
+    if not (len(closing) or len(opening)):
+        return set(), set()
+
+    G = state["G"]
+    set_pipe_status(G, closing, "failed")
+    set_pipe_status(G, opening, "healthy")
+
+    before, after = state["supplied_mask"], supplied_mask(G, state["source"])
+    labels = G["nodes"]
+    lost = set(labels[before & ~after].tolist())
+    gained = set(labels[after & ~before].tolist())
+
+    state["supplied"].difference_update(lost)
+    state["supplied"].update(gained)
+    state["supplied_mask"] = after.copy()
+    return lost, gained
+
+
+def _route_pipes(routes):
+    return {
+        frozenset(pipe)
+        for path in routes.values() if path
+        for pipe in zip(path, path[1:])
+    }
+
+
+def advance_step(state, time_step, scores=None):
+    """
+    Moves the stepping state to time_step, touching only the pipes
+    whose status changed. Returns a summary of the step: {"time_step",
+    "threshold", "changed", "lost", "gained", "metrics", "routes",
+    "hydraulics", "flows"}.
+
+    scores: optional precomputed (stress, failure_prob) arrays in
+    G_before.edges order.
+    """
+    G, edges, source = state["G"], state["edges"], state["source"]
+    threshold = None
+
+    with span("failure_scoring"):
+        if time_step == 0:
+            failed = state["initial_failed"]
+        else:
+            if scores is None:
+                if state["columns"] is None:
+                    state["columns"] = pipe_columns(G)
+                scores = score_pipes(
+                    **state["columns"],
+                    magnitude=state["magnitude"],
+                    time_step=time_step
+                )
+            threshold = failure_threshold(scores[1])
+            failed = scores[1] > threshold
+
+    # ---------------------------
+    # STATUS CHANGES ONLY
+    # ---------------------------
+    changed = np.flatnonzero(failed != state["failed"])
+    if is_compact(G):
+        closing, opening = changed[failed[changed]], changed[~failed[changed]]
+    else:
+        closing = [edges[i] for i in changed.tolist() if failed[i]]
+        opening = [edges[i] for i in changed.tolist() if not failed[i]]
+
+    state["failed"] = failed.copy()
+
+    with span("connectivity"):
+        if is_compact(G):
+            lost, gained = _compact_supply_changes(state, closing, opening)
+        else:
+            supplied = state["supplied"]
+            lost = close_pipes(G, supplied, closing, source)
+            gained = open_pipes(G, supplied, opening)
+
+    # ---------------------------
+    # SERVED COUNTS + DEMAND
+    # ---------------------------
+    weights, critical_set = state["weights"], state["critical_set"]
+    for nodes, sign in ((lost, -1), (gained, 1)):
+        critical = sum(1 for n in nodes if n in critical_set)
+        state["critical_served"] += sign * critical
+        state["normal_served"] += sign * (len(nodes) - critical)
+        state["weighted_demand"] += sign * sum(weights[n] for n in nodes)
+
+    # ---------------------------
+    # ROUTES (only when a route pipe closed or any pipe reopened)
+    # ---------------------------
+    with span("compute_routes"):
+        if len(opening) or any(frozenset(pipe) in state["route_pipes"] for pipe in _pipe_ends(G, closing)):
+            state["routes"] = compute_routes(G, source, state["critical_nodes"])
+            state["route_pipes"] = _route_pipes(state["routes"])
+
+    # ---------------------------
+    # HYDRAULICS (only when a pipe changed)
+    # ---------------------------
+    critical_served, normal_served, low_pressure = state["critical_served"], state["normal_served"], 0
+    if state["hydraulics"]:
+        with span("hydraulics"):
+            if changed.size or state["hydraulic"] is None:
+                state["hydraulic"] = solve_hydraulics(
+                    G, source, warm=state["hydraulic"], is_open=~failed
+                )
+        hydraulic = state["hydraulic"]
+        served = hydraulic["served"]
+        critical_served = int((served & state["critical_mask"]).sum())
+        normal_served = int(served.sum()) - critical_served
+        low_pressure = int((hydraulic["supplied"] & ~served).sum())
+
+    # ---------------------------
+    # MAX-FLOW ALLOCATION (kept while no water-carrying pipe changed)
+    # ---------------------------
+    if state["allocation_mode"] == "max_flow" and (changed.size or state["flows"] is None):
+        with span("allocate_water"):
+            state["flows"] = flow_allocation(
+                G, state["total_supply"], source, warm=state["flows"], is_open=~failed
+            )
+
+    metrics = service_metrics(
+        int(failed.sum()),
+        critical_served, len(state["critical_nodes"]),
+        normal_served, state["n_nodes"] - len(state["critical_nodes"]),
+        low_pressure
+    )
+
+    return {
+        "time_step": time_step,
+        "threshold": threshold,
+        "changed": changed,
+        "lost": lost,
+        "gained": gained,
+        "metrics": metrics,
+        "routes": dict(state["routes"]),
+        "hydraulics": state["hydraulic"],
+        "flows": state["flows"]
+    }
+
+
+def supply_allocation(G, supplied, total_supply, weighted_demand):
+    """
+    Same split as allocate_water, from a known supplied set and its
+    weighted demand.
+    """
+    if is_compact(G):
+        index = np.sort(node_positions(G, list(supplied)))
+        node = G["node"]
+        weight = node["demand"][index].astype(float) * node["priority"][index]
+        shares = total_supply * weight / weighted_demand if weighted_demand else np.zeros(len(index))
+        return dict(zip(G["nodes"][index].tolist(), shares.tolist()))
+
+    allocation = {}
+    for n, d in G.nodes(data=True):
+        if n not in supplied:
+            continue
+        if weighted_demand == 0:
+            allocation[n] = 0
+        else:
+            allocation[n] = (
+                total_supply *
+                (d.get('demand', 0) * d.get('priority', 0)) /
+                weighted_demand
+            )
+    return allocation
+
+
+# ==================================================
+# PRECOMPUTED TIME-SERIES FRAMES
+# ==================================================
+# Frames hold only what changed since the previous step: status
+# changes as (index, code) pairs, nodes that lost or regained supply
+# and a dict diff of the routes. Pipe scores change at almost every
+# pipe each step, so they are not stored at all: the timeline keeps
+# the static scoring columns once and frame_state() re-scores the one
+# step it rebuilds. Hydraulic and max-flow results are kept as float32
+# arrays, shared by consecutive frames when they were not re-solved in
+# between. No graph copies are kept.
+
+
+def _stored_hydraulics(hydraulic):
+    return {
+        "pressure": hydraulic["pressure"].astype(np.float32),
+        "delivered": hydraulic["delivered"].astype(np.float32),
+        "flow": hydraulic["flow"].astype(np.float32),
+        "supplied": hydraulic["supplied"],
+        "served": hydraulic["served"],
+        "iterations": hydraulic["iterations"],
+        "converged": hydraulic["converged"]
+    }
+
+
+def _stored_flows(flows):
+    return {
+        "allocation": flows["allocation"],
+        "delivered": flows["delivered"].astype(np.float32),
+        "flow": flows["flow"].astype(np.float32),
+        "bottlenecks": flows["bottlenecks"],
+        "tiers": flows["tiers"]
+    }
+
+
+def _dict_delta(previous, current):
+    changed = {k: v for k, v in current.items() if previous.get(k) != v}
+    removed = [k for k in previous if k not in current]
+    return changed, removed
+
+
+def precompute_frames(G_before, magnitude, time_steps=TIME_STEPS, source=SOURCE, total_supply=None,
+                      hydraulics=HYDRAULICS, allocation_mode=ALLOCATION):
+    """
+    Runs every time step of one scenario, scoring all steps in a single
+    batched pass and stepping the network incrementally, and stores
+    each step as a delta against the previous.
+    """
+    time_steps = list(time_steps)
+
+    columns = pipe_columns(G_before)
+    stress_all, prob_all = score_pipes(**columns, magnitude=magnitude, time_step=time_steps)
+
+    state = start_incremental(G_before, magnitude, source, total_supply, hydraulics, allocation_mode)
+    initial_supplied = frozenset(state["supplied"])
+    initial_status = state["initial_failed"].astype(np.int8) * STATUS_CODES["failed"]
+
+    frames = []
+    routes = {}
+    solved, stored = None, None
+    allocated, stored_flows = None, None
+
+    for i, t in enumerate(time_steps):
+        scores = (stress_all[i], prob_all[i]) if t > 0 else None
+        step = advance_step(state, t, scores=scores)
+        changed = step["changed"]
+
+        routes_changed, routes_removed = _dict_delta(routes, step["routes"])
+
+        if step["hydraulics"] is not solved:
+            solved = step["hydraulics"]
+            stored = _stored_hydraulics(solved)
+        if step["flows"] is not allocated:
+            allocated = step["flows"]
+            stored_flows = _stored_flows(allocated)
+
+        frames.append({
+            "time_step": t,
+            "threshold": step["threshold"],
+            "metrics": step["metrics"],
+            "scored": scores is not None,
+            "status_changes": (
+                changed.astype(np.int32),
+                state["failed"][changed].astype(np.int8) * STATUS_CODES["failed"]
+            ),
+            "supply_changes": (step["lost"], step["gained"]),
+            "weighted_demand": state["weighted_demand"],
+            "routes": (routes_changed, routes_removed),
+            "hydraulics": stored,
+            "flows": stored_flows
+        })
+
+        routes = step["routes"]
+
+    return {
+        "magnitude": magnitude,
+        "time_steps": time_steps,
+        "edges": state["edges"],
+        "columns": columns,
+        "critical_nodes": state["critical_nodes"],
+        "total_supply": state["total_supply"],
+        "initial_status": initial_status,
+        "initial_supplied": initial_supplied,
+        "frames": frames
+    }
+
+
+def frame_state(timeline, G_before, time_step):
+    """
+    Rebuilds the scenario result of one precomputed step by replaying
+    the deltas up to it. Returns the same keys as simulate,
+    except G_operational.
+    """
+    idx = timeline["time_steps"].index(time_step)
+
+    status = timeline["initial_status"].copy()
+    supplied = set(timeline["initial_supplied"])
+    routes = {}
+
+    for frame in timeline["frames"][:idx + 1]:
+        changed, codes = frame["status_changes"]
+        status[changed] = codes
+
+        lost, gained = frame["supply_changes"]
+        supplied.difference_update(lost)
+        supplied.update(gained)
+
+        routes_changed, routes_removed = frame["routes"]
+        for k in routes_removed:
+            routes.pop(k, None)
+        routes.update(routes_changed)
+
+    frame = timeline["frames"][idx]
+
+    G_after = copy_network(G_before)
+    count("graph_copies")
+    if frame["scored"]:
+        write_scores(G_after, *score_pipes(
+            **timeline["columns"],
+            magnitude=timeline["magnitude"],
+            time_step=frame["time_step"]
+        ))
+
+    # Timeline pipes are in G_before.edges order
+    set_pipe_status(G_after, None, [STATUS_NAMES[code] for code in status.tolist()])
+
+    return {
+        "G_after": G_after,
+        "threshold": frame["threshold"],
+        "critical_nodes": timeline["critical_nodes"],
+        "routes": routes,
+        "allocation": (
+            supply_allocation(G_before, supplied, timeline["total_supply"], frame["weighted_demand"])
+            if frame["flows"] is None else frame["flows"]["allocation"]
+        ),
+        "flows": frame["flows"],
+        "hydraulics": frame["hydraulics"],
+        "metrics": frame["metrics"]
+    }
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+import batch
+
+
+def _summary(output):
+    with open(output / batch.SUMMARY_FILE) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_run_options_name_their_partitions(tmp_path):
+    common = ["--magnitudes", "6.5", "--time-steps", "5", "--output", str(tmp_path)]
+    batch.main(common)
+    batch.main(common + ["--allocation", "max_flow", "--epicenter", "23.26", "77.41"])
+
+    names = [row["scenario"] for row in _summary(tmp_path)]
+    assert names == ["M6.5", "M6.5-max_flow-epi_23.26_77.41"]
+    assert sorted(p.name for p in (tmp_path / "pipes").iterdir()) == [f"scenario={n}" for n in names]
+
+
+def test_duplicate_partitions_are_refused(tmp_path):
+    scenarios = tmp_path / "scenarios.csv"
+    scenarios.write_text("magnitude,time_step\n6.5,5\n7,3\n6.5,5\n")
+
+    with pytest.raises(SystemExit):
+        batch.main([str(scenarios), "--output", str(tmp_path / "out")])
+    assert not (tmp_path / "out").exists()
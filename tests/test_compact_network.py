@@ -0,0 +1,44 @@
+import networkx as nx
+import numpy as np
+
+from models.compact_network import FAILED, add_pipes, copy, decode, from_graph, to_graph
+from models.connectivity import reachable_nodes, set_pipe_status
+
+
+def _path(n, **pipe):
+    G = nx.Graph()
+    nx.add_path(G, [f"N{i}" for i in range(1, n + 1)], status="healthy", length=10, material="PVC", age=5,
+                soil="clay", pressure_cap=80, **pipe)
+    return G
+
+
+def test_many_categories_keep_their_codes():
+    G = _path(301)
+    for i, (_, _, d) in enumerate(G.edges(data=True)):
+        d["material"] = f"M{i}"
+
+    net = from_graph(G)
+    assert net["pipe"]["material"].max() == 299
+    assert decode(net, "material").tolist() == [f"M{i}" for i in range(300)]
+
+
+def test_copy_keeps_statuses_apart():
+    net = from_graph(_path(4))
+    clone = copy(net)
+    set_pipe_status(clone, [1], "failed")
+
+    assert (net["pipe"]["status"] != FAILED).all()
+    assert reachable_nodes(net, "N1") == {"N1", "N2", "N3", "N4"}
+    assert reachable_nodes(clone, "N1") == {"N1", "N2"}
+
+
+def test_added_pipes_join_the_network():
+    net = from_graph(_path(4))
+    set_pipe_status(net, [1], "failed")
+    add_pipes(net, [1], [3], status=2, is_physical=False, length=15.0)
+
+    assert reachable_nodes(net, "N1") == {"N1", "N2", "N3", "N4"}
+    G = to_graph(net)
+    assert G.edges["N2", "N4"]["status"] == "rerouted"
+    assert G.edges["N2", "N4"]["material"] is None
+    assert np.isnan(net["pipe"]["failure_prob"][-1])
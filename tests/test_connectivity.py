@@ -0,0 +1,80 @@
+import networkx as nx
+import numpy as np
+
+from digital_twin import create_digital_twin
+from models.compact_network import endpoint_arrays
+from models.connectivity import (
+    close_pipes, graph_version, reachable_nodes, set_pipe_status
+)
+from models.flow_allocation import flow_arrays
+from models.hydraulic_model import hydraulic_arrays
+from models.routing_model import add_rerouted_pipe, remove_failed_pipes
+from models.spatial_index import pipe_index
+
+
+def _line():
+    G = nx.Graph()
+    nx.add_path(G, ["N1", "N2", "N3", "N4"], status="healthy")
+    return G
+
+
+def test_status_change_refreshes_reachability():
+    G = _line()
+    assert reachable_nodes(G, "N1") == {"N1", "N2", "N3", "N4"}
+
+    set_pipe_status(G, [("N2", "N3")], "failed")
+    assert reachable_nodes(G, "N1") == {"N1", "N2"}
+
+    set_pipe_status(G, [("N2", "N3")], "healthy")
+    assert reachable_nodes(G, "N1") == {"N1", "N2", "N3", "N4"}
+
+
+def test_whole_network_status_write():
+    G = _line()
+    reachable_nodes(G, "N1")
+
+    set_pipe_status(G, None, ["healthy", "healthy", "failed"])
+    assert reachable_nodes(G, "N1") == {"N1", "N2", "N3"}
+
+
+def test_close_pipes_matches_fresh_search():
+    G = create_digital_twin()
+    supplied = set(reachable_nodes(G))
+    version = graph_version(G)
+
+    pipes = list(G.edges)[:6]
+    close_pipes(G, supplied, pipes)
+
+    assert graph_version(G) != version
+    assert supplied == reachable_nodes(G)
+    assert supplied == nx.node_connected_component(
+        nx.subgraph_view(G, filter_edge=lambda u, v: G.edges[u, v]["status"] != "failed"), "N1"
+    )
+
+
+def test_topology_caches_follow_pipe_swaps():
+    G = create_digital_twin()
+    before = (hydraulic_arrays(G), flow_arrays(G), pipe_index(G))
+
+    # Copies share the arrays until their pipes change
+    H = G.copy()
+    assert all(x is y for x, y in zip((hydraulic_arrays(H), flow_arrays(H), pipe_index(H)), before))
+
+    # One pipe out, one in: same node and pipe counts, new topology
+    u, v = next(iter(H.edges))
+    set_pipe_status(H, [(u, v)], "failed")
+    remove_failed_pipes(H)
+    a, b = next((a, b) for a in H.nodes for b in H.nodes if a != b and not H.has_edge(a, b))
+    add_rerouted_pipe(H, a, b, length=100.0)
+    assert H.number_of_edges() == G.number_of_edges()
+
+    _, ends_u, ends_v = endpoint_arrays(H)
+    for arrays in (hydraulic_arrays(H), flow_arrays(H)):
+        assert arrays is not before[0] and arrays is not before[1]
+        assert np.array_equal(arrays["u"], ends_u) and np.array_equal(arrays["v"], ends_v)
+    assert pipe_index(H) is not before[2]
+
+    # The original twin keeps its own arrays
+    assert hydraulic_arrays(G) is before[0]
+    assert flow_arrays(G) is before[1]
+    assert pipe_index(G) is before[2]
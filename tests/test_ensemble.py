@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from digital_twin import create_digital_twin
+from ensemble import evaluate_realization, network_arrays
+from simulation import simulate, supply_total
+
+
+@pytest.mark.parametrize("hydraulics", [False, True])
+def test_realization_matches_simulate(hydraulics):
+    G = create_digital_twin()
+    result = simulate(G, 6.5, 5, hydraulics=hydraulics)
+    failed = np.array([d["status"] == "failed" for _, _, d in result["G_after"].edges(data=True)])
+
+    net = network_arrays(G, np.zeros(len(failed)), hydraulics=hydraulics)
+    failed_pipes, critical, overall, unserved = evaluate_realization(net, failed, supply_total(G))
+
+    metrics = result["metrics"]
+    assert failed_pipes == metrics["failed_pipes"]
+    assert critical == metrics["critical_service_ratio"]
+    assert overall == metrics["overall_service_ratio"]
+
+    demand = {n: d.get("demand", 0) for n, d in G.nodes(data=True)}
+    expected = sum(max(demand[n] - result["allocation"].get(n, 0), 0) for n in demand)
+    assert unserved == pytest.approx(expected)
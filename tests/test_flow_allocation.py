@@ -0,0 +1,13 @@
+import pytest
+
+from digital_twin import create_digital_twin
+from models.flow_allocation import flow_allocation
+
+
+@pytest.mark.parametrize("total_supply", [1e6, 1e9, 1e12])
+def test_large_supply_keeps_resolution(total_supply):
+    G = create_digital_twin()
+    expected = flow_allocation(G, 500)
+    result = flow_allocation(G, total_supply)
+    assert result["resolution"] == expected["resolution"]
+    assert result["tiers"] == expected["tiers"]
@@ -0,0 +1,88 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+import models.hydraulic_model as hydraulic_model
+from digital_twin import create_digital_twin
+from metrics import compute_metrics
+from models.hydraulic_model import (
+    DEMAND_UNIT, MIN_DELIVERY_PRESSURE, MIN_PRESSURE_REQUIRED, SOURCE_HEAD, solve_hydraulics
+)
+from models.network_generator import generate_network
+from simulation import simulate
+
+
+def _branch_network():
+    # N1 (source) feeds a block next door over a short main, and a
+    # large consumer at the end of a long, old, narrow branch
+    G = nx.Graph()
+    G.add_node("N1", demand=0, priority=5)
+    G.add_node("N2", demand=100, priority=2)
+    G.add_node("N3", demand=2000, priority=2)
+    pipe = dict(status="healthy", soil="clay", is_physical=True)
+    G.add_edge("N1", "N2", length=200, material="DI", age=5, pressure_cap=150, **pipe)
+    G.add_edge("N2", "N3", length=3000, material="CI", age=50, pressure_cap=60, **pipe)
+    return G
+
+
+def test_long_branch_falls_below_minimum_pressure():
+    G = _branch_network()
+    result = solve_hydraulics(G, "N1")
+
+    assert result["converged"]
+    pressure = dict(zip(G.nodes, result["pressure"].tolist()))
+    assert pressure["N1"] == SOURCE_HEAD
+    assert pressure["N2"] >= MIN_PRESSURE_REQUIRED
+    assert pressure["N3"] < MIN_PRESSURE_REQUIRED
+    assert result["supplied"].all()
+    assert result["served"].tolist() == [True, True, False]
+
+    # N3 gets part of its demand, and the branch carries exactly that
+    delivered = dict(zip(G.nodes, result["delivered"].tolist()))
+    assert delivered["N2"] == pytest.approx(100)
+    assert 0 < delivered["N3"] < 2000
+    assert result["flow"][1] == pytest.approx(delivered["N3"] * DEMAND_UNIT, rel=1e-3)
+
+
+def test_low_pressure_node_counts_as_unserved():
+    G = _branch_network()
+    metrics = simulate(G, 6.5, 0, source="N1", hydraulics=True)["metrics"]
+
+    assert metrics["low_pressure_nodes"] == 1
+    assert metrics["normal_nodes_served"] == 1
+    assert compute_metrics(G, G, source="N1")["normal_nodes_served"] == 2
+
+
+def test_generated_network_stays_physical(tmp_path):
+    # One source cannot carry a dense 1000-node network's demand: far
+    # nodes get less water, not negative pressures
+    generate_network(1000, seed=42, output_dir=str(tmp_path))
+    G = create_digital_twin(str(tmp_path / "nodes.csv"), str(tmp_path / "pipes.csv"))
+    result = solve_hydraulics(G)
+
+    assert result["converged"]
+    assert result["supplied"].all()
+    pressure, delivered = result["pressure"], result["delivered"]
+    assert pressure.min() >= MIN_DELIVERY_PRESSURE - 1e-3
+
+    demand = np.array([d["demand"] for _, d in G.nodes(data=True)], dtype=float)
+    assert (delivered <= demand + 1e-9).all()
+    full = np.isclose(delivered, demand, rtol=1e-3)
+    assert 0 < result["served"].sum() < len(demand)
+    assert (full[result["served"]]).all()
+
+    # The source sends out what the nodes receive
+    source = list(G.nodes).index("N1")
+    sent = sum(
+        flow if a == "N1" else -flow
+        for (a, b), flow in zip(G.edges, result["flow"].tolist())
+        if "N1" in (a, b)
+    )
+    assert sent / DEMAND_UNIT == pytest.approx(delivered.sum() - delivered[source], rel=1e-3)
+
+
+def test_warns_when_not_converged(monkeypatch):
+    monkeypatch.setattr(hydraulic_model, "MAX_ITERATIONS", 1)
+    with pytest.warns(RuntimeWarning, match="without converging"):
+        result = solve_hydraulics(_branch_network(), "N1")
+    assert not result["converged"]
@@ -0,0 +1,180 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from digital_twin import NODES_PATH, PIPES_PATH, create_compact_twin, create_digital_twin
+from models.connectivity import reachable_nodes
+from models.network_generator import generate_network
+from simulation import TIME_STEPS, advance_step, frame_state, precompute_frames, simulate, start_incremental
+
+
+@pytest.fixture(scope="module")
+def twins():
+    return create_digital_twin(), create_compact_twin()
+
+
+def _same_allocation(a, b):
+    assert a.keys() == b.keys()
+    assert np.allclose([a[n] for n in a], [b[n] for n in a])
+
+
+@pytest.fixture(scope="module")
+def generated(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("network")
+    generate_network(400, radius=0.04, seed=7, loop_fraction=0.3, output_dir=str(folder))
+    return create_digital_twin(str(folder / "nodes.csv"), str(folder / "pipes.csv"))
+
+
+def _statuses(G):
+    return {e: d["status"] for e, d in G.edges.items()}
+
+
+# ------------------------------------
+# INCREMENTAL STEPPER VS SIMULATE
+# ------------------------------------
+@pytest.mark.parametrize("magnitude", [4.5, 6.5, 8.0])
+def test_stepper_matches_simulate(twins, magnitude):
+    G = twins[0]
+    state = start_incremental(G, magnitude)
+
+    # Forward and backward jumps, including repeated steps
+    for t in random.Random(magnitude).choices(TIME_STEPS, k=12):
+        step = advance_step(state, t)
+        expected = simulate(G, magnitude, t)
+
+        assert step["metrics"] == expected["metrics"]
+        assert step["threshold"] == expected["threshold"]
+        assert step["routes"] == expected["routes"]
+        assert state["supplied"] == set(reachable_nodes(expected["G_after"]))
+
+
+def _sparse_scores(G, seed):
+    # A few pipes far above the rest, so the dynamic threshold fails
+    # only those and much of the network stays supplied
+    failing = np.random.default_rng(seed).random(G.number_of_edges()) < 0.03
+    failure_prob = np.where(failing, 0.99, 0.01)
+    return failure_prob, failure_prob
+
+
+def test_stepper_matches_simulate_on_looped_network(generated):
+    state = start_incremental(generated, 6.5)
+
+    # Independent failure sets per step: pipes close and reopen
+    lost, gained = set(), set()
+    for seed, t in enumerate([3, 5, 5, 2, 9, 0, 7]):
+        scores = _sparse_scores(generated, seed) if t else None
+        step = advance_step(state, t, scores=scores)
+        expected = simulate(generated, 6.5, t, scores=scores)
+
+        assert step["metrics"] == expected["metrics"]
+        assert step["routes"] == expected["routes"]
+        assert state["supplied"] == set(reachable_nodes(expected["G_after"]))
+        lost |= step["lost"]
+        gained |= step["gained"]
+
+    assert lost and gained
+
+
+@pytest.mark.parametrize("hydraulics, allocation_mode", [(True, "proportional"), (False, "max_flow")])
+def test_stepper_matches_simulate_with_solvers(twins, hydraulics, allocation_mode):
+    G = twins[0]
+    state = start_incremental(G, 6.5, hydraulics=hydraulics, allocation_mode=allocation_mode)
+
+    for t in TIME_STEPS:
+        step = advance_step(state, t)
+        expected = simulate(G, 6.5, t, hydraulics=hydraulics, allocation_mode=allocation_mode)
+        assert step["metrics"] == expected["metrics"]
+        if allocation_mode == "max_flow":
+            _same_allocation(step["flows"]["allocation"], expected["allocation"])
+
+
+# ------------------------------------
+# PRECOMPUTED FRAMES VS SIMULATE
+# ------------------------------------
+@pytest.mark.parametrize("magnitude", [4.5, 6.5, 8.0])
+def test_frames_match_simulate(twins, magnitude):
+    G = twins[0]
+    timeline = precompute_frames(G, magnitude)
+
+    for t in TIME_STEPS:
+        frame = frame_state(timeline, G, t)
+        expected = simulate(G, magnitude, t)
+
+        assert frame["metrics"] == expected["metrics"]
+        assert frame["threshold"] == expected["threshold"]
+        assert frame["routes"] == expected["routes"]
+        assert frame["allocation"] == expected["allocation"]
+        assert _statuses(frame["G_after"]) == _statuses(expected["G_after"])
+
+        probs = [d.get("failure_prob") for _, _, d in frame["G_after"].edges(data=True)]
+        assert probs == [d.get("failure_prob") for _, _, d in expected["G_after"].edges(data=True)]
+
+
+# ------------------------------------
+# COMPACT VS NETWORKX
+# ------------------------------------
+@pytest.mark.parametrize("hydraulics", [False, True])
+@pytest.mark.parametrize("allocation_mode", ["proportional", "max_flow"])
+@pytest.mark.parametrize("time_step", [0, 5, 10])
+def test_compact_simulate_matches_networkx(twins, hydraulics, allocation_mode, time_step):
+    G, net = twins
+    a = simulate(G, 6.5, time_step, hydraulics=hydraulics, allocation_mode=allocation_mode)
+    b = simulate(net, 6.5, time_step, hydraulics=hydraulics, allocation_mode=allocation_mode)
+
+    assert a["metrics"] == b["metrics"]
+    assert a["threshold"] == b["threshold"]
+    assert a["routes"] == b["routes"]
+    _same_allocation(a["allocation"], b["allocation"])
+
+
+def test_compact_stepper_matches_networkx(twins):
+    G, net = twins
+    state_a, state_b = start_incremental(G, 6.5), start_incremental(net, 6.5)
+
+    for t in range(11):
+        a, b = advance_step(state_a, t), advance_step(state_b, t)
+        assert a["metrics"] == b["metrics"]
+        assert (a["lost"], a["gained"], a["routes"]) == (b["lost"], b["gained"], b["routes"])
+
+
+def test_compact_frames_match_networkx(twins):
+    G, net = twins
+    timeline_a, timeline_b = precompute_frames(G, 6.5), precompute_frames(net, 6.5)
+
+    for t in TIME_STEPS:
+        a, b = frame_state(timeline_a, G, t), frame_state(timeline_b, net, t)
+        assert a["metrics"] == b["metrics"]
+        assert a["routes"] == b["routes"]
+        _same_allocation(a["allocation"], b["allocation"])
+
+
+@pytest.fixture(scope="module")
+def fractional_twins(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("fractional")
+    nodes = pd.read_csv(NODES_PATH)
+    nodes["demand"] = nodes["demand"] + 0.5
+    nodes.to_csv(folder / "nodes.csv", index=False)
+    paths = (str(folder / "nodes.csv"), PIPES_PATH)
+    return create_digital_twin(*paths), create_compact_twin(*paths)
+
+
+def test_compact_matches_networkx_with_fractional_demand(fractional_twins):
+    G, net = fractional_twins
+    timeline_a, timeline_b = precompute_frames(G, 6.5), precompute_frames(net, 6.5)
+
+    for t in TIME_STEPS:
+        a, b = frame_state(timeline_a, G, t), frame_state(timeline_b, net, t)
+        _same_allocation(a["allocation"], b["allocation"])
+        _same_allocation(b["allocation"], simulate(net, 6.5, t)["allocation"])
+        assert np.isclose(sum(b["allocation"].values()), sum(a["allocation"].values()))
+
+
+def test_compact_twin_is_not_modified(twins):
+    _, net = twins
+    status = net["pipe"]["status"].copy()
+    simulate(net, 6.5, 5)
+    advance_step(start_incremental(net, 6.5), 5)
+    frame_state(precompute_frames(net, 6.5, time_steps=[0, 5]), net, 5)
+    assert np.array_equal(net["pipe"]["status"], status)
@@ -0,0 +1,39 @@
+import networkx as nx
+import numpy as np
+
+from models.spatial_index import epicenter_distances, pipe_index, pipes_within
+
+
+def _network():
+    # A winding line of short pipes plus one pipe crossing the whole area
+    G = nx.Graph()
+    rng = np.random.default_rng(3)
+    lat, lon = 23.0 + np.cumsum(rng.normal(0, 0.002, (2, 400)), axis=1)
+    for i in range(400):
+        G.add_node(i, lat=lat[i], lon=lon[i] + 54.0)
+    for i in range(399):
+        G.add_edge(i, i + 1)
+    G.add_node("far_a", lat=22.9, lon=76.9)
+    G.add_node("far_b", lat=23.3, lon=77.3)
+    G.add_edge("far_a", "far_b")
+    return G
+
+
+def test_within_matches_exact_distances():
+    G = _network()
+    epicenters = [(23.1, 77.1), (23.0, 77.2), (22.95, 76.95)]
+
+    for radius in (0.5, 2.0, 8.0):
+        found = pipes_within(G, epicenters, radius)
+        for (lat, lon), pipes in zip(epicenters, found):
+            exact = np.flatnonzero(epicenter_distances(G, (lat, lon)) <= radius)
+            assert np.array_equal(pipes, exact)
+
+
+def test_long_pipe_does_not_widen_queries():
+    G = _network()
+    index = pipe_index(G)
+
+    # The crossing pipe is ~40 km long; pieces stay near the short pipes' size
+    assert index["reach"] * 6371 < 1.0
+    assert (index["owner"] == index["owner"].max()).sum() > 10
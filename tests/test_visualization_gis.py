@@ -0,0 +1,35 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from visualization_gis import grid_cells, plot_gis_network
+
+
+def test_grid_cells_rejects_empty_budget():
+    with pytest.raises(ValueError):
+        grid_cells(np.zeros(3), np.zeros(3), 0.01, 0)
+
+
+def _failed_grid(n):
+    G = nx.Graph()
+    for i in range(n + 1):
+        G.add_node(i, lat=23.0 + i * 1e-4, lon=77.0, priority=1, demand=1)
+    for i in range(n):
+        G.add_edge(i, i + 1, status="failed", pipe_id=f"P{i}", failure_prob=0.9)
+    return G
+
+
+def _drawn_pipes(fig):
+    # Each pipe is a None-separated (start, end) pair in its line trace
+    return sum(len(t.lat) // 3 for t in fig.data if t.mode == "lines")
+
+
+def test_failed_pipes_drawn_in_full_within_budget():
+    fig = plot_gis_network(_failed_grid(50), lod=True, max_detail=100)
+    assert _drawn_pipes(fig) == 50
+
+
+def test_failed_pipes_decimated_beyond_budget():
+    fig = plot_gis_network(_failed_grid(500), lod=True, max_detail=20)
+    assert _drawn_pipes(fig) <= 20
+    assert any("failed pipes in this cell" in text for t in fig.data if t.mode == "markers" for text in t.text or ())
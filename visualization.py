@@ -1,15 +1,40 @@
+import numpy as np
 import plotly.graph_objects as go
 import networkx as nx
 
+from models.connectivity import get_sources
+
 # ==================================================
 # WATER NETWORK VISUALIZATION
 # ==================================================
-def plot_water_network(G, pos, title="Water Network"):
+# Pipe styles, one trace per status
+EDGE_STYLES = {
+    "failed": dict(color="red", width=4, dash="dot"),
+    "rerouted": dict(color="green", width=3, dash="dash"),
+    "healthy": dict(color="gray", width=1, dash="solid")
+}
+
+# Above this many pipes, traces switch to WebGL (Scattergl)
+WEBGL_EDGE_THRESHOLD = 2000
+
+
+def edge_style_key(d):
+    status = d.get("status")
+    return status if status in ("failed", "rerouted") else "healthy"
+
+
+def plot_water_network(G, pos, title="Water Network", use_webgl=None):
     fig = go.Figure()
 
+    if use_webgl is None:
+        use_webgl = G.number_of_edges() > WEBGL_EDGE_THRESHOLD
+    Scatter = go.Scattergl if use_webgl else go.Scatter
+
     # -------------------
-    # Draw Pipes (Edges) — SAFE
+    # Draw Pipes (Edges) — one None-separated trace per status
     # -------------------
+    groups = {key: ([], [], [], [], []) for key in EDGE_STYLES}
+
     for u, v, d in G.edges(data=True):
 
         # Skip edges if node positions missing
@@ -19,30 +44,38 @@ def plot_water_network(G, pos, title="Water Network"):
         x0, y0 = pos[u]
         x1, y1 = pos[v]
 
-        if d.get("status") == "failed":
-            color = "red"
-            width = 4
-            dash = "dot"
-        elif d.get("status") == "rerouted":
-            color = "green"
-            width = 3
-            dash = "dash"
-        else:
-            color = "gray"
-            width = 1
-            dash = "solid"
+        xs, ys, mid_x, mid_y, hover = groups[edge_style_key(d)]
+        xs.extend((x0, x1, None))
+        ys.extend((y0, y1, None))
+        mid_x.append((x0 + x1) / 2)
+        mid_y.append((y0 + y1) / 2)
+        hover.append(
+            f"Pipe ID: {d.get('pipe_id', 'N/A')}<br>"
+            f"Status: {d.get('status', 'unknown')}<br>"
+            f"Failure Prob: {round(d.get('failure_prob', 0), 2)}"
+        )
+
+    for key, (xs, ys, mid_x, mid_y, hover) in groups.items():
+        if not xs:
+            continue
 
-        fig.add_trace(go.Scatter(
-            x=[x0, x1],
-            y=[y0, y1],
+        fig.add_trace(Scatter(
+            x=xs,
+            y=ys,
             mode='lines',
-            line=dict(width=width, color=color, dash=dash),
+            line=EDGE_STYLES[key],
+            hoverinfo='skip',
+            showlegend=False
+        ))
+
+        # Hover data lives on (invisible) midpoint markers
+        fig.add_trace(Scatter(
+            x=mid_x,
+            y=mid_y,
+            mode='markers',
+            marker=dict(size=6, color=EDGE_STYLES[key]["color"], opacity=0),
             hoverinfo='text',
-            text=(
-                f"Pipe ID: {d.get('pipe_id', 'N/A')}<br>"
-                f"Status: {d.get('status', 'unknown')}<br>"
-                f"Failure Prob: {round(d.get('failure_prob', 0), 2)}"
-            ),
+            text=hover,
             showlegend=False
         ))
 
@@ -52,6 +85,7 @@ def plot_water_network(G, pos, title="Water Network"):
     node_x, node_y = [], []
     node_size, node_color = [], []
     node_labels, node_hover = [], []
+    sources = get_sources(G)
 
     for n, d in G.nodes(data=True):
 
@@ -63,10 +97,10 @@ def plot_water_network(G, pos, title="Water Network"):
         node_x.append(x)
         node_y.append(y)
 
-        if n == "N1":
+        if n in sources:
             node_size.append(50)
             node_color.append("blue")
-            label = "N1 (Source)"
+            label = f"{n} (Source)"
 
         elif d.get("priority", 0) >= 4:
             node_size.append(34)
@@ -90,7 +124,7 @@ def plot_water_network(G, pos, title="Water Network"):
     # -------------------
     # ADD NODES TRACE
     # -------------------
-    fig.add_trace(go.Scatter(
+    fig.add_trace(Scatter(
         x=node_x,
         y=node_y,
         mode='markers+text',
@@ -125,37 +159,127 @@ def plot_water_network(G, pos, title="Water Network"):
 # ==================================================
 # FAILURE PROBABILITY HEATMAP
 # ==================================================
-def plot_failure_heatmap(G):
-    pos = nx.spring_layout(G, seed=42)
+HEATMAP_BINS = 40
+
+# Fallback layouts for networks without lat/lon, one per network
+LAYOUT_CACHE_SIZE = 8
+_layout_cache = {}
+
+
+def network_layout(G):
+    """
+    Node positions for the heatmap: geographic (lon, lat) when every
+    node has coordinates, otherwise a spring layout computed once per
+    network (physical pipes only) and cached.
+    """
+    pos = {
+        n: (d["lon"], d["lat"])
+        for n, d in G.nodes(data=True)
+        if d.get("lon") is not None and d.get("lat") is not None
+    }
+    if len(pos) == G.number_of_nodes():
+        return pos
+
+    key = hash((
+        tuple(G.nodes),
+        tuple((u, v) for u, v, d in G.edges(data=True) if d.get("is_physical", True))
+    ))
+
+    if key not in _layout_cache:
+        if len(_layout_cache) >= LAYOUT_CACHE_SIZE:
+            _layout_cache.pop(next(iter(_layout_cache)))   # drop the oldest
+        _layout_cache[key] = nx.spring_layout(G, seed=42)
+
+    return _layout_cache[key]
+
+
+def plot_failure_heatmap(G, bins=HEATMAP_BINS):
+    """
+    Bins pipe midpoints into a grid weighted by failure_prob, so each
+    cell shows the expected number of failed pipes. O(E) per call.
+    """
+    pos = network_layout(G)
 
     x, y, prob = [], [], []
 
     for u, v, d in G.edges(data=True):
-        x.append(pos[u][0])
-        y.append(pos[u][1])
+        if u not in pos or v not in pos:
+            continue
+        x.append((pos[u][0] + pos[v][0]) / 2)
+        y.append((pos[u][1] + pos[v][1]) / 2)
         prob.append(d.get('failure_prob', 0))
 
-    fig = go.Figure(go.Scatter(
-        x=x,
-        y=y,
-        mode='markers',
-        marker=dict(
-            size=18,
-            color=prob,
-            colorscale='Hot',
-            showscale=True,
-            colorbar=dict(title="Failure Probability"),
-            opacity=0.85
-        ),
-        hoverinfo='text',
-        text=[f"P(failure)={round(p,2)}" for p in prob]
+    x, y, prob = np.array(x, dtype=float), np.array(y, dtype=float), np.array(prob, dtype=float)
+
+    if len(x):
+        expected, x_edges, y_edges = np.histogram2d(x, y, bins=bins, weights=prob)
+        counts, _, _ = np.histogram2d(x, y, bins=[x_edges, y_edges])
+    else:
+        expected = counts = np.zeros((bins, bins))
+        x_edges = y_edges = np.linspace(0, 1, bins + 1)
+
+    # Empty cells stay transparent
+    z = np.where(counts > 0, expected, np.nan).T
+
+    fig = go.Figure(go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2,
+        y=(y_edges[:-1] + y_edges[1:]) / 2,
+        z=z,
+        customdata=counts.T,
+        colorscale='Hot',
+        reversescale=True,
+        colorbar=dict(title="Expected Failures"),
+        hovertemplate=(
+            "Pipes: %{customdata:.0f}<br>"
+            "Expected failures: %{z:.2f}<extra></extra>"
+        )
     ))
 
     fig.update_layout(
         title="Pipe Failure Probability Heatmap",
         xaxis=dict(visible=False),
-        yaxis=dict(visible=False),
+        yaxis=dict(visible=False, scaleanchor="x"),
         plot_bgcolor='white'
     )
 
     return fig
+
+
+# ==================================================
+# FRAGILITY SURFACE
+# ==================================================
+FRAGILITY_LABELS = {
+    "critical_service_ratio": "Critical Nodes Served (%)",
+    "overall_service_ratio": "Nodes Served (%)",
+    "failed_pipes": "Failed Pipes",
+    "unserved_demand": "Unserved Demand"
+}
+
+
+def plot_fragility_surface(sweep, metric="critical_service_ratio"):
+    """
+    One sweep metric over the magnitude x time grid.
+    """
+    label = FRAGILITY_LABELS.get(metric, metric)
+
+    fig = go.Figure(go.Heatmap(
+        x=sweep["time_steps"],
+        y=sweep["magnitudes"],
+        z=sweep[metric],
+        colorscale='RdYlGn' if metric.endswith("service_ratio") else 'Hot',
+        reversescale=not metric.endswith("service_ratio"),
+        colorbar=dict(title=label),
+        hovertemplate=(
+            "Magnitude: %{y}<br>"
+            "Minute: %{x}<br>"
+            f"{label}: " "%{z:.2f}<extra></extra>"
+        )
+    ))
+
+    fig.update_layout(
+        title=f"Fragility Surface — {label}",
+        xaxis_title="Simulation Time (minutes)",
+        yaxis_title="Earthquake Magnitude"
+    )
+
+    return fig
@@ -1,14 +1,146 @@
+import numpy as np
 import plotly.graph_objects as go
 
-def plot_gis_network(G):
-    lats = []
-    lons = []
+# Pipe styles, one map trace per status
+GIS_EDGE_STYLES = {
+    "failed": dict(width=4, color="red"),
+    "rerouted": dict(width=4, color="green"),
+    "healthy": dict(width=4, color="blue")
+}
+
+# ----------------------
+# LEVEL OF DETAIL
+# ----------------------
+# Beyond LOD_MAX_DETAIL pipes, healthy pipes and residential nodes
+# outside the detail extent (by default the map viewport) are
+# decimated/aggregated into grid cells of roughly LOD_CELL_PIXELS on
+# screen. Failed and rerouted pipes outside it are drawn in full while
+# there are at most LOD_MAX_DETAIL of each, and are decimated the same
+# way beyond that, each kept pipe reporting how many it stands for.
+# Critical nodes are always drawn at full detail.
+LOD_MAX_DETAIL = 5000
+LOD_CELL_PIXELS = 24
+
+# Map size used to turn a zoom level into a viewport extent
+MAP_WIDTH_PIXELS = 1200
+MAP_HEIGHT_PIXELS = 450
+
+
+def lod_cell_size(zoom):
+    """
+    Grid cell size in degrees for a mapbox zoom level (256 px tiles).
+    """
+    return LOD_CELL_PIXELS * 360.0 / (256 * 2 ** zoom)
+
+
+def grid_cells(lat, lon, cell, max_cells):
+    """
+    Bins points into square cells, doubling the cell size until there
+    are at most max_cells occupied cells.
+    Returns (first index of each cell, cell id of each point).
+    """
+    if max_cells < 1:
+        raise ValueError("max_cells must be at least 1")
+    if cell <= 0:
+        raise ValueError("cell must be positive")
+
+    while True:
+        row = np.floor(lat / cell).astype(np.int64)
+        col = np.floor(lon / cell).astype(np.int64)
+        if len(col):
+            row -= row.min()
+            col -= col.min()
+        keys = row * (col.max(initial=0) + 1) + col
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        if len(first) <= max_cells:
+            return first, inverse
+        cell *= 2
+
+
+def network_center(G):
+    """
+    Mean (lat, lon) of the nodes with coordinates, or None.
+    """
+    coords = np.array([
+        (d["lat"], d["lon"]) for _, d in G.nodes(data=True)
+        if d.get("lat") is not None and d.get("lon") is not None
+    ], dtype=float)
+    if not len(coords):
+        return None
+    lat, lon = coords.mean(axis=0)
+    return float(lat), float(lon)
+
+
+def viewport_extent(center, zoom, width=MAP_WIDTH_PIXELS, height=MAP_HEIGHT_PIXELS):
+    """
+    (lat_min, lon_min, lat_max, lon_max) shown by a width x height map
+    at zoom around center = (lat, lon); None without a center.
+    """
+    if center is None:
+        return None
+    lat, lon = center
+    degrees_per_pixel = 360.0 / (256 * 2 ** zoom)
+    half_lon = width / 2 * degrees_per_pixel
+    half_lat = height / 2 * degrees_per_pixel * np.cos(np.radians(lat))
+    return (lat - half_lat, lon - half_lon, lat + half_lat, lon + half_lon)
+
+
+def in_extent(lat, lon, extent):
+    """
+    extent = (lat_min, lon_min, lat_max, lon_max); None means nowhere.
+    """
+    if extent is None:
+        return np.zeros(len(lat), dtype=bool)
+    lat_min, lon_min, lat_max, lon_max = extent
+    return (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+
+
+def _pipe_trace(lat0, lon0, lat1, lon1, hover, style):
+    n = len(lat0)
+
+    # None-separated segments in a single trace
+    lats = np.empty(3 * n, dtype=object)
+    lons = np.empty(3 * n, dtype=object)
+    lats[0::3], lats[1::3], lats[2::3] = lat0, lat1, None
+    lons[0::3], lons[1::3], lons[2::3] = lon0, lon1, None
+
+    return [
+        go.Scattermapbox(
+            lat=lats.tolist(),
+            lon=lons.tolist(),
+            mode="lines",
+            line=style,
+            hoverinfo="skip",
+            showlegend=False
+        ),
+        # Hover data on midpoint markers
+        go.Scattermapbox(
+            lat=((lat0 + lat1) / 2).tolist(),
+            lon=((lon0 + lon1) / 2).tolist(),
+            mode="markers",
+            marker=dict(size=6, color=style["color"], opacity=0),
+            hoverinfo="text",
+            text=hover,
+            showlegend=False
+        )
+    ]
+
+
+def plot_gis_network(G, zoom=14, extent=None, lod=None, max_detail=LOD_MAX_DETAIL, center=None):
+    """
+    zoom: map zoom level, also sets the LOD grid size.
+    extent: (lat_min, lon_min, lat_max, lon_max) drawn at full detail.
+    lod: force level-of-detail on/off; None enables it above max_detail pipes.
+    center: (lat, lon) of the map; None centers it on the network.
+    """
+    node_ids, lats, lons = [], [], []
 
     for n, d in G.nodes(data=True):
         lat = d.get("lat")
         lon = d.get("lon")
 
         if lat is not None and lon is not None:
+            node_ids.append(n)
             lats.append(lat)
             lons.append(lon)
 
@@ -16,52 +148,121 @@ def plot_gis_network(G):
     if len(lats) == 0:
         raise ValueError("No GIS coordinates found in graph nodes")
 
-    center_lat = sum(lats) / len(lats)
-    center_lon = sum(lons) / len(lons)
+    lats = np.array(lats, dtype=float)
+    lons = np.array(lons, dtype=float)
+
+    center_lat, center_lon = (lats.mean(), lons.mean()) if center is None else center
+
+    if lod is None:
+        lod = G.number_of_edges() > max_detail
+    cell = lod_cell_size(zoom)
 
     fig = go.Figure()
 
     # ----------------------
     # DRAW PIPES
     # ----------------------
+    coords = {n: (lat, lon) for n, lat, lon in zip(node_ids, lats.tolist(), lons.tolist())}
+    groups = {key: ([], [], [], [], []) for key in GIS_EDGE_STYLES}
+
     for u, v, d in G.edges(data=True):
-        if (
-            G.nodes[u].get("lat") is None or
-            G.nodes[u].get("lon") is None or
-            G.nodes[v].get("lat") is None or
-            G.nodes[v].get("lon") is None
-        ):
+        if u not in coords or v not in coords:
             continue
 
-        color = "red" if d.get("status") == "failed" else "blue"
+        status = d.get("status")
+        key = status if status in ("failed", "rerouted") else "healthy"
 
-        fig.add_trace(go.Scattermapbox(
-            lat=[G.nodes[u]["lat"], G.nodes[v]["lat"]],
-            lon=[G.nodes[u]["lon"], G.nodes[v]["lon"]],
-            mode="lines",
-            line=dict(width=4, color=color),
-            hoverinfo="text",
-            text=f"Failure Prob: {round(d.get('failure_prob', 0), 2)}"
-        ))
+        lat0s, lon0s, lat1s, lon1s, edge_data = groups[key]
+        lat0s.append(coords[u][0])
+        lon0s.append(coords[u][1])
+        lat1s.append(coords[v][0])
+        lon1s.append(coords[v][1])
+        edge_data.append(d)
+
+    for key, (lat0, lon0, lat1, lon1, edge_data) in groups.items():
+        if not lat0:
+            continue
+
+        lat0, lon0 = np.array(lat0), np.array(lon0)
+        lat1, lon1 = np.array(lat1), np.array(lon1)
+        represents = np.ones(len(lat0), dtype=np.int64)
+
+        mid_lat, mid_lon = (lat0 + lat1) / 2, (lon0 + lon1) / 2
+        detail = in_extent(mid_lat, mid_lon, extent)
+        far = np.flatnonzero(~detail)
+
+        if lod and (key == "healthy" or len(far) > max_detail):
+            # Keep one representative pipe per grid cell outside the extent
+            first, inverse = grid_cells(mid_lat[far], mid_lon[far], cell, max_detail)
+            represents[far[first]] = np.bincount(inverse)
+            keep = np.sort(np.concatenate([np.flatnonzero(detail), far[first]]))
+
+            lat0, lon0, lat1, lon1 = lat0[keep], lon0[keep], lat1[keep], lon1[keep]
+            edge_data = [edge_data[i] for i in keep.tolist()]
+            represents = represents[keep]
+
+        hover = [
+            (f"{c} {key} pipes in this cell<br>" if c > 1 else "") +
+            f"Pipe ID: {d.get('pipe_id', 'N/A')}<br>"
+            f"Status: {d.get('status') or 'unknown'}<br>"
+            f"Failure Prob: {round(d.get('failure_prob', 0), 2)}"
+            for d, c in zip(edge_data, represents.tolist())
+        ]
+
+        for trace in _pipe_trace(lat0, lon0, lat1, lon1, hover, GIS_EDGE_STYLES[key]):
+            fig.add_trace(trace)
 
     # ----------------------
     # DRAW NODES
     # ----------------------
+    data = [G.nodes[n] for n in node_ids]
+    critical = np.array([d.get("priority", 0) >= 4 for d in data], dtype=bool)
+    detail = critical | in_extent(lats, lons, extent) if lod else np.ones(len(lats), dtype=bool)
+    shown = np.flatnonzero(detail)
+
     fig.add_trace(go.Scattermapbox(
-        lat=lats,
-        lon=lons,
+        lat=lats[shown].tolist(),
+        lon=lons[shown].tolist(),
         mode="markers",
         marker=dict(size=10, color="red"),
-        hoverinfo="none"
+        hoverinfo="text",
+        text=[
+            f"Node: {node_ids[i]}<br>"
+            f"Type: {data[i].get('type')}<br>"
+            f"Priority: {data[i].get('priority')}<br>"
+            f"Demand: {data[i].get('demand')}"
+            for i in shown.tolist()
+        ],
+        showlegend=False
     ))
 
+    # Aggregated residential nodes: one marker per grid cell
+    far = np.flatnonzero(~detail)
+    if len(far):
+        _, inverse = grid_cells(lats[far], lons[far], cell, max_detail)
+        counts = np.bincount(inverse)
+        demand = np.array([data[i].get("demand", 0) or 0 for i in far.tolist()], dtype=float)
+
+        fig.add_trace(go.Scattermapbox(
+            lat=(np.bincount(inverse, lats[far]) / counts).tolist(),
+            lon=(np.bincount(inverse, lons[far]) / counts).tolist(),
+            mode="markers",
+            marker=dict(size=(8 + 4 * np.log2(counts)).tolist(), color="gray", opacity=0.6),
+            hoverinfo="text",
+            text=[
+                f"{c} nodes<br>Total Demand: {round(t, 1)}"
+                for c, t in zip(counts.tolist(), np.bincount(inverse, demand).tolist())
+            ],
+            showlegend=False
+        ))
+
     fig.update_layout(
         mapbox=dict(
             style="open-street-map",
             center=dict(lat=center_lat, lon=center_lon),
-            zoom=14
+            zoom=zoom
         ),
         margin=dict(l=0, r=0, t=0, b=0)
     )
 
-    return fig
\ No newline at end of file
+    return fig